@@ -6,6 +6,8 @@ from SSHProject.BasicTool.MeDIT.Normalize import NormalizeZ
 
 from scipy.stats import mannwhitneyu
 
+from DataSet.CaseManifest import CaseManifest
+
 
 def WritePSACSV():
     case_list, age_list, psa_list = [], [], []
@@ -47,7 +49,7 @@ def WriteCSV(feature_name, clinical_df, case_list, save_path=''):
         for case in case_list:
             case_name = case[:case.index('_slice')]
             # case_name = case
-            if case_name in [case for case in clinical_df.index]:
+            if case_name in clinical_df.index:
 
                 info = clinical_df.loc[case_name]
 
@@ -116,7 +118,7 @@ if __name__ == '__main__':
     # label_path = r'/home/zhangyihong/Documents/ProstateECE/SUH_Dwi1500/label.csv'
     # csv_path = r'/home/zhangyihong/Documents/ProstateECE/SUH_Dwi1500/FiveClinical.csv'
     feature_df = pd.read_csv(csv_path, index_col='case')
-    label_df = pd.read_csv(label_path, index_col='case')
+    manifest = CaseManifest(r'/home/zhangyihong/Documents/ProstateECE/manifest.db')
     # age_list = feature_df['age']
     # psa_list = feature_df['psa']
     # pGs_list = feature_df['pGs']
@@ -131,19 +133,16 @@ if __name__ == '__main__':
     b_NI_list = []
     label_list = []
 
-    for case in os.listdir(r'/home/zhangyihong/Documents/ProstateECE/NPYNoDivide/AdcSlice/Test'):
-        if case == 'Test' or case == 'DSR^dai shou rong_slice16.npy':
+    for case in manifest.GetKeyList(cohort='JSPH', split='Test'):
+        if case == 'DSR^dai shou rong_slice16':
             continue
         else:
-            # case = case[: case.index('_-_slice')]
-            case = case[: case.index('.npy')]
-
             age_list.append(feature_df.loc[case]['age'])
             psa_list.append(feature_df.loc[case]['psa'])
             bGs_list.append(feature_df.loc[case]['bGs'])
             core_list.append(feature_df.loc[case]['core'])
             b_NI_list.append(feature_df.loc[case]['b-NI'])
-            label_list.append(label_df.loc[case]['ece'])
+            label_list.append(manifest.GetLabel(case, 'JSPH'))
             # age_list.append(feature_df.loc[case]['age'])
             # psa_list.append(feature_df.loc[case]['PSA'])
             # pGs_list.append(feature_df.loc[case]['pGs'])
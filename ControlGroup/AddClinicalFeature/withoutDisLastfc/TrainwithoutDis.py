@@ -11,6 +11,8 @@ from SSHProject.CnnTools.T4T.Utility.Data import *
 from SSHProject.CnnTools.T4T.Utility.CallBacks import EarlyStopping
 from SSHProject.CnnTools.T4T.Utility.Initial import HeWeightInit
 
+from DataSet.CohortCache import CohortCache
+
 from AddClinicalFeature.withoutDisLastfc.ModelwithoutDis import ResNeXt
 
 model_root = r'/home/zhangyihong/Documents/ProstateECE/Model'
@@ -25,7 +27,12 @@ def ClearGraphPath(graph_path):
         os.mkdir(graph_path)
 
 
-def _GetLoader(sub_list, aug_param_config, input_shape, batch_size, shuffle):
+def _GetLoader(sub_list, aug_param_config, input_shape, batch_size, shuffle, cache=None):
+    if cache is not None:
+        return cache.GetLoader(sub_list, ['T2Slice', 'AdcSlice', 'DwiSlice'], 'Positive',
+                               input_shape, batch_size, shuffle, aug_param_config, roi_list=[],
+                               feature_list=['FiveClinicalbGS.csv'])
+
     data = DataManager(sub_list=sub_list, augment_param=aug_param_config)
 
     data.AddOne(Image2D(data_root + '/T2Slice', shape=input_shape))
@@ -39,7 +46,7 @@ def _GetLoader(sub_list, aug_param_config, input_shape, batch_size, shuffle):
     return loader, batches
 
 
-def EnsembleTrain():
+def EnsembleTrain(use_cache=False):
     torch.autograd.set_detect_anomaly(True)
 
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
@@ -64,12 +71,14 @@ def EnsembleTrain():
         ElasticTransform.name: ['elastic', 1, 0.1, 256]
     }
 
+    cache = CohortCache(data_root) if use_cache else None
+
     spliter = DataSpliter()
     cv_generator = spliter.SplitLabelCV(data_root + '/ece.csv', store_root=model_folder)
     for cv_index, (sub_train, sub_val) in enumerate(cv_generator):
         sub_model_folder = MakeFolder(model_folder / 'CV_{}'.format(cv_index))
-        train_loader, train_batches = _GetLoader(sub_train, param_config, input_shape, batch_size, True)
-        val_loader, val_batches = _GetLoader(sub_val, param_config, input_shape, batch_size, True)
+        train_loader, train_batches = _GetLoader(sub_train, param_config, input_shape, batch_size, True, cache)
+        val_loader, val_batches = _GetLoader(sub_val, param_config, input_shape, batch_size, True, cache)
 
         model = ResNeXt(3, 2).to(device)
         model.apply(HeWeightInit)
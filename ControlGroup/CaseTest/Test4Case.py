@@ -9,11 +9,15 @@ from BasicTool.MeDIT.SaveAndLoad import LoadImage
 from SYECE.model import ResNeXt
 # from SYECE.ModelWithoutDis import ResNeXt
 from ECEDataProcess.DataProcess.MaxRoi import GetRoiCenter
+from ECEDataProcess.DataProcess.SliceExtractor import ExtractSlices, RoiSlices, SliceCenters
 from DistanceMap.RoiDistanceMap import FindRegion, ExtractEdge
+from DistanceMap.VolumeDistanceMap import VolumeFindRegion
+from DataSet.PackedStore import SplitKey
+from DataSet.CaseManifest import CaseManifest
 
 
 
-def LoadData(data_folder):
+def LoadData(data_folder, return_spacing=False):
     # t2_path = os.path.join(data_folder, 't2.nii')
     # dwi_path = os.path.join(data_folder, 'dwi_Reg.nii')
     # adc_path = os.path.join(data_folder, 'adc_Reg.nii')
@@ -29,11 +33,15 @@ def LoadData(data_folder):
     _, t2, _ = LoadImage(t2_path, dtype=np.float32)
     _, dwi, _ = LoadImage(dwi_path, dtype=np.float32)
     _, adc, _ = LoadImage(adc_path, dtype=np.float32)
-    _, prostate, _ = LoadImage(prostate_path, dtype=np.float32)
+    prostate_image, prostate, _ = LoadImage(prostate_path, dtype=np.float32)
     _, pca, _ = LoadImage(pca_path, dtype=np.float32)
 
-    return t2.transpose((2, 0, 1)), dwi.transpose((2, 0, 1)), adc.transpose((2, 0, 1)), \
-           prostate.transpose((2, 0, 1)), pca.transpose((2, 0, 1))
+    data = (t2.transpose((2, 0, 1)), dwi.transpose((2, 0, 1)), adc.transpose((2, 0, 1)),
+            prostate.transpose((2, 0, 1)), pca.transpose((2, 0, 1)))
+    if return_spacing:
+        # (slice, row, column) 对应的 spacing
+        return data + (tuple(prostate_image.GetSpacing()[::-1]),)
+    return data
 
 
 def GetROISlice(roi_data):
@@ -77,35 +85,38 @@ def Process(data, slice, center, is_roi=False):
     return data_slice_crop
 
 
-def Run(case_folder):
-    input_list = []
-    t2, dwi, adc, prostate, pca = LoadData(case_folder)
+def Run(case_folder, attention_mode=None):
+    # (slices, 5, 192, 192): t2, adc, dwi, prostate, pca
+    # attention_mode='volume' / 'slice': 整个 volume 按 mm 算一次注意力图, 作为第 6 个通道, (slices, 6, 192, 192)
+    if attention_mode is None:
+        t2, dwi, adc, prostate, pca = LoadData(case_folder)
+    else:
+        t2, dwi, adc, prostate, pca, spacing = LoadData(case_folder, return_spacing=True)
 
-    slice_list_pca = GetROISlice(pca)
-    slice_list_pro = GetROISlice(prostate)
-    slice_list = [slice for slice in slice_list_pca if slice in slice_list_pro]
+    slice_list = RoiSlices(pca, prostate)
     # print(slice_list)
 
-    for slice in slice_list:
-        data_slice_list = []
-        center, _ = GetRoiCenter(pca[slice, ...])
-        data_slice_list.append(Process(t2, slice, center))
-        data_slice_list.append(Process(adc, slice, center))
-        data_slice_list.append(Process(dwi, slice, center))
-        data_slice_list.append(Process(prostate, slice, center, is_roi=True))
-        data_slice_list.append(Process(pca, slice, center, is_roi=True))
-        input_list.append(data_slice_list)
-
-    return input_list
-
-
-def ModelTest(data_folder, model_folder, case_name, weights_list=None):
-    # label_df = pd.read_csv(r'/home/zhangyihong/Documents/ProstateECE/NPYNoDivide/ece.csv', index_col='case')
-    label_df = pd.read_csv(r'/home/zhangyihong/Documents/ProstateECE/SUH_Dwi1500/label.csv', index_col='case')
+    center_list = SliceCenters(pca, slice_list)
+    volume_list, is_roi_list = [t2, adc, dwi, prostate, pca], [False, False, False, True, True]
+    if attention_mode is not None:
+        volume_list.append(VolumeFindRegion(prostate, pca, spacing, mode=attention_mode).astype(np.float32))
+        is_roi_list.append(True)
+    return ExtractSlices(volume_list, slice_list, center_list, crop_shape=(192, 192), is_roi_list=is_roi_list)
+
+
+def ModelTest(data_folder, model_folder, case_name, weights_list=None, manifest=None, cohort='SUH',
+              attention_mode=None):
+    # manifest: DataSet.CaseManifest, case 和 label 直接查库
+    # attention_mode: None 时逐层 FindRegion, 'volume' / 'slice' 时用 Run 里整个 volume 算好的注意力图
+    if manifest is None:
+        # label_df = pd.read_csv(r'/home/zhangyihong/Documents/ProstateECE/NPYNoDivide/ece.csv', index_col='case')
+        label_df = pd.read_csv(r'/home/zhangyihong/Documents/ProstateECE/SUH_Dwi1500/label.csv', index_col='case')
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 
     cv_folder_list = [one for one in IterateCase(model_folder, only_folder=True, verbose=0)]
     cv_pred_list, cv_label_list = [], []
+    # 每个 case 的层 (和注意力图) 只算一次, 所有 fold 共用
+    case_slice_dict = {}
     label_list, case_list = [], []
     for cv_index, cv_folder in enumerate(cv_folder_list):
         model = ResNeXt(3, 2).to(device)
@@ -123,19 +134,28 @@ def ModelTest(data_folder, model_folder, case_name, weights_list=None):
         all_case_pred_list = []
         model.eval()
         for case in case_name:
-            case_all_slice_list = Run(os.path.join(data_folder, case[: case.index('_-_slice')]))
+            one_case = SplitKey(case)[0]
+            if one_case not in case_slice_dict:
+                case_slice_dict[one_case] = Run(os.path.join(data_folder, one_case), attention_mode)
+            case_all_slice_list = case_slice_dict[one_case]
             # case_all_slice_list = Run(os.path.join(data_folder, case))
             all_slice_preds_list = []
 
             if cv_index == 0:
                 # label_list.append((label_df.loc[case])['ece'])
-                label_list.append((label_df.loc[case[: case.index('_-_slice')]])['label'])
-                case_list.append(case[: case.index('_-_slice')])
+                if manifest is None:
+                    label_list.append((label_df.loc[one_case])['label'])
+                else:
+                    label_list.append(manifest.GetLabel(one_case, cohort))
+                case_list.append(one_case)
 
             print('in cv {}, predict {}'.format(cv_index, case))
             # predict for each slice
             for case_one_slice_list in case_all_slice_list:
-                distance_map = FindRegion(case_one_slice_list[3], case_one_slice_list[4]) # attention map
+                if attention_mode is None:
+                    distance_map = FindRegion(case_one_slice_list[3], case_one_slice_list[4]) # attention map
+                else:
+                    distance_map = case_one_slice_list[5]
                 distance_map = np.where(distance_map >= 0.1, 1, 0).astype(np.float32) # binary attention map
 
                 # distance_map = ExtractEdge(np.squeeze(case_one_slice_list[3]), kernel=np.ones((7, 7))).astype(np.float32) # prostate boundary
@@ -246,9 +266,10 @@ if __name__ == '__main__':
 
 
     ##################################SUH#######################################################
-    SUH_list = sorted(os.listdir(r'/home/zhangyihong/Documents/ProstateECE/SUH_Dwi1500/AdcSlice'))
-    SUH_name = [name[:name.index('.npy')] for name in SUH_list]
-    case_list, mean_pred, label_list = ModelTest(data_root, model_root, SUH_name, weights_list=None)
+    manifest = CaseManifest(r'/home/zhangyihong/Documents/ProstateECE/manifest.db')
+    SUH_name = manifest.GetKeyList(cohort='SUH')
+    case_list, mean_pred, label_list = ModelTest(data_root, model_root, SUH_name, weights_list=None,
+                                                 manifest=manifest, cohort='SUH')
 
     for index, case in enumerate(case_list):
         save_path = os.path.join(r'/home/zhangyihong/Documents/ProstateECE/Result/CaseH5/BinaryAtten/SUH', case+'.h5')
@@ -0,0 +1,93 @@
+import time
+import numpy as np
+
+# 注意力图在 DataLoader 的 worker 里从增强以后的前列腺/PCa mask 现算, 不再预先存 DistanceMap/BinaryAttentionMap/...
+# 再当作 is_roi 的图像去做增强. 输入里的两个 mask 在增强以后换成一张注意力图:
+#     'blurry':   DistanceTransform.FindRegion, 和 DistanceMap 一样 (normalize=True 时和 DistanceMap0.2 一样)
+#     'binary':   FindRegion >= 0.1
+#     'pca':      PCa ROI 本身
+#     'boundary': 前列腺的边界, 和 RoiDistanceMap.ExtractEdge(kernel=np.ones((7, 7))) 一样
+# 和 Test4Case.ModelTest 里推理时的三种注意力图一致.
+# 形状都是 (1, H, W), float32.
+# mask 已经裁剪到 input_shape, 前列腺碰到裁剪边界时, 边界外面会被当作背景, 多出一条假的边界.
+# AttentionTransform 默认先把 mask 按边缘值向外延伸 pad 个像素再算, 再裁回原来的大小; 这只是近似,
+# 裁掉的部分如果和延伸的不一样 (比如前列腺就在边界外面结束), 结果仍然和在整张图上算的不同.
+
+attention_variants = ['blurry', 'binary', 'pca', 'boundary']
+
+
+def AttentionMap(prostate, pca, variant='blurry', step=10, normalize=False, metric='chessboard', pad=0):
+    '''
+    prostate / pca: (H, W) 或 (1, H, W), 增强以后的 mask (nearest 插值, 仍是 0/1).
+    pad: 先按边缘值向外延伸 pad 个像素再算, 返回时裁回 (H, W).
+    '''
+    from DistanceMap.DistanceTransform import FindRegion, ExtractEdge
+    prostate = (np.squeeze(np.asarray(prostate)) > 0.5).astype(float)
+    pca = (np.squeeze(np.asarray(pca)) > 0.5).astype(float)
+    if pad > 0:
+        attention = AttentionMap(np.pad(prostate, pad, mode='edge'), np.pad(pca, pad, mode='edge'), variant, step,
+                                 normalize, metric)
+        return attention[:, pad:-pad, pad:-pad]
+    if variant == 'blurry':
+        attention = FindRegion(prostate, pca, step=step, metric=metric)
+        if normalize:
+            attention = attention * 0.8 + 0.2
+    elif variant == 'binary':
+        attention = (FindRegion(prostate, pca, step=step, metric=metric) >= 0.1).astype(float)
+    elif variant == 'pca':
+        attention = pca
+    elif variant == 'boundary':
+        attention = ExtractEdge(prostate, width=6, metric=metric)
+    else:
+        raise ValueError('variant should be one of {}, got {}'.format(attention_variants, variant))
+    return attention[np.newaxis].astype(np.float32)
+
+
+class AttentionTransform(object):
+    '''
+    PackedDataManager(transform=...) 用: 先做原来的增强 (transform 可以是 None), 再把
+    input_list[prostate_index] 和 input_list[pca_index] 两个 mask 换成一张注意力图, 放在前列腺 mask 的位置.
+    pad: 见 AttentionMap, 默认 2 * step + 6, 大于注意力图能传到的距离, 裁剪边界不会影响里面的值.
+    '''
+    def __init__(self, transform=None, prostate_index=-2, pca_index=-1, variant='blurry', step=10, normalize=False,
+                 pad=None):
+        if variant not in attention_variants:
+            raise ValueError('variant should be one of {}, got {}'.format(attention_variants, variant))
+        self.transform = transform
+        self.prostate_index = prostate_index
+        self.pca_index = pca_index
+        self.variant = variant
+        self.step = step
+        self.normalize = normalize
+        self.pad = 2 * step + 6 if pad is None else pad
+
+    def __call__(self, data_list, is_roi_list):
+        if self.transform is not None:
+            data_list = self.transform(data_list, is_roi_list)
+        prostate_index = self.prostate_index % len(data_list)
+        pca_index = self.pca_index % len(data_list)
+
+        attention = AttentionMap(data_list[prostate_index], data_list[pca_index], self.variant, self.step,
+                                 self.normalize, pad=self.pad)
+        result = []
+        for index, one in enumerate(data_list):
+            if index == prostate_index:
+                result.append(attention)
+            elif index != pca_index:
+                result.append(one)
+        return result
+
+
+def CheckStored(store, key_list=None, variant='blurry', stored_modality='DistanceMap', normalize=False):
+    '''
+    不增强时现算的注意力图和存好的 (DistanceMap / DistanceMap0.2 ...) 比较, 返回最大的绝对误差和平均每张的时间.
+    store: PackedStore 或 CohortCache.
+    '''
+    key_list = store.GetKeyList() if key_list is None else key_list
+    error, start = 0., time.perf_counter()
+    for key in key_list:
+        attention = AttentionMap(store.GetOne('ProstateSlice', key), store.GetOne('RoiSlice', key), variant,
+                                 normalize=normalize)
+        stored = np.asarray(store.GetOne(stored_modality, key)).reshape(attention.shape)
+        error = max(error, float(np.abs(attention - stored).max()))
+    return error, (time.perf_counter() - start) / max(1, len(key_list))
@@ -0,0 +1,86 @@
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+# DataManager.Balance 是复制少数类的 index, epoch 变长, 同一张图要多解码几遍.
+# 这里用采样器做平衡: dataset 的 index 不变, 每个 epoch 按类别权重抽样, 长度默认就是样本数.
+
+
+def ClassWeight(labels, class_weight=None):
+    # 默认每一类的总概率相同
+    labels = np.asarray(labels).astype(int)
+    classes = np.unique(labels)
+    if class_weight is None:
+        class_weight = {one: 1. for one in classes}
+    class_weight = {one: float(class_weight[one]) for one in classes}
+    total = sum(class_weight.values())
+    return {one: class_weight[one] / total for one in classes}
+
+
+class WeightedBalanceSampler(Sampler):
+    '''
+    每个样本的概率 = 类别权重 / 该类样本数, 有放回地抽 num_samples 个.
+    num_samples 默认是样本数, 一个 epoch 的开销和不平衡时一样.
+    '''
+    def __init__(self, labels, class_weight=None, num_samples=None, generator=None):
+        labels = np.asarray(labels).astype(int)
+        class_weight = ClassWeight(labels, class_weight)
+        classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+        weights = np.array([class_weight[one] for one in classes])[inverse] / counts[inverse]
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.num_samples = len(labels) if num_samples is None else num_samples
+        self.generator = generator
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        index = torch.multinomial(self.weights, self.num_samples, replacement=True, generator=self.generator)
+        return iter(index.tolist())
+
+
+class StratifiedBatchSampler(Sampler):
+    '''
+    每个 batch 里每一类的个数按 class_weight 分 (默认各一半), 至少各一个, 保证每个 batch 都有 ECE 阳性和阴性.
+    每一类各自打乱后顺序取, 取完再打乱, 不生成复制后的 index 列表.
+    给 DataLoader(batch_sampler=...) 用.
+    '''
+    def __init__(self, labels, batch_size, class_weight=None, num_samples=None, generator=None):
+        labels = np.asarray(labels).astype(int)
+        self.class_index = {one: np.where(labels == one)[0] for one in np.unique(labels)}
+        if len(self.class_index) > batch_size:
+            raise ValueError('batch size {} is smaller than the class number {}'.format(
+                batch_size, len(self.class_index)))
+
+        class_weight = ClassWeight(labels, class_weight)
+        classes = sorted(self.class_index)
+        number = {one: max(1, int(round(batch_size * class_weight[one]))) for one in classes}
+        # 四舍五入以后凑回 batch_size, 多出/少了的算在最大的类上
+        largest = max(classes, key=lambda one: number[one])
+        number[largest] += batch_size - sum(number.values())
+        self.class_number = number
+
+        self.batch_size = batch_size
+        self.num_samples = len(labels) if num_samples is None else num_samples
+        self.generator = generator
+
+    def __len__(self):
+        return int(np.ceil(self.num_samples / self.batch_size))
+
+    def _Permutation(self, one):
+        order = torch.randperm(len(self.class_index[one]), generator=self.generator).numpy()
+        return self.class_index[one][order]
+
+    def __iter__(self):
+        order = {one: self._Permutation(one) for one in self.class_index}
+        position = {one: 0 for one in self.class_index}
+        for _ in range(len(self)):
+            batch = []
+            for one, number in self.class_number.items():
+                for _ in range(number):
+                    if position[one] == len(order[one]):
+                        order[one], position[one] = self._Permutation(one), 0
+                    batch.append(int(order[one][position[one]]))
+                    position[one] += 1
+            shuffle = torch.randperm(len(batch), generator=self.generator).tolist()
+            yield [batch[index] for index in shuffle]
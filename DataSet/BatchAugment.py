@@ -0,0 +1,254 @@
+import math
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from SSHProject.BasicTool.MeDIT.Augment import RotateTransform, ShiftTransform, ZoomTransform, FlipTransform, \
+    BiasTransform, NoiseTransform, ContrastTransform, GammaTransform, ElasticTransform
+
+# param_config 的 batch 版本: 在 torch 上对整个 batch 做增强, 可以放在 GPU 上.
+# Rotate/Shift/Zoom/Flip (+Elastic) 合成一个采样网格, 所有图像一次 grid_sample,
+# 图像 (T2/ADC/DWI/DistanceMap) 用 bilinear, ROI 用 nearest; Bias/Noise/Contrast/Gamma 只作用在非 ROI 上.
+
+
+def _Sample(param, batch, device, dims=1):
+    # param: ['uniform', low, high(, dims)] / ['choice', a, b, ...]
+    if param[0] == 'uniform':
+        if len(param) > 3:
+            dims = param[3]
+        return torch.empty((batch, dims), device=device).uniform_(param[1], param[2]).squeeze(-1)
+    elif param[0] == 'choice':
+        choice = torch.tensor([float(one) for one in param[1:]], device=device)
+        return choice[torch.randint(len(choice), (batch,), device=device)]
+    raise ValueError('unknown param type: {}'.format(param[0]))
+
+
+def _GaussianKernel(sigma, device):
+    radius = max(1, int(3 * sigma))
+    x = torch.arange(-radius, radius + 1, dtype=torch.float32, device=device)
+    kernel = torch.exp(-x ** 2 / (2 * sigma ** 2))
+    return kernel / kernel.sum()
+
+
+def GaussianSmooth2D(data, sigma):
+    # data: (batch, channel, H, W), 可分离卷积
+    kernel = _GaussianKernel(sigma, data.device)
+    channel, size = data.shape[1], kernel.numel()
+    data = F.conv2d(F.pad(data, (size // 2, size // 2, 0, 0), mode='reflect'),
+                    kernel.view(1, 1, 1, -1).repeat(channel, 1, 1, 1), groups=channel)
+    data = F.conv2d(F.pad(data, (0, 0, size // 2, size // 2), mode='reflect'),
+                    kernel.view(1, 1, -1, 1).repeat(channel, 1, 1, 1), groups=channel)
+    return data
+
+
+class BatchAugment(object):
+    '''
+    augmentor = BatchAugment(param_config)
+    inputs = augmentor.Execute(inputs, is_roi_list=[False, False, False, True])
+    inputs 是 DataLoader 出来的 list, 每个 (batch, channel, H, W).
+    ElasticTransform: ['elastic', 概率, sigma (相对图像边长), alpha (像素)].
+    elastic_bank_size > 0 时, 位移场从预先算好的 ElasticBank 里取, 不再每个 batch 重新生成.
+    '''
+    def __init__(self, param_config, elastic_bank_size=0, memory_budget=256):
+        self.param_config = {} if param_config is None else param_config
+        self.elastic_bank_size = elastic_bank_size
+        self.memory_budget = memory_budget
+        self._elastic_bank = None
+
+    def _Get(self, transform):
+        return self.param_config.get(transform.name, None)
+
+    def _Affine(self, batch, device):
+        theta = torch.zeros((batch, 2, 3), device=device)
+        theta[:, 0, 0] = 1.
+        theta[:, 1, 1] = 1.
+
+        rotate = self._Get(RotateTransform)
+        if rotate is not None:
+            angle = _Sample(rotate['theta'], batch, device) * math.pi / 180.
+            cos, sin = torch.cos(angle), torch.sin(angle)
+            theta[:, 0, 0], theta[:, 0, 1] = cos, -sin
+            theta[:, 1, 0], theta[:, 1, 1] = sin, cos
+
+        zoom = self._Get(ZoomTransform)
+        if zoom is not None:
+            theta[:, :, 0] /= _Sample(zoom['horizontal_zoom'], batch, device).unsqueeze(-1)
+            theta[:, :, 1] /= _Sample(zoom['vertical_zoom'], batch, device).unsqueeze(-1)
+
+        flip = self._Get(FlipTransform)
+        if flip is not None and 'horizontal_flip' in flip:
+            is_flip = _Sample(flip['horizontal_flip'], batch, device)
+            theta[:, :, 0] *= 1. - 2. * is_flip.unsqueeze(-1)
+        if flip is not None and 'vertical_flip' in flip:
+            is_flip = _Sample(flip['vertical_flip'], batch, device)
+            theta[:, :, 1] *= 1. - 2. * is_flip.unsqueeze(-1)
+
+        shift = self._Get(ShiftTransform)
+        if shift is not None:
+            # 归一化坐标是 [-1, 1], 平移比例乘 2
+            theta[:, 0, 2] = -2. * _Sample(shift['horizontal_shift'], batch, device)
+            theta[:, 1, 2] = -2. * _Sample(shift['vertical_shift'], batch, device)
+        return theta
+
+    def _ElasticDisplacement(self, batch, shape, device):
+        elastic = self._Get(ElasticTransform)
+        if elastic is None:
+            return None
+        _, prob, sigma, alpha = elastic
+        if self.elastic_bank_size > 0:
+            if self._elastic_bank is None or self._elastic_bank.shape != tuple(shape):
+                from DataSet.ElasticBank import ElasticBank
+                self._elastic_bank = ElasticBank(sigma, alpha, shape, self.elastic_bank_size, self.memory_budget,
+                                                 device=device)
+            displacement = self._elastic_bank.Sample(batch, device)
+        else:
+            noise = torch.rand((batch, 2) + tuple(shape), device=device) * 2. - 1.
+            displacement = GaussianSmooth2D(noise, sigma * max(shape)) * alpha
+        displacement *= (torch.rand((batch, 1, 1, 1), device=device) < prob).float()
+        # 像素 -> 归一化坐标, (batch, H, W, 2)
+        scale = torch.tensor([2. / shape[1], 2. / shape[0]], device=device)
+        return displacement.permute(0, 2, 3, 1) * scale
+
+    def Grid(self, batch, shape, device):
+        grid = F.affine_grid(self._Affine(batch, device), [batch, 1] + list(shape), align_corners=False)
+        displacement = self._ElasticDisplacement(batch, shape, device)
+        if displacement is not None:
+            grid = grid + displacement
+        return grid
+
+    def _Intensity(self, image_list):
+        batch, device = image_list[0].shape[0], image_list[0].device
+        shape = image_list[0].shape[-2:]
+
+        bias = self._Get(BiasTransform)
+        if bias is not None:
+            center = _Sample(bias['center'], batch, device).view(batch, 2, 1, 1)
+            drop_ratio = _Sample(bias['drop_ratio'], batch, device).view(batch, 1, 1)
+            y, x = torch.meshgrid(torch.linspace(-1., 1., shape[0], device=device),
+                                  torch.linspace(-1., 1., shape[1], device=device), indexing='ij')
+            distance = (x - center[:, 0]) ** 2 + (y - center[:, 1]) ** 2
+            field = (1. - drop_ratio * distance / distance.flatten(1).max(dim=1)[0].view(batch, 1, 1)).unsqueeze(1)
+            image_list = [image * field for image in image_list]
+
+        noise = self._Get(NoiseTransform)
+        if noise is not None:
+            sigma = _Sample(noise['noise_sigma'], batch, device).view(batch, 1, 1, 1)
+            image_list = [image + torch.randn_like(image) * sigma * image.flatten(1).std(dim=1).view(batch, 1, 1, 1)
+                          for image in image_list]
+
+        contrast = self._Get(ContrastTransform)
+        if contrast is not None:
+            factor = _Sample(contrast['factor'], batch, device).view(batch, 1, 1, 1)
+            image_list = [(image - image.mean(dim=(1, 2, 3), keepdim=True)) * factor +
+                          image.mean(dim=(1, 2, 3), keepdim=True) for image in image_list]
+
+        gamma = self._Get(GammaTransform)
+        if gamma is not None:
+            gamma = _Sample(gamma['gamma'], batch, device).view(batch, 1, 1, 1)
+            new_list = []
+            for image in image_list:
+                min_value = image.flatten(1).min(dim=1)[0].view(batch, 1, 1, 1)
+                max_value = image.flatten(1).max(dim=1)[0].view(batch, 1, 1, 1)
+                value_range = (max_value - min_value).clamp(min=1e-6)
+                new_list.append(((image - min_value) / value_range) ** gamma * value_range + min_value)
+            image_list = new_list
+        return image_list
+
+    def Execute(self, data_list, is_roi_list, mode_list=None):
+        if not self.param_config:
+            return data_list
+        if mode_list is None:
+            mode_list = ['nearest' if is_roi else 'bilinear' for is_roi in is_roi_list]
+
+        batch, shape = data_list[0].shape[0], data_list[0].shape[-2:]
+        device = data_list[0].device
+        grid = self.Grid(batch, shape, device)
+
+        # 同一种插值的放在 channel 上拼起来, 一次 grid_sample
+        result = list(data_list)
+        for mode in set(mode_list):
+            index_list = [index for index, one in enumerate(mode_list) if one == mode]
+            stacked = torch.cat([data_list[index].float() for index in index_list], dim=1)
+            warped = F.grid_sample(stacked, grid, mode=mode, padding_mode='zeros', align_corners=False)
+            warped = torch.split(warped, [data_list[index].shape[1] for index in index_list], dim=1)
+            for index, one in zip(index_list, warped):
+                result[index] = one
+
+        image_index = [index for index, is_roi in enumerate(is_roi_list) if not is_roi]
+        if len(image_index) > 0:
+            image_list = self._Intensity([result[index] for index in image_index])
+            for index, one in zip(image_index, image_list):
+                result[index] = one
+        return result
+
+    def __call__(self, data_list, is_roi_list, mode_list=None):
+        return self.Execute(data_list, is_roi_list, mode_list)
+
+
+class SampleAugment(object):
+    '''
+    单个样本的版本, 给 PackedDataManager(transform=...) 用, 在 DataLoader 的 worker 里跑.
+    输入是 numpy (channel, H, W), 不是图像的 (临床特征等) 原样返回.
+    '''
+    def __init__(self, param_config, mode_list=None):
+        self.augmentor = BatchAugment(param_config)
+        self.mode_list = mode_list
+
+    def __call__(self, data_list, is_roi_list):
+        image_index = [index for index, one in enumerate(data_list) if np.ndim(one) == 3]
+        if len(image_index) == 0:
+            return data_list
+        mode_list = None if self.mode_list is None else [self.mode_list[index] for index in image_index]
+        with torch.no_grad():
+            augmented = self.augmentor([torch.from_numpy(np.asarray(data_list[index], dtype=np.float32))[None]
+                                        for index in image_index],
+                                       [is_roi_list[index] for index in image_index], mode_list)
+        result = list(data_list)
+        for index, one in zip(image_index, augmented):
+            result[index] = one[0].numpy()
+        return result
+
+
+def Benchmark(data_root, param_config, sub_list=None, input_shape=(192, 192), batch_size=24, repeat=3):
+    # 当前 DataManager 逐样本增强 vs. 不增强的 DataManager + BatchAugment
+    from SSHProject.CnnTools.T4T.Utility.Data import DataManager, Image2D, Label
+    from DataSet.LoaderFactory import MakeLoader
+
+    def _Loader(augment_param):
+        data = DataManager(sub_list=sub_list, augment_param=augment_param)
+        data.AddOne(Image2D(data_root + '/T2Slice', shape=input_shape))
+        data.AddOne(Image2D(data_root + '/AdcSlice', shape=input_shape))
+        data.AddOne(Image2D(data_root + '/DwiSlice', shape=input_shape))
+        data.AddOne(Image2D(data_root + '/DistanceMap', shape=input_shape, is_roi=True))
+        data.AddOne(Label(data_root + '/label.csv', label_tag='Positive'), is_input=False)
+        return MakeLoader(data, batch_size=batch_size, shuffle=False, num_workers=0)
+
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    augmentor = BatchAugment(param_config)
+    is_roi_list = [False, False, False, True]
+    mode_list = ['bilinear', 'bilinear', 'bilinear', 'bilinear']
+
+    per_sample_loader, batch_loader = _Loader(param_config), _Loader(None)
+    per_sample_time, batch_time = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for inputs, outputs in per_sample_loader:
+            inputs = [one.to(device) for one in inputs]
+        per_sample_time.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for inputs, outputs in batch_loader:
+            inputs = augmentor([one.to(device) for one in inputs], is_roi_list, mode_list)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        batch_time.append(time.perf_counter() - start)
+
+    print('per-sample: {:.3f}s / epoch, batched: {:.3f}s / epoch, speed up {:.1f}x'.format(
+        min(per_sample_time), min(batch_time), min(per_sample_time) / min(batch_time)))
+    return min(per_sample_time), min(batch_time)
+
+
+if __name__ == '__main__':
+    from SYECE.EnhancedPred import param_config
+    Benchmark(r'/home/zhangyihong/Documents/ProstateECE/NPYNoDivide', param_config)
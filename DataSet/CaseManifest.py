@@ -0,0 +1,253 @@
+import os
+import sqlite3
+import pandas as pd
+
+from DataSet.PackedStore import SplitKey
+
+# 所有数据的索引: case, slice, split, cohort (JSPH/SUH), ece, PSA, age, 文件位置.
+# 存在 sqlite 里, case/key 上有索引, 脚本里不用再 os.listdir + 切 '_slice' + pd.read_csv().loc[case].
+# 增量建库: 每个目录记录 mtime, 没变的目录不再扫描.
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS slice (
+    key TEXT PRIMARY KEY, case_name TEXT, slice INTEGER, split TEXT, cohort TEXT,
+    data_root TEXT, path TEXT, packed_row INTEGER);
+CREATE INDEX IF NOT EXISTS slice_case ON slice (case_name);
+CREATE INDEX IF NOT EXISTS slice_cohort_split ON slice (cohort, split);
+CREATE TABLE IF NOT EXISTS case_info (
+    case_name TEXT, cohort TEXT, ece INTEGER, psa REAL, age REAL, PRIMARY KEY (case_name, cohort));
+CREATE TABLE IF NOT EXISTS source (folder TEXT PRIMARY KEY, mtime REAL);
+CREATE TABLE IF NOT EXISTS b_value (
+    case_name TEXT, b TEXT, file TEXT, volume INTEGER, source TEXT, folder TEXT);
+CREATE INDEX IF NOT EXISTS b_value_case ON b_value (case_name);
+'''
+
+
+def _ToFloat(value):
+    # PSA 里有 '>100' 这样的
+    if isinstance(value, str):
+        value = value.strip().lstrip('>＞')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _Column(df, name):
+    for column in df.columns:
+        if column.lower() == name.lower():
+            return df[column]
+    return None
+
+
+class CaseManifest(object):
+    '''
+    manifest = CaseManifest(r'/home/zhangyihong/Documents/ProstateECE/manifest.db')
+    manifest.Update('JSPH', NPYNoDivide, label_csv=NPYNoDivide + '/ece.csv', clinical_csv=...)
+    manifest.GetKeyList(cohort='JSPH', split='Test')
+    manifest.GetLabel('CHEN REN')
+    '''
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connect = sqlite3.connect(db_path)
+        self.connect.executescript(_schema)
+
+    def Close(self):
+        self.connect.close()
+
+    def _FolderChanged(self, folder):
+        mtime = os.stat(folder).st_mtime
+        row = self.connect.execute('SELECT mtime FROM source WHERE folder = ?', (folder,)).fetchone()
+        return row is None or row[0] != mtime, mtime
+
+    def Update(self, cohort, data_root, label_csv=None, clinical_csv=None, modality='AdcSlice',
+               split_folder=None, label_column=None, encoding='gbk'):
+        '''
+        modality: 用哪个模态的目录列出样本, 所有模态的文件名是一样的.
+        split_folder: split -> 模态下的子目录, 默认 {'Train': '', 'Test': 'Test'}.
+        '''
+        if split_folder is None:
+            split_folder = {'Train': '', 'Test': 'Test'}
+
+        packed_row = {}
+        packed_index = os.path.join(data_root, 'Packed', 'index.csv')
+        if os.path.exists(packed_index):
+            packed_df = pd.read_csv(packed_index, dtype={'key': str})
+            packed_row = dict(zip(packed_df['key'], packed_df['row']))
+
+        update_number = 0
+        for split, sub_folder in split_folder.items():
+            folder = os.path.join(data_root, modality, sub_folder)
+            if not os.path.isdir(folder):
+                continue
+            is_changed, mtime = self._FolderChanged(folder)
+            if not is_changed:
+                continue
+            # 目录变了就整个 split 重写, 删掉的文件也会从库里去掉
+            self.connect.execute('DELETE FROM slice WHERE cohort = ? AND split = ?', (cohort, split))
+            rows = []
+            for file in os.listdir(folder):
+                if not file.endswith('.npy'):
+                    continue
+                key = file[:-len('.npy')]
+                case, slice = SplitKey(key)
+                rows.append((key, case, slice, split, cohort, data_root, os.path.join(sub_folder, file),
+                             packed_row.get(key, None)))
+            self.connect.executemany('INSERT OR REPLACE INTO slice VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connect.execute('INSERT OR REPLACE INTO source VALUES (?, ?)', (folder, mtime))
+            update_number += len(rows)
+
+        for csv_path in [label_csv, clinical_csv]:
+            if csv_path is None:
+                continue
+            is_changed, mtime = self._FolderChanged(csv_path)
+            if is_changed:
+                self._UpdateCaseInfo(cohort, label_csv, clinical_csv, label_column, encoding)
+                for one in [label_csv, clinical_csv]:
+                    if one is not None:
+                        self.connect.execute('INSERT OR REPLACE INTO source VALUES (?, ?)',
+                                             (one, os.stat(one).st_mtime))
+                break
+
+        self.connect.commit()
+        print('{}: {} slices updated'.format(cohort, update_number))
+
+    def _UpdateCaseInfo(self, cohort, label_csv, clinical_csv, label_column, encoding):
+        info = {}
+        if label_csv is not None:
+            label_df = pd.read_csv(label_csv, index_col=0)
+            if label_column is None:
+                label_column = 'ece' if 'ece' in label_df.columns else label_df.columns[0]
+            for index, label in label_df[label_column].items():
+                case, _ = SplitKey(str(index))
+                info.setdefault(case, {})['ece'] = None if pd.isna(label) else int(label)
+        if clinical_csv is not None:
+            clinical_df = pd.read_csv(clinical_csv, index_col='case', encoding=encoding)
+            psa, age = _Column(clinical_df, 'psa'), _Column(clinical_df, 'age')
+            for index in clinical_df.index:
+                case, _ = SplitKey(str(index))
+                one = info.setdefault(case, {})
+                one['psa'] = None if psa is None else _ToFloat(psa[index])
+                one['age'] = None if age is None else _ToFloat(age[index])
+
+        self.connect.executemany(
+            'INSERT OR REPLACE INTO case_info VALUES (?, ?, ?, ?, ?)',
+            [(case, cohort, one.get('ece', None), one.get('psa', None), one.get('age', None))
+             for case, one in info.items()])
+
+    def UpdateBValue(self, process_folder):
+        '''
+        process_folder 下每个 case 的 b 值/文件/volume 写进 b_value 表, 见 ECEDataProcess.DataProcess.BValueIndex.
+        case 目录的 mtime 没变就不再读 bval.
+        '''
+        from ECEDataProcess.DataProcess.BValueIndex import CaseBValues
+        update_number = 0
+        for case in sorted(os.listdir(process_folder)):
+            case_folder = os.path.join(process_folder, case)
+            if not os.path.isdir(case_folder):
+                continue
+            is_changed, mtime = self._FolderChanged(case_folder)
+            if not is_changed:
+                continue
+            self.connect.execute('DELETE FROM b_value WHERE folder = ?', (case_folder,))
+            self.connect.executemany('INSERT INTO b_value VALUES (?, ?, ?, ?, ?, ?)',
+                                     [(case, one['b'], one['file'], one['volume'], one['source'], case_folder)
+                                      for one in CaseBValues(case_folder)])
+            self.connect.execute('INSERT OR REPLACE INTO source VALUES (?, ?)', (case_folder, mtime))
+            update_number += 1
+        self.connect.commit()
+        print('{}: b value of {} cases updated'.format(process_folder, update_number))
+
+    def GetBValue(self, case, process_folder=None):
+        '''
+        和 BValueIndex.CaseBValues 的返回一样, 多一个 folder.
+        process_folder: UpdateBValue 时的目录, 只取这个目录下的 case; 不给时同名的 case 只能在一个目录里, 否则报错.
+        '''
+        case, _ = SplitKey(case)
+        if process_folder is None:
+            rows = self.connect.execute('SELECT b, file, volume, source, folder FROM b_value WHERE case_name = ? '
+                                        'ORDER BY rowid', (case,)).fetchall()
+        else:
+            rows = self.connect.execute('SELECT b, file, volume, source, folder FROM b_value WHERE case_name = ? '
+                                        'AND folder = ? ORDER BY rowid',
+                                        (case, os.path.join(process_folder, case))).fetchall()
+        folder_list = sorted(set(row[4] for row in rows))
+        if len(folder_list) > 1:
+            raise ValueError('{} is in {} process folders, give process_folder: {}'.format(
+                case, len(folder_list), folder_list))
+        return [dict(zip(['b', 'file', 'volume', 'source', 'folder'], row)) for row in rows]
+
+    def SelectDwi(self, case, target=1500, b_value=None, process_folder=None):
+        # 返回选中的记录, 用 BValueIndex.ReadDwiVolume(entry['folder'], entry) 只读这一个 volume
+        from ECEDataProcess.DataProcess.BValueIndex import SelectB
+        return SelectB(self.GetBValue(case, process_folder), target, b_value)
+
+    def _Where(self, cohort, split, case, prefix=''):
+        condition, value = [], []
+        for name, one in [('cohort', cohort), ('split', split), ('case_name', case)]:
+            if one is not None:
+                condition.append('{}{} = ?'.format(prefix, name))
+                value.append(one)
+        return (' WHERE ' + ' AND '.join(condition)) if condition else '', value
+
+    def GetKeyList(self, cohort=None, split=None, case=None):
+        where, value = self._Where(cohort, split, case)
+        return [one[0] for one in self.connect.execute('SELECT key FROM slice' + where + ' ORDER BY key', value)]
+
+    def GetCaseList(self, cohort=None, split=None):
+        where, value = self._Where(cohort, split, None)
+        return [one[0] for one in self.connect.execute(
+            'SELECT DISTINCT case_name FROM slice' + where + ' ORDER BY case_name', value)]
+
+    def GetPackedRow(self, cohort=None, split=None):
+        # {key: Update 时 data_root/Packed/index.csv 里的 row}, 没打包的是 None
+        where, value = self._Where(cohort, split, None)
+        return dict(self.connect.execute('SELECT key, packed_row FROM slice' + where, value).fetchall())
+
+    def GetLabelDict(self, cohort=None, split=None):
+        # {key: ece}, 一次查出来给 DataLoader 用, worker 里不用再连 sqlite
+        where, value = self._Where(cohort, split, None, prefix='s.')
+        return dict(self.connect.execute('SELECT s.key, c.ece FROM slice s LEFT JOIN case_info c '
+                                         'ON s.case_name = c.case_name AND s.cohort = c.cohort' + where,
+                                         value).fetchall())
+
+    def GetSlice(self, key):
+        row = self.connect.execute('SELECT * FROM slice WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return dict(zip(['key', 'case', 'slice', 'split', 'cohort', 'data_root', 'path', 'packed_row'], row))
+
+    def GetPath(self, key, modality):
+        one = self.GetSlice(key)
+        return os.path.join(one['data_root'], modality, one['path'])
+
+    def GetCaseInfo(self, case, cohort=None):
+        case, _ = SplitKey(case)
+        if cohort is None:
+            row = self.connect.execute('SELECT * FROM case_info WHERE case_name = ?', (case,)).fetchone()
+        else:
+            row = self.connect.execute('SELECT * FROM case_info WHERE case_name = ? AND cohort = ?',
+                                       (case, cohort)).fetchone()
+        if row is None:
+            raise KeyError(case)
+        return dict(zip(['case', 'cohort', 'ece', 'psa', 'age'], row))
+
+    def GetLabel(self, case, cohort=None):
+        # case 或者 key 都可以
+        return self.GetCaseInfo(case, cohort)['ece']
+
+    def ToDataFrame(self):
+        return pd.read_sql_query('SELECT s.*, c.ece, c.psa, c.age FROM slice s LEFT JOIN case_info c '
+                                 'ON s.case_name = c.case_name AND s.cohort = c.cohort', self.connect)
+
+
+if __name__ == '__main__':
+    root = r'/home/zhangyihong/Documents/ProstateECE'
+    manifest = CaseManifest(root + '/manifest.db')
+    manifest.Update('JSPH', root + '/NPYNoDivide', label_csv=root + '/NPYNoDivide/ece.csv',
+                    clinical_csv=root + '/NPYNoDivide/test_clinical.csv')
+    manifest.Update('SUH', root + '/SUH_Dwi1500', label_csv=root + '/SUH_Dwi1500/label.csv',
+                    clinical_csv=root + '/SUH_Dwi1500/suh_clinical_supplement.csv', split_folder={'External': ''},
+                    label_column='label')
+    print(manifest.ToDataFrame().groupby(['cohort', 'split']).size())
+    # manifest.UpdateBValue(r'X:\PrcoessedData\ProstateCancerECE')
@@ -0,0 +1,162 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from DataSet.PackedStore import PackedDataManager, PackedImage2D, PackedLabel
+from DataSet.LoaderFactory import MakeLoader
+
+# 交叉验证时每个 fold 都新建 DataManager, 五折要把整个数据集从硬盘读十遍.
+# CohortCache 把 data_root 下的数据读一次, 每个 fold 只是同一份数组上的 sub_list.
+# 接口和 PackedStore 一样 (GetOne/GetLabel/__contains__), 可以直接给 PackedDataManager 用.
+
+
+class CohortCache(object):
+    '''
+    cache = CohortCache(data_root, max_memory=4096)
+    cache.Preload(['T2Slice', 'AdcSlice', 'DwiSlice', 'DistanceMap'])
+    train_loader, train_batches = cache.GetLoader(sub_train, ['T2Slice', 'AdcSlice', 'DwiSlice'], 'Positive', ...)
+
+    max_memory: MB, 超过以后按 LRU 丢掉最久没用的.
+    DataLoader 用多进程时, 数据要在建 loader 之前读进主进程, worker fork 出来以后共享这一份 (copy-on-write),
+    GetLoader 里会先 Preload 这个 sub_list.
+    '''
+    def __init__(self, data_root, max_memory=4096, sub_folder_list=None, label_csv='label.csv'):
+        self.data_root = data_root
+        self.max_memory = max_memory * 1024 * 1024
+        self.sub_folder_list = ['', 'Test'] if sub_folder_list is None else sub_folder_list
+        self.label_csv = label_csv
+
+        self._cache = OrderedDict()
+        self._memory = 0
+        self._folder = {}
+        self._table = {}
+        self.hit, self.miss = 0, 0
+
+    def __contains__(self, key):
+        return key in self.Table(self.label_csv).index
+
+    def _KeyFolder(self, modality):
+        # key -> 所在的子目录, 每个模态只 listdir 一次
+        if modality not in self._folder:
+            key_folder = {}
+            for sub_folder in self.sub_folder_list:
+                folder = os.path.join(self.data_root, modality, sub_folder)
+                if not os.path.isdir(folder):
+                    continue
+                for one in os.listdir(folder):
+                    if one.endswith('.npy'):
+                        key_folder.setdefault(one[:-len('.npy')], folder)
+            self._folder[modality] = key_folder
+        return self._folder[modality]
+
+    def _Put(self, cache_key, data):
+        self._cache[cache_key] = data
+        self._memory += data.nbytes
+        while self._memory > self.max_memory and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._memory -= old.nbytes
+
+    def GetOne(self, modality, key):
+        cache_key = (modality, key)
+        if cache_key in self._cache:
+            self.hit += 1
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+        self.miss += 1
+        data = np.load(os.path.join(self._KeyFolder(modality)[key], key + '.npy'))
+        self._Put(cache_key, data)
+        return data
+
+    def Preload(self, modalities, key_list=None, verbose=True):
+        for modality in modalities:
+            for key in (sorted(self._KeyFolder(modality)) if key_list is None else key_list):
+                self.GetOne(modality, key)
+        if verbose:
+            print('CohortCache: {} arrays, {:.1f} MB'.format(len(self._cache), self._memory / 1024 / 1024))
+
+    def Table(self, csv_name):
+        if csv_name not in self._table:
+            table = pd.read_csv(os.path.join(self.data_root, csv_name), index_col=0)
+            table.index = table.index.astype(str)
+            self._table[csv_name] = table
+        return self._table[csv_name]
+
+    def GetLabel(self, key, label_tag):
+        return self.Table(self.label_csv).at[key, label_tag]
+
+    def GetFeature(self, csv_name, key):
+        return self.Table(csv_name).loc[key].values
+
+    def GetKeyList(self, split=None, modality='T2Slice'):
+        # split 和 PackedStore 一样是子目录名 ('' / 'Test'), 按 modality 的文件在哪个子目录里区分
+        key_list = self.Table(self.label_csv).index.tolist()
+        if split is None:
+            return key_list
+        folder = os.path.join(self.data_root, modality, split)
+        key_folder = self._KeyFolder(modality)
+        return [key for key in key_list if key_folder.get(key) == folder]
+
+    def GetLoader(self, sub_list, modality_list, label_tag, input_shape, batch_size, shuffle, aug_param_config=None,
+                  roi_list=None, feature_list=None, balance='duplicate', class_weight=None, epoch_length=None,
+                  epoch_seed=None, attention=None, attention_normalize=False):
+        '''
+        和各个 Train.py 里的 _GetLoader 一样返回 (loader, batches). 各个 EnsembleTrain(use_cache=True) 时用:
+        所有 fold 共用一份数据, 只读一次硬盘; 增强换成 DataSet.BatchAugment.SampleAugment, 和 MeDIT 的不完全一样,
+        所以默认不用.
+        roi_list: 哪些模态是 ROI (DistanceMap/RoiSlice/...), 增强时用 nearest, 不做灰度变换.
+        feature_list: 作为输入的临床特征 csv, 如 ['FiveClinicalbGS.csv'].
+        balance: None / 'duplicate' (默认, 原来的 Balance, 复制 index) / 'weight' (WeightedBalanceSampler)
+                 / 'stratified' (StratifiedBatchSampler, 每个 batch 两类都有).
+                 'weight' / 'stratified' 每个 epoch 随机抽样, 会忽略 shuffle, 只用在训练集上;
+                 验证集用 None 或 'duplicate', 每个 epoch 完整地过一遍.
+        class_weight: {0: w0, 1: w1}, 默认两类一样; epoch_length: 每个 epoch 的样本数, 默认是 sub_list 的长度.
+        attention: 'blurry' / 'binary' / 'pca' / 'boundary', 从增强以后的 ProstateSlice/RoiSlice 现算注意力图,
+                   放在 modality_list 的后面, 见 AttentionStage; attention_normalize: blurry 时 *0.8+0.2.
+        '''
+        from DataSet.BatchAugment import SampleAugment
+        from DataSet.BalanceSampler import WeightedBalanceSampler, StratifiedBatchSampler
+        roi_list = [] if roi_list is None else roi_list
+        transform = SampleAugment(aug_param_config) if aug_param_config else None
+        mask_list = []
+        if attention is not None:
+            from DataSet.AttentionStage import AttentionTransform
+            mask_list = ['ProstateSlice', 'RoiSlice']
+            transform = AttentionTransform(transform, len(modality_list), len(modality_list) + 1, attention,
+                                           normalize=attention_normalize)
+
+        data = PackedDataManager(self, sub_list=sub_list, transform=transform)
+        self.Preload(modality_list + mask_list, data.keys, verbose=False)
+        for modality in modality_list:
+            data.AddOne(PackedImage2D(modality, shape=input_shape, is_roi=modality in roi_list))
+        for modality in mask_list:
+            data.AddOne(PackedImage2D(modality, shape=input_shape, is_roi=True))
+        for csv_name in ([] if feature_list is None else feature_list):
+            data.AddOne(CachedFeature(csv_name))
+        data.AddOne(PackedLabel(label_tag), is_input=False)
+
+        if balance == 'duplicate':
+            data.Balance(PackedLabel(label_tag))
+        if balance == 'weight':
+            sampler = WeightedBalanceSampler(data.GetLabelList(PackedLabel(label_tag)), class_weight, epoch_length)
+            loader = MakeLoader(data, batch_size=batch_size, shuffle=False, sampler=sampler, epoch_seed=epoch_seed)
+            batches = np.ceil(len(sampler) / batch_size)
+        elif balance == 'stratified':
+            batch_sampler = StratifiedBatchSampler(data.GetLabelList(PackedLabel(label_tag)), batch_size,
+                                                   class_weight, epoch_length)
+            loader = MakeLoader(data, batch_size=batch_size, shuffle=False, batch_sampler=batch_sampler,
+                                epoch_seed=epoch_seed)
+            batches = len(batch_sampler)
+        else:
+            loader = MakeLoader(data, batch_size=batch_size, shuffle=shuffle, epoch_seed=epoch_seed)
+            batches = np.ceil(len(data.indexes) / batch_size)
+        return loader, batches
+
+
+class CachedFeature(object):
+    def __init__(self, csv_name, dtype=np.float32):
+        self.csv_name = csv_name
+        self.dtype = dtype
+
+    def GetOne(self, store, key):
+        return np.asarray(store.GetFeature(self.csv_name, key), dtype=self.dtype)
@@ -0,0 +1,100 @@
+import time
+import torch
+
+from DataSet.BatchAugment import GaussianSmooth2D
+
+# ElasticTransform 每个样本都重新生成平滑的随机位移场, 是增强里最慢的一步.
+# 这里预先在工作分辨率 (192x192) 上算好一组位移场, 用的时候随机取, 再加上随机翻转和缩放.
+
+
+class ElasticBank(object):
+    '''
+    bank = ElasticBank(sigma=0.1, alpha=256, shape=(192, 192), bank_size=512, memory_budget=256)
+    displacement = bank.Sample(batch, device)   # (batch, 2, H, W), 单位是像素
+    memory_budget: MB, bank_size 会被限制在预算以内.
+    scale_range: 每个位移场随机乘的系数, 默认 (1, 1) 不缩放, 和原来的 ElasticTransform 的幅度一样; 放宽时需要自己确认.
+    '''
+    def __init__(self, sigma, alpha, shape=(192, 192), bank_size=512, memory_budget=256, scale_range=(1., 1.),
+                 dtype=torch.float16, device='cpu', seed=0):
+        self.sigma, self.alpha = sigma, alpha
+        self.shape = tuple(shape)
+        self.scale_range = scale_range
+        self.dtype = dtype
+
+        field_bytes = 2 * self.shape[0] * self.shape[1] * torch.tensor([], dtype=dtype).element_size()
+        self.bank_size = max(1, min(bank_size, int(memory_budget * 1024 * 1024 // field_bytes)))
+        if self.bank_size < bank_size:
+            print('ElasticBank: bank size {} -> {} for {} MB'.format(bank_size, self.bank_size, memory_budget))
+
+        generator = torch.Generator(device='cpu').manual_seed(seed)
+        bank = []
+        for start in range(0, self.bank_size, 64):
+            batch = min(64, self.bank_size - start)
+            noise = torch.rand((batch, 2) + self.shape, generator=generator) * 2. - 1.
+            bank.append(self.Generate(noise).to(dtype))
+        self.bank = torch.cat(bank, dim=0).to(device)
+
+    @property
+    def memory(self):
+        return self.bank.numel() * self.bank.element_size() / 1024 / 1024
+
+    def Generate(self, noise):
+        return GaussianSmooth2D(noise, self.sigma * max(self.shape)) * self.alpha
+
+    def OnTheFly(self, batch, device):
+        noise = torch.rand((batch, 2) + self.shape, device=device) * 2. - 1.
+        return self.Generate(noise)
+
+    def Sample(self, batch, device):
+        index = torch.randint(self.bank_size, (batch,))
+        displacement = self.bank[index].to(device=device, dtype=torch.float32)
+
+        # 左右/上下翻转: 翻转位置, 同时翻转对应方向的位移
+        flip_x = torch.rand(batch, device=device) < 0.5
+        flip_y = torch.rand(batch, device=device) < 0.5
+        displacement[flip_x] = displacement[flip_x].flip(-1) * torch.tensor([-1., 1.], device=device).view(1, 2, 1, 1)
+        displacement[flip_y] = displacement[flip_y].flip(-2) * torch.tensor([1., -1.], device=device).view(1, 2, 1, 1)
+        # 交换 x/y 分量 (转置)
+        transpose = torch.rand(batch, device=device) < 0.5
+        if self.shape[0] == self.shape[1]:
+            displacement[transpose] = displacement[transpose].transpose(-1, -2).flip(1)
+
+        scale = torch.empty((batch, 1, 1, 1), device=device).uniform_(*self.scale_range)
+        return displacement * scale
+
+
+def _Diversity(displacement):
+    # 两两之间位移场的平均绝对相关系数, 越小越多样
+    flat = displacement.flatten(1).float()
+    flat = flat - flat.mean(dim=1, keepdim=True)
+    flat = flat / flat.norm(dim=1, keepdim=True).clamp(min=1e-12)
+    corr = flat @ flat.t()
+    batch = corr.shape[0]
+    return (corr.abs().sum() - corr.diagonal().abs().sum()).item() / (batch * (batch - 1))
+
+
+def CompareElastic(sigma=0.1, alpha=256, shape=(192, 192), bank_size=512, memory_budget=256, batch=24, repeat=20):
+    device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    bank = ElasticBank(sigma, alpha, shape, bank_size, memory_budget, device=device)
+
+    result = {}
+    for name, function in [('on the fly', bank.OnTheFly), ('bank', bank.Sample)]:
+        function(batch, device)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        sample_list = [function(batch, device) for _ in range(repeat)]
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        cost = (time.perf_counter() - start) / repeat
+        sample = torch.cat(sample_list, dim=0)[:256]
+        result[name] = {'ms / batch': cost * 1000, 'diversity': _Diversity(sample),
+                        'mean |displacement|': sample.abs().mean().item()}
+        print('{}: {:.2f} ms / batch, diversity {:.4f}, mean |displacement| {:.3f} pixel'.format(
+            name, result[name]['ms / batch'], result[name]['diversity'], result[name]['mean |displacement|']))
+    print('bank: {} fields, {:.1f} MB'.format(bank.bank_size, bank.memory))
+    return result
+
+
+if __name__ == '__main__':
+    CompareElastic()
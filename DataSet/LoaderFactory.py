@@ -0,0 +1,258 @@
+import os
+import time
+import queue
+import random
+import threading
+import multiprocessing
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+# 所有训练/测试的 DataLoader 都从这里建, 默认多进程 + pin memory + 预取
+default_num_workers = min(8, os.cpu_count() or 1)
+
+
+class EpochSeed(object):
+    '''
+    worker 间共享的 epoch 计数. persistent_workers 时 worker_init_fn 只跑一次,
+    所以每个 epoch 开始前调用 SetEpoch, worker 在取下一个样本时按 (seed, epoch, worker) 重新设种子,
+    param_config 里的增强 (np.random/random) 每个 worker、每个 epoch 都不一样, 并且可复现.
+    stream: 同一个 seed 下不同的 loader (train/val) 用不同的 stream, 种子按 (seed, stream, epoch, worker) 生成.
+    '''
+    def __init__(self, seed=0, stream=0, epoch=None):
+        self.seed = seed
+        self.stream = stream
+        self._epoch = multiprocessing.Value('i', 0) if epoch is None else epoch
+
+    def Stream(self, stream):
+        # 和这个 EpochSeed 共用 epoch 计数 (SetEpoch 一次就行), 只是 stream 不同
+        return EpochSeed(self.seed, stream, self._epoch)
+
+    def SetEpoch(self, epoch):
+        with self._epoch.get_lock():
+            self._epoch.value = epoch
+
+    def GetEpoch(self):
+        return self._epoch.value
+
+    def Seed(self, worker_id):
+        seed_seq = np.random.SeedSequence([self.seed, self.stream, self.GetEpoch(), worker_id])
+        seed = int(seed_seq.generate_state(1)[0])
+        np.random.seed(seed)
+        random.seed(seed)
+        torch.manual_seed(seed)
+
+
+class _SeededDataset(Dataset):
+    def __init__(self, dataset, epoch_seed):
+        self.dataset = dataset
+        self.epoch_seed = epoch_seed
+        self._seeded_epoch = None
+
+    def __getattr__(self, item):
+        # data.indexes 之类的属性直接转给原来的 dataset
+        if item == 'dataset':
+            raise AttributeError(item)
+        return getattr(self.dataset, item)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        epoch = self.epoch_seed.GetEpoch()
+        if epoch != self._seeded_epoch:
+            worker_info = torch.utils.data.get_worker_info()
+            self.epoch_seed.Seed(0 if worker_info is None else worker_info.id + 1)
+            self._seeded_epoch = epoch
+        return self.dataset[index]
+
+
+def MakeLoader(dataset, batch_size, shuffle, num_workers=None, pin_memory=None, persistent_workers=True,
+               prefetch_factor=2, epoch_seed=None, sampler=None, batch_sampler=None, drop_last=False):
+    if num_workers is None:
+        num_workers = default_num_workers
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    if epoch_seed is not None:
+        dataset = _SeededDataset(dataset, epoch_seed)
+
+    kwargs = {}
+    if num_workers > 0:
+        kwargs['persistent_workers'] = persistent_workers
+        kwargs['prefetch_factor'] = prefetch_factor
+    if batch_sampler is not None:
+        # batch_sampler 自己决定 batch 的组成, DataLoader 的 batch_size/shuffle/drop_last 要用默认值
+        return DataLoader(dataset, batch_sampler=batch_sampler, num_workers=num_workers, pin_memory=pin_memory,
+                          **kwargs)
+    if sampler is not None:
+        shuffle = False
+
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, sampler=sampler,
+                      num_workers=num_workers, pin_memory=pin_memory, drop_last=drop_last, **kwargs)
+
+
+class DataWaitTimer(object):
+    '''
+    for inputs, outputs in timer.Iterate(train_loader): ...
+    记录训练循环在 next(loader) 上等了多久, 和这一轮的总时间.
+    '''
+    def __init__(self):
+        self.wait_time = 0.
+        self.total_time = 0.
+        self.batches = 0
+
+    def Reset(self):
+        self.wait_time, self.total_time, self.batches = 0., 0., 0
+
+    def Iterate(self, loader):
+        start = time.perf_counter()
+        iterator = iter(loader)
+        while True:
+            wait_start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            self.wait_time += time.perf_counter() - wait_start
+            self.batches += 1
+            yield batch
+        self.total_time += time.perf_counter() - start
+
+    def Summary(self):
+        ratio = self.wait_time / self.total_time if self.total_time > 0 else 0.
+        return {'data wait': self.wait_time, 'total': self.total_time, 'wait ratio': ratio, 'batches': self.batches}
+
+    def __str__(self):
+        summary = self.Summary()
+        return 'data wait: {:.2f}s / {:.2f}s ({:.1%}), {} batches'.format(
+            summary['data wait'], summary['total'], summary['wait ratio'], summary['batches'])
+
+
+def ModelFormat(model):
+    # 模型参数的 dtype 和 memory format (channels_last 或者默认)
+    dtype, memory_format = torch.float32, torch.contiguous_format
+    for param in model.parameters():
+        dtype = param.dtype
+        if param.dim() == 4:
+            if param.is_contiguous(memory_format=torch.channels_last) and not param.is_contiguous():
+                memory_format = torch.channels_last
+            break
+    return dtype, memory_format
+
+
+def _Put(buffer, item, stop):
+    # 训练循环提前 break 时 stop 会被设置, 后台线程不会卡在满的 queue 上
+    while not stop.is_set():
+        try:
+            buffer.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+class DevicePrefetcher(DataWaitTimer):
+    '''
+    for inputs, outputs in prefetcher.Iterate(train_loader): ...  (inputs/outputs 已经在 device 上)
+    后台线程取下一个 batch, 在 CPU 上转好 dtype/memory format, 再异步拷到 device (CUDA 时用单独的 stream),
+    训练循环和取数据、拷贝重叠. 代替循环里的 MoveTensorsToDevice.
+    wait_time 是训练循环实际等待的时间, load_time 是后台线程取数据+拷贝的时间, 两者之差是被重叠掉的部分.
+    dtype 只作用于浮点 tensor, label 等整型不变; memory_format 只作用于 4 维 tensor.
+    '''
+    def __init__(self, device, dtype=None, memory_format=None, depth=2, model=None):
+        super(DevicePrefetcher, self).__init__()
+        if model is not None:
+            dtype, memory_format = ModelFormat(model)
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.memory_format = memory_format
+        self.depth = depth
+        self.load_time = 0.
+        self._stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+
+    def Reset(self):
+        super(DevicePrefetcher, self).Reset()
+        self.load_time = 0.
+
+    def _Convert(self, data):
+        if isinstance(data, (list, tuple)):
+            return type(data)(self._Convert(one) for one in data)
+        if isinstance(data, dict):
+            return {key: self._Convert(one) for key, one in data.items()}
+        if isinstance(data, np.ndarray):
+            data = torch.from_numpy(data)
+        if not isinstance(data, torch.Tensor):
+            return data
+        if self.dtype is not None and data.is_floating_point():
+            data = data.to(self.dtype)
+        if self.memory_format is not None and data.dim() == 4:
+            data = data.contiguous(memory_format=self.memory_format)
+        return data.to(self.device, non_blocking=True)
+
+    def _RecordStream(self, data):
+        if isinstance(data, (list, tuple)):
+            for one in data:
+                self._RecordStream(one)
+        elif isinstance(data, dict):
+            for one in data.values():
+                self._RecordStream(one)
+        elif isinstance(data, torch.Tensor):
+            # 这块显存之后在默认 stream 上用, 告诉 caching allocator 不要提前回收
+            data.record_stream(torch.cuda.current_stream(self.device))
+
+    def _Produce(self, loader, buffer, stop):
+        try:
+            iterator = iter(loader)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                event = None
+                if self._stream is not None:
+                    with torch.cuda.stream(self._stream):
+                        batch = self._Convert(batch)
+                        event = torch.cuda.Event()
+                        event.record(self._stream)
+                else:
+                    batch = self._Convert(batch)
+                self.load_time += time.perf_counter() - start
+                _Put(buffer, (batch, event), stop)
+            _Put(buffer, StopIteration, stop)
+        except BaseException as e:
+            _Put(buffer, e, stop)
+
+    def Iterate(self, loader):
+        start = time.perf_counter()
+        buffer, stop = queue.Queue(maxsize=self.depth), threading.Event()
+        thread = threading.Thread(target=self._Produce, args=(loader, buffer, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                item = buffer.get()
+                self.wait_time += time.perf_counter() - wait_start
+                if item is StopIteration:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                batch, event = item
+                if event is not None:
+                    torch.cuda.current_stream(self.device).wait_event(event)
+                    self._RecordStream(batch)
+                self.batches += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+            self.total_time += time.perf_counter() - start
+
+    def Summary(self):
+        summary = super(DevicePrefetcher, self).Summary()
+        summary['overlapped'] = max(0., self.load_time - self.wait_time)
+        return summary
+
+    def __str__(self):
+        summary = self.Summary()
+        return 'data wait: {:.2f}s / {:.2f}s ({:.1%}), overlapped {:.2f}s, {} batches'.format(
+            summary['data wait'], summary['total'], summary['wait ratio'], summary['overlapped'], summary['batches'])
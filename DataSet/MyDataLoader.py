@@ -4,9 +4,10 @@ from SSHProject.CnnTools.T4T.Utility.Data import *
 from SSHProject.BasicTool.MeDIT.Augment import config_example
 
 from NPYFilePath import *
+from DataSet.LoaderFactory import MakeLoader
 
 
-def LoadTVData(folder, shape=(184, 184), is_test=False, setname=None):
+def LoadTVData(folder, shape=(184, 184), is_test=False, setname=None, num_workers=None, epoch_seed=None):
 
     if setname is None:
         setname = ['Train', 'Validation']
@@ -61,16 +62,18 @@ def LoadTVData(folder, shape=(184, 184), is_test=False, setname=None):
 
     ###########################################################
     if is_test:
-        train_loader = DataLoader(train_dataset, batch_size=1, shuffle=False)
-        validation_loader = DataLoader(validation_dataset, batch_size=1, shuffle=False)
+        train_loader = MakeLoader(train_dataset, batch_size=1, shuffle=False, num_workers=num_workers)
+        validation_loader = MakeLoader(validation_dataset, batch_size=1, shuffle=False, num_workers=num_workers)
     else:
-        train_loader = DataLoader(train_dataset, batch_size=12, shuffle=True)
-        validation_loader = DataLoader(validation_dataset, batch_size=12, shuffle=True)
+        train_loader = MakeLoader(train_dataset, batch_size=12, shuffle=True, num_workers=num_workers,
+                                  epoch_seed=epoch_seed)
+        validation_loader = MakeLoader(validation_dataset, batch_size=12, shuffle=True, num_workers=num_workers,
+                                       epoch_seed=None if epoch_seed is None else epoch_seed.Stream(1))
 
     return train_loader, validation_loader
 
 
-def LoadTestData(folder, shape=(184, 184)):
+def LoadTestData(folder, shape=(184, 184), num_workers=None):
 
     t2_folder = os.path.join(folder, 'T2Slice')
     dwi_folder = os.path.join(folder, 'DwiSlice')
@@ -97,5 +100,5 @@ def LoadTestData(folder, shape=(184, 184)):
 
     test_dataset.AddOne(Feature(ece_folder), is_input=False)
 
-    test_loader = DataLoader(test_dataset, batch_size=1, shuffle=False)
+    test_loader = MakeLoader(test_dataset, batch_size=1, shuffle=False, num_workers=num_workers)
     return test_loader
\ No newline at end of file
@@ -0,0 +1,258 @@
+import os
+import numpy as np
+import pandas as pd
+from torch.utils.data import Dataset
+
+# 把 T2Slice/AdcSlice/... 下面每个样本一个 .npy 的目录, 打包成每个模态一个连续数组
+# store_folder/
+#     T2Slice.npy, AdcSlice.npy, ...  (N, 1, H, W), 用 np.memmap 打开
+#     index.csv                       key, case, slice, split, row, 以及 label 列
+
+default_modalities = ['T2Slice', 'AdcSlice', 'DwiSlice', 'RoiSlice', 'ProstateSlice', 'DistanceMap']
+
+
+def SplitKey(key):
+    # 'CHEN REN_slice11' (JSPH) / 'XXX_-_slice5' (SUH)
+    for sep in ['_-_slice', '_slice']:
+        if sep in key:
+            return key[:key.index(sep)], int(key[key.index(sep) + len(sep):])
+    return key, -1
+
+
+def _ListKey(folder):
+    return sorted([one[:-len('.npy')] for one in os.listdir(folder) if one.endswith('.npy')])
+
+
+def PackFolder(data_root, store_folder, modalities=None, label_csv_list=None, sub_folder_list=None, dtype=np.float32):
+    '''
+    data_root: NPYNoDivide 这样的目录, 下面是 T2Slice/AdcSlice/...
+    sub_folder_list: 要打包的子目录, 如 ['', 'Test'], '' 表示模态目录本身
+    label_csv_list: label.csv/ece.csv 等, 第一列是 key, 其余列写进 index.csv
+    '''
+    if modalities is None:
+        modalities = [one for one in default_modalities if os.path.isdir(os.path.join(data_root, one))]
+    if sub_folder_list is None:
+        sub_folder_list = ['']
+    if label_csv_list is None:
+        label_csv_list = []
+    if not os.path.exists(store_folder):
+        os.makedirs(store_folder)
+
+    # 只打包所有模态都有的样本
+    key_list, split_list = [], []
+    for sub_folder in sub_folder_list:
+        key_set = None
+        for modality in modalities:
+            one_set = set(_ListKey(os.path.join(data_root, modality, sub_folder)))
+            key_set = one_set if key_set is None else key_set & one_set
+        for key in sorted(key_set):
+            key_list.append(key)
+            split_list.append(sub_folder)
+
+    if len(key_list) == 0:
+        raise ValueError('no sample found in {}'.format(data_root))
+    # 取数据/标签都只按 key, 同一个 key 在两个子目录里 ('' 和 Test) 时后一个会盖掉前一个, 直接报错
+    key_series = pd.Series(key_list)
+    duplicate = sorted(set(key_series[key_series.duplicated()]))
+    if len(duplicate) > 0:
+        raise ValueError('{} keys are in more than one of {}, e.g. {}'.format(
+            len(duplicate), sub_folder_list, duplicate[:3]))
+
+    for modality in modalities:
+        first = np.load(os.path.join(data_root, modality, split_list[0], key_list[0] + '.npy'))
+        store = np.lib.format.open_memmap(os.path.join(store_folder, modality + '.npy'), mode='w+',
+                                          dtype=dtype, shape=(len(key_list),) + first.shape)
+        for row, (key, split) in enumerate(zip(key_list, split_list)):
+            store[row] = np.load(os.path.join(data_root, modality, split, key + '.npy'))
+        store.flush()
+        del store
+        print('{} packed: {}'.format(modality, len(key_list)))
+
+    index_df = pd.DataFrame({'key': key_list,
+                             'case': [SplitKey(key)[0] for key in key_list],
+                             'slice': [SplitKey(key)[1] for key in key_list],
+                             'split': split_list,
+                             'row': np.arange(len(key_list))})
+    for label_csv in label_csv_list:
+        label_df = pd.read_csv(label_csv, index_col=0)
+        label_df.index = label_df.index.astype(str)
+        for column in label_df.columns:
+            if column in index_df.columns:
+                continue
+            index_df[column] = label_df[column].reindex(index_df['key']).values
+    index_df.to_csv(os.path.join(store_folder, 'index.csv'), index=False)
+    return index_df
+
+
+class PackedStore(object):
+    def __init__(self, store_folder, mmap_mode='c'):
+        # mmap_mode='c': copy-on-write, 只读页面共享, torch.as_tensor 不会报 non-writable 的 warning
+        self.store_folder = store_folder
+        self.mmap_mode = mmap_mode
+        self.index = pd.read_csv(os.path.join(store_folder, 'index.csv'), dtype={'key': str, 'case': str})
+        self.index['split'] = self.index['split'].fillna('')
+        if self.index['key'].duplicated().any():
+            raise ValueError('{} has duplicate keys, pack it again with PackFolder'.format(store_folder))
+        self._row = dict(zip(self.index['key'], self.index['row']))
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self._row
+
+    def __getstate__(self):
+        # DataLoader 多进程时不传 memmap, 子进程里重新打开
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    @property
+    def modalities(self):
+        return sorted([one[:-len('.npy')] for one in os.listdir(self.store_folder) if one.endswith('.npy')])
+
+    def Array(self, modality):
+        if modality not in self._arrays:
+            self._arrays[modality] = np.load(os.path.join(self.store_folder, modality + '.npy'),
+                                             mmap_mode=self.mmap_mode)
+        return self._arrays[modality]
+
+    def Row(self, key):
+        return self._row[key]
+
+    def GetKeyList(self, split=None):
+        if split is None:
+            return self.index['key'].tolist()
+        return self.index.loc[self.index['split'] == split, 'key'].tolist()
+
+    def GetOne(self, modality, key):
+        # memmap 上的切片, 不拷贝
+        return self.Array(modality)[self._row[key]]
+
+    def GetLabel(self, key, label_tag):
+        return self.index.at[self._row[key], label_tag]
+
+
+class PackedImage2D(object):
+    def __init__(self, modality, shape=None, is_roi=False):
+        self.modality = modality
+        self.shape = shape
+        self.is_roi = is_roi
+
+    def GetOne(self, store, key):
+        data = store.GetOne(self.modality, key)
+        if self.shape is None or tuple(data.shape[-2:]) == tuple(self.shape):
+            return data
+        # 中心裁剪, 仍然是 view
+        row = (data.shape[-2] - self.shape[0]) // 2
+        col = (data.shape[-1] - self.shape[1]) // 2
+        return data[..., row:row + self.shape[0], col:col + self.shape[1]]
+
+
+class PackedLabel(object):
+    def __init__(self, label_tag, dtype=np.float32):
+        self.label_tag = label_tag
+        self.dtype = dtype
+
+    def GetOne(self, store, key):
+        return np.asarray(store.GetLabel(key, self.label_tag), dtype=self.dtype)
+
+
+class PackedDataManager(Dataset):
+    '''
+    和 T4T 的 DataManager 用法一致, 只是数据从 PackedStore 里取:
+        data = PackedDataManager(PackedStore(store_root), sub_list=sub_train)
+        data.AddOne(PackedImage2D('T2Slice', shape=(192, 192)))
+        data.AddOne(PackedLabel('Positive'), is_input=False)
+        data.Balance(PackedLabel('Positive'))
+    transform(input_list, is_roi_list) 对每个样本做增强, 返回新的 input_list.
+    '''
+    def __init__(self, store, sub_list=None, transform=None):
+        self.store = store
+        if sub_list is None:
+            self.keys = store.GetKeyList()
+        else:
+            self.keys = [key for key in sub_list if key in store]
+            if len(self.keys) != len(sub_list):
+                print('{} keys in sub_list are not in the store'.format(len(sub_list) - len(self.keys)))
+        self.indexes = list(range(len(self.keys)))
+        self.transform = transform
+        self.input_dataset, self.output_dataset = [], []
+
+    def AddOne(self, one, is_input=True):
+        if is_input:
+            self.input_dataset.append(one)
+        else:
+            self.output_dataset.append(one)
+
+    def GetLabelList(self, label):
+        # 和 self.indexes 一一对应, 给 BalanceSampler 用
+        return np.array([label.GetOne(self.store, self.keys[index]) for index in self.indexes]).astype(int)
+
+    def Balance(self, label):
+        # 和 DataManager.Balance 一样, 复制少数类的 index
+        labels = np.array([label.GetOne(self.store, key) for key in self.keys]).astype(int)
+        pos, neg = np.where(labels == 1)[0].tolist(), np.where(labels == 0)[0].tolist()
+        if len(pos) == 0 or len(neg) == 0:
+            return
+        small, large = (pos, neg) if len(pos) < len(neg) else (neg, pos)
+        self.indexes = large + small * (len(large) // len(small)) + small[:len(large) % len(small)]
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, index):
+        key = self.keys[self.indexes[index]]
+        inputs = [one.GetOne(self.store, key) for one in self.input_dataset]
+        outputs = [one.GetOne(self.store, key) for one in self.output_dataset]
+        if self.transform is not None:
+            inputs = self.transform(inputs, [getattr(one, 'is_roi', False) for one in self.input_dataset])
+        if len(outputs) == 1:
+            outputs = outputs[0]
+        return inputs, outputs
+
+
+class ManifestLabel(object):
+    '''
+    CaseManifest 里 case 的 ece 作为标签, 建的时候一次查出来.
+    '''
+    def __init__(self, manifest, cohort=None, split=None, dtype=np.float32):
+        self.label = manifest.GetLabelDict(cohort, split)
+        self.dtype = dtype
+
+    def GetOne(self, store, key):
+        return np.asarray(self.label[key], dtype=self.dtype)
+
+
+def ManifestDataManager(store, manifest, cohort=None, split=None, transform=None):
+    '''
+    样本从 CaseManifest 里按 cohort/split 查, 不再列目录. manifest 记下的 packed_row 和 store 的 index.csv 对不上时报错,
+    说明 manifest 或 Packed 过期了, 要重新 CaseManifest.Update / PackFolder.
+    split 是 manifest 的 (Train/Test/External), 不是 PackedStore 的子目录名.
+    '''
+    row_dict = manifest.GetPackedRow(cohort, split)
+    stale = [key for key, row in row_dict.items() if row is None or key not in store or store.Row(key) != row]
+    if len(stale) > 0:
+        raise ValueError('{} keys in the manifest do not match {}, e.g. {}'.format(
+            len(stale), store.store_folder, stale[:3]))
+    return PackedDataManager(store, sub_list=sorted(row_dict), transform=transform)
+
+
+if __name__ == '__main__':
+    data_root = r'/home/zhangyihong/Documents/ProstateECE/NPYNoDivide'
+    PackFolder(data_root, data_root + '/Packed',
+               label_csv_list=[data_root + '/label.csv', data_root + '/ece.csv'],
+               sub_folder_list=['', 'Test'])
+
+    store = PackedStore(data_root + '/Packed')
+    # 样本和 ece 标签从 manifest 里查, 见 DataSet.CaseManifest
+    from DataSet.CaseManifest import CaseManifest
+    manifest = CaseManifest(r'/home/zhangyihong/Documents/ProstateECE/manifest.db')
+    manifest.Update('JSPH', data_root, label_csv=data_root + '/ece.csv')
+    data = ManifestDataManager(store, manifest, cohort='JSPH', split='Test')
+    data.AddOne(PackedImage2D('T2Slice', shape=(192, 192)))
+    data.AddOne(PackedImage2D('DistanceMap', shape=(192, 192), is_roi=True))
+    data.AddOne(ManifestLabel(manifest, cohort='JSPH', split='Test'), is_input=False)
+    inputs, outputs = data[0]
+    print(len(data), inputs[0].shape, outputs)
@@ -0,0 +1,190 @@
+import os
+import time
+import multiprocessing
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+from scipy import ndimage
+
+# 合成的前列腺 MRI 队列, 不需要病人数据就能跑 loader/距离图/指标/模型的 benchmark.
+# 目录结构和真实数据一致:
+#     root/SYN000000/t2.nii, adc_Reg.nii, dwi_Reg.nii, roi.nii, ProstateROI_TrumpetNet.nii.gz
+#     root/NPYNoDivide/T2Slice/(Test/)SYN000000_slice11.npy, AdcSlice, DwiSlice, RoiSlice, ProstateSlice, DistanceMap
+#     root/NPYNoDivide/label.csv (Negative/Positive), ece.csv, clinical.csv
+# ECE 的标签由几何决定: 病灶有一部分在前列腺外面就是 1, 距离图和标签是一致的.
+
+spacing = (0.5, 0.5, 3.0)  # x, y, z, mm
+npy_modalities = ['T2Slice', 'AdcSlice', 'DwiSlice', 'RoiSlice', 'ProstateSlice', 'DistanceMap']
+
+# 背景 / 前列腺 / 病灶 的信号
+_intensity = {'t2': (300., 450., 200.), 'adc': (1500., 1300., 700.), 'dwi': (40., 60., 150.)}
+
+
+def _Blob(shape, center, radii, rng, irregularity=0.15):
+    '''
+    不规则的椭球, 半径按面内角度加几项低频余弦扰动, 只在包围盒里计算.
+    center/radii: (z, y, x), 单位是体素
+    '''
+    mask = np.zeros(shape, dtype=bool)
+    margin = 1 + 3 * irregularity
+    low = [max(0, int(c - r * margin) - 1) for c, r in zip(center, radii)]
+    high = [min(s, int(c + r * margin) + 2) for s, c, r in zip(shape, center, radii)]
+    if any(l >= h for l, h in zip(low, high)):
+        return mask
+
+    z, y, x = np.meshgrid(*[(np.arange(l, h) - c) / r for l, h, c, r in zip(low, high, center, radii)],
+                          indexing='ij')
+    distance = np.sqrt(z ** 2 + y ** 2 + x ** 2)
+    theta = np.arctan2(y, x)
+    boundary = np.ones_like(distance)
+    for k in range(1, 4):
+        boundary += irregularity / k * rng.uniform(-1, 1) * np.cos(k * theta + rng.uniform(0, 2 * np.pi))
+    # 尖端和底部稍微收窄
+    boundary *= 1 - 0.2 * np.abs(z)
+    mask[low[0]:high[0], low[1]:high[1], low[2]:high[2]] = distance < boundary
+    return mask
+
+
+def _Image(prostate, lesion, kind, rng):
+    background, gland, tumor = _intensity[kind]
+    field = ndimage.gaussian_filter(rng.standard_normal(prostate.shape).astype(np.float32), sigma=(1, 8, 8))
+    image = background * (1 + 0.5 * field / (np.abs(field).max() + 1e-6))
+    image[prostate] = gland * (1 + 0.1 * field[prostate])
+    image[lesion] = tumor * (1 + 0.1 * field[lesion])
+    image = ndimage.gaussian_filter(image, sigma=(0, 0.8, 0.8))
+    # Rician 噪声
+    noise = 0.04 * gland
+    real = image + rng.normal(0, noise, image.shape)
+    imag = rng.normal(0, noise, image.shape)
+    return np.sqrt(real ** 2 + imag ** 2).astype(np.float32)
+
+
+def SyntheticCase(seed, shape=(24, 280, 280), ece_ratio=0.4):
+    '''
+    返回 dict: t2/adc/dwi (float32), roi/prostate (uint8), 形状都是 (slice, row, column); 以及 ece/age/psa.
+    '''
+    rng = np.random.RandomState(seed)
+    depth, height, width = shape
+    center = np.array([depth / 2 + rng.uniform(-2, 2), height / 2 + rng.uniform(-15, 15),
+                       width / 2 + rng.uniform(-15, 15)])
+    radii = np.array([rng.uniform(0.25, 0.35) * depth, rng.uniform(0.10, 0.15) * height,
+                      rng.uniform(0.13, 0.18) * width])
+    prostate = _Blob(shape, center, radii, rng, irregularity=0.1)
+
+    is_ece = rng.uniform() < ece_ratio
+    angle = rng.uniform(0, 2 * np.pi)
+    direction = np.array([rng.uniform(-0.2, 0.2), np.sin(angle), np.cos(angle)])
+    ratio = rng.uniform(0.85, 1.05) if is_ece else rng.uniform(0.3, 0.6)
+    lesion_center = center + direction * radii * ratio
+    lesion_radii = np.array([rng.uniform(0.3, 0.5) * radii[0], rng.uniform(0.2, 0.35) * radii[1],
+                             rng.uniform(0.2, 0.35) * radii[2]])
+    lesion = _Blob(shape, lesion_center, lesion_radii, rng, irregularity=0.25)
+    if not is_ece:
+        lesion &= ndimage.binary_erosion(prostate, iterations=3)
+    if lesion.sum() == 0:
+        # 太小被腐蚀没了, 放回前列腺中心
+        lesion = _Blob(shape, center, lesion_radii, rng, irregularity=0.25) & prostate
+    ece = int((lesion & ~prostate).sum() > 0)
+
+    case = {kind: _Image(prostate, lesion, kind, rng) for kind in _intensity}
+    case['roi'] = lesion.astype(np.uint8)
+    case['prostate'] = prostate.astype(np.uint8)
+    case['ece'] = ece
+    case['age'] = int(rng.normal(68, 7))
+    case['psa'] = round(float(rng.lognormal(2.3 + 0.4 * ece, 0.7)), 2)
+    return case
+
+
+def _WriteNii(data, path):
+    image = sitk.GetImageFromArray(data)
+    image.SetSpacing(spacing)
+    sitk.WriteImage(image, path)
+
+
+def _Normalize(data):
+    # 和 H5.CropT2Data 一样按层做 z-score, 不改原数组
+    data = data.astype(np.float32)
+    return (data - data.mean()) / (data.std() + 1e-6)
+
+
+def _WriteCase(args):
+    index, root, seed, shape, split, write_nifti, write_npy, distance_map = args
+    case_name = 'SYN{:06d}'.format(index)
+    case = SyntheticCase(seed, shape)
+
+    if write_nifti:
+        case_folder = os.path.join(root, case_name)
+        os.makedirs(case_folder, exist_ok=True)
+        _WriteNii(case['t2'], os.path.join(case_folder, 't2.nii'))
+        _WriteNii(case['adc'], os.path.join(case_folder, 'adc_Reg.nii'))
+        _WriteNii(case['dwi'], os.path.join(case_folder, 'dwi_Reg.nii'))
+        _WriteNii(case['roi'], os.path.join(case_folder, 'roi.nii'))
+        _WriteNii(case['prostate'], os.path.join(case_folder, 'ProstateROI_TrumpetNet.nii.gz'))
+
+    # 和 MaxRoi.SelectMaxRoiSlice 一样取病灶最大的那一层
+    slice = int(np.argmax(case['roi'].reshape(case['roi'].shape[0], -1).sum(axis=1)))
+    key = '{}_slice{}'.format(case_name, slice)
+    if write_npy:
+        slice_data = {'T2Slice': _Normalize(case['t2'][slice]),
+                      'AdcSlice': _Normalize(case['adc'][slice]),
+                      'DwiSlice': _Normalize(case['dwi'][slice]),
+                      'RoiSlice': case['roi'][slice].astype(np.float32),
+                      'ProstateSlice': case['prostate'][slice].astype(np.float32)}
+        if distance_map:
+            from DistanceMap.RoiDistanceMap import FindRegion
+            slice_data['DistanceMap'] = FindRegion(case['prostate'][slice], case['roi'][slice]).astype(np.float32)
+        for modality, data in slice_data.items():
+            np.save(os.path.join(root, 'NPYNoDivide', modality, split, key + '.npy'), data[np.newaxis])
+
+    return {'key': key, 'case': case_name, 'split': split, 'ece': case['ece'], 'age': case['age'], 'psa': case['psa']}
+
+
+def GenerateCohort(root, case_number, shape=(24, 280, 280), test_ratio=0.3, seed=0, write_nifti=True, write_npy=True,
+                   distance_map=True, num_workers=None, verbose=True):
+    '''
+    root: 输出目录, case_number 从 10 到 100k 都可以, 每个 case 的随机数种子只和 (seed, index) 有关,
+    同样的参数生成的数据完全一样, 和 num_workers 无关.
+    '''
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    split_rng = np.random.RandomState(seed)
+    split_list = np.where(split_rng.uniform(size=case_number) < test_ratio, 'Test', '')
+    seed_list = np.random.SeedSequence(seed).generate_state(case_number)
+
+    if write_npy:
+        for modality in npy_modalities:
+            if modality == 'DistanceMap' and not distance_map:
+                continue
+            os.makedirs(os.path.join(root, 'NPYNoDivide', modality, 'Test'), exist_ok=True)
+
+    args = [(index, root, int(seed_list[index]), shape, split_list[index], write_nifti, write_npy, distance_map)
+            for index in range(case_number)]
+    start = time.perf_counter()
+    rows = []
+    if num_workers > 1:
+        chunk_size = max(1, min(64, case_number // num_workers // 4))
+        with multiprocessing.Pool(num_workers) as pool:
+            for row in pool.imap_unordered(_WriteCase, args, chunksize=chunk_size):
+                rows.append(row)
+                if verbose and len(rows) % 1000 == 0:
+                    print('{} / {} cases, {:.1f} cases/s'.format(len(rows), case_number,
+                                                                len(rows) / (time.perf_counter() - start)))
+    else:
+        rows = [_WriteCase(one) for one in args]
+
+    df = pd.DataFrame(rows).sort_values('case')
+    csv_folder = os.path.join(root, 'NPYNoDivide')
+    os.makedirs(csv_folder, exist_ok=True)
+    label_df = pd.DataFrame({'case': df['key'], 'Negative': 1 - df['ece'], 'Positive': df['ece']})
+    label_df.to_csv(os.path.join(csv_folder, 'label.csv'), index=False)
+    df[['key', 'ece']].rename(columns={'key': 'case'}).to_csv(os.path.join(csv_folder, 'ece.csv'), index=False)
+    df[['case', 'age', 'psa']].to_csv(os.path.join(csv_folder, 'clinical.csv'), index=False)
+
+    if verbose:
+        print('{} cases ({} test, {} ECE) in {:.1f}s'.format(case_number, (df['split'] == 'Test').sum(),
+                                                          df['ece'].sum(), time.perf_counter() - start))
+    return df
+
+
+if __name__ == '__main__':
+    GenerateCohort(r'/home/zhangyihong/Documents/ProstateECE/Synthetic', 100)
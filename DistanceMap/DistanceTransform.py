@@ -0,0 +1,195 @@
+import time
+import numpy as np
+from scipy import ndimage
+
+# RoiDistanceMap 的 BlurryEdge / ExtractEdge / DetectCloseRegion / FindRegion 用距离变换一次算完.
+# 3x3 的 kernel 膨胀 i 次 == 到 roi 的棋盘距离 <= i, 所以 metric='chessboard' 和原来逐次膨胀的结果完全一样 (包括浮点累加顺序);
+# metric='euclidean' 用精确的欧氏距离变换, spacing 给定时距离单位是 mm, step / width 也按 mm 理解.
+# 输入可以是一层 (row, column) 也可以是一批 (..., row, column), 每层单独算, 层之间不互相影响.
+
+_far = np.iinfo(np.int32).max
+
+
+def _Structure(ndim):
+    # 只在最后两维 (层内) 相邻的 3x3 结构, 一批一起算时层之间不传递距离
+    structure = np.zeros((3,) * ndim, dtype=bool)
+    structure[(1,) * (ndim - 2)] = True
+    return structure
+
+
+def SeedDistance(seed, metric='chessboard', spacing=None):
+    '''
+    每个像素到同一层里 seed 的距离, seed 里是 0; 这一层没有 seed 时是 _far (chessboard, int32) / inf (euclidean).
+    '''
+    seed = np.asarray(seed).astype(bool)
+    if seed.ndim < 2:
+        raise ValueError('seed should be at least 2D, got {}D'.format(seed.ndim))
+    if metric == 'chessboard':
+        if seed.ndim == 2:
+            distance = ndimage.distance_transform_cdt(~seed, metric='chessboard')
+        else:
+            distance = ndimage.distance_transform_cdt(~seed, metric=_Structure(seed.ndim))
+        far = _far
+    elif metric == 'euclidean':
+        sampling = (1., 1.) if spacing is None else tuple(spacing)[-2:]
+        # 层之间的距离设得很大, 只有层内的 seed 有用; 没有 seed 的层下面单独置为 inf
+        sampling = (1e6,) * (seed.ndim - 2) + sampling
+        distance = ndimage.distance_transform_edt(~seed, sampling=sampling)
+        far = np.inf
+    else:
+        raise ValueError('metric should be chessboard or euclidean, got {}'.format(metric))
+
+    empty = ~seed.reshape(seed.shape[:-2] + (-1,)).any(axis=-1)
+    distance[empty] = far
+    return distance
+
+
+def _Ramp(value, distance, step):
+    '''
+    和 BlurryEdge 的循环一样: 第 0 次加 roi 本身的值, 之后第 i 次加膨胀了 i 次的 mask.
+    roi 是 0/1 时每个像素就是 (step - ceil(d)) 个 1/step 依次相加, 直接查表, 浮点结果也一样.
+    '''
+    if np.all((value == 0) | (value == 1)):
+        table = np.zeros(step + 1)
+        for index in range(1, step + 1):
+            table[index] = table[index - 1] + 1. / step
+        if distance.dtype.kind == 'f':
+            distance = np.ceil(np.minimum(distance, step))
+        count = step - np.minimum(distance, step).astype(np.int64)
+        return table[count]
+
+    result = np.zeros(distance.shape, dtype=float)
+    for index in range(step):
+        result += 1. / step * (value if index == 0 else (distance <= index).astype(float))
+    return result
+
+
+def BlurryEdge(roi, step=10, metric='chessboard', spacing=None):
+    roi = np.asarray(roi)
+    return _Ramp(roi.astype(float), SeedDistance(roi, metric, spacing), step)
+
+
+def ExtractEdge(roi, width=2, metric='chessboard', spacing=None):
+    '''
+    和 RoiDistanceMap.ExtractEdge(roi, np.ones((3, 3))) 一样: 膨胀 width 次减腐蚀 width 次, 返回 int 的 0/1.
+    kernel 为 np.ones((7, 7)) 时对应 width=6. 腐蚀时图像外面算背景.
+    '''
+    roi = np.asarray(roi).astype(bool)
+    if metric == 'chessboard' and width == int(width):
+        # 棋盘距离 <= width 就是 (2 * width + 1) 的方形最大/最小值滤波, 比距离变换快
+        size = (1,) * (roi.ndim - 2) + (2 * int(width) + 1,) * 2
+        roi = roi.astype(np.uint8)
+        outer = ndimage.maximum_filter(roi, size=size, mode='constant', cval=0)
+        inner = ndimage.minimum_filter(roi, size=size, mode='constant', cval=0)
+        return (outer - inner).astype(int)
+
+    outer = SeedDistance(roi, metric, spacing) <= width
+    pad = [(0, 0)] * (roi.ndim - 2) + [(1, 1), (1, 1)]
+    inner = SeedDistance(~np.pad(roi, pad), metric, spacing)[..., 1:-1, 1:-1] > width
+    return (outer & ~inner).astype(int)
+
+
+def DetectRegion(roi0, roi1, metric='chessboard', spacing=None):
+    roi0, roi1 = np.asarray(roi0), np.asarray(roi1)
+    roi0_edge = ExtractEdge(roi0, metric=metric, spacing=spacing)
+    roi1_edge = ExtractEdge(roi1, metric=metric, spacing=spacing)
+
+    roi1_out = roi1 - roi0
+    roi1_out[roi1_out < 0] = 0
+
+    region = roi1_out + (roi1_edge * roi0_edge)
+    region[region > 1] = 1
+    return region
+
+
+def DetectCloseRegion(roi0, roi1, step=10, metric='chessboard', spacing=None):
+    '''
+    两个边界同时膨胀到第一次接触: 接触的次数 index = ceil(min(max(d0, d1))), ratio = (step - index) / step,
+    diff 是膨胀 index 次以后重合的地方; step 次内没有接触时 diff 为 0, ratio 为 0. ratio 的形状是 (...).
+    '''
+    distance0 = SeedDistance(ExtractEdge(roi0, metric=metric, spacing=spacing), metric, spacing)
+    distance1 = SeedDistance(ExtractEdge(roi1, metric=metric, spacing=spacing), metric, spacing)
+    distance = np.maximum(distance0, distance1)
+    index = np.ceil(distance.reshape(distance.shape[:-2] + (-1,)).min(axis=-1).astype(float))
+    touch = index < step
+    ratio = np.where(touch, (step - np.where(touch, index, 0)) / step, 0.)
+    diff = (distance <= np.where(touch, index, -1)[..., np.newaxis, np.newaxis]).astype(int)
+    return diff, ratio
+
+
+def FindRegion(roi0, roi1, step=10, metric='chessboard', spacing=None):
+    '''
+    roi0: 前列腺, roi1: PCa, (row, column) 或 (..., row, column); 返回和 RoiDistanceMap.FindRegion 一样的 float 图.
+    '''
+    roi0, roi1 = np.asarray(roi0), np.asarray(roi1)
+    region = DetectRegion(roi0, roi1, metric, spacing)
+    blurry = BlurryEdge(region, step, metric, spacing)
+
+    # 没有交界的层: 两个边界一起膨胀到接触的地方, 乘上接触的早晚
+    close = region.reshape(region.shape[:-2] + (-1,)).sum(axis=-1) < 1
+    if np.any(close):
+        diff, ratio = DetectCloseRegion(roi0[close], roi1[close], step, metric, spacing)
+        blurry[close] = ratio[..., np.newaxis, np.newaxis] * BlurryEdge(diff, step, metric, spacing)
+    return blurry
+
+
+def FindRegionBatch(roi0_list, roi1_list, step=10, metric='chessboard', spacing=None):
+    # 一组同样大小的层, 一次算完
+    return FindRegion(np.stack(roi0_list), np.stack(roi1_list), step, metric, spacing)
+
+
+def _RandomPair(shape, rng):
+    roi0, roi1 = np.zeros(shape), np.zeros(shape)
+    center = rng.randint(shape[0] // 4, shape[0] * 3 // 4, size=2)
+    radius = rng.randint(shape[0] // 10, shape[0] // 4)
+    row, column = np.ogrid[:shape[0], :shape[1]]
+    roi0[(row - center[0]) ** 2 + (column - center[1]) ** 2 < radius ** 2] = 1
+    lesion_center = center + rng.randint(-radius - 10, radius + 10, size=2)
+    lesion_radius = rng.randint(3, max(4, radius // 2))
+    roi1[(row - lesion_center[0]) ** 2 + (column - lesion_center[1]) ** 2 < lesion_radius ** 2] = 1
+    if rng.uniform() < 0.3:
+        roi1 *= roi0
+    return roi0, roi1
+
+
+def CheckParity(number=200, shape=(184, 184), seed=0):
+    '''
+    随机的前列腺/病灶和 RoiDistanceMap.FindRegion (逐次膨胀) 比较, 返回最大的绝对误差, 应该是 0.
+    '''
+    from DistanceMap.RoiDistanceMap import FindRegionDilation
+    rng = np.random.RandomState(seed)
+    pair_list = [_RandomPair(shape, rng) for _ in range(number)]
+    roi0 = np.stack([one[0] for one in pair_list])
+    roi1 = np.stack([one[1] for one in pair_list])
+
+    batch = FindRegion(roi0, roi1)
+    error = 0.
+    for index in range(number):
+        try:
+            reference = FindRegionDilation(roi0[index], roi1[index])
+        except AssertionError:
+            # 原来的 DetectCloseRegion 里边界重合时的 assert
+            continue
+        error = max(error, np.abs(reference - batch[index]).max())
+        error = max(error, np.abs(reference - FindRegion(roi0[index], roi1[index])).max())
+    return error
+
+
+def BenchmarkFindRegion(number=1000, shape=(184, 184), seed=0):
+    from DistanceMap.RoiDistanceMap import FindRegionDilation
+    rng = np.random.RandomState(seed)
+    pair_list = [_RandomPair(shape, rng) for _ in range(number)]
+
+    start = time.perf_counter()
+    for roi0, roi1 in pair_list:
+        try:
+            FindRegionDilation(roi0, roi1)
+        except AssertionError:
+            pass
+    dilation_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    FindRegionBatch([one[0] for one in pair_list], [one[1] for one in pair_list])
+    transform_time = time.perf_counter() - start
+    print('{} slices: dilation {:.2f}s, distance transform {:.2f}s'.format(number, dilation_time, transform_time))
+    return dilation_time, transform_time
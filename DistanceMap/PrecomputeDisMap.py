@@ -0,0 +1,175 @@
+import os
+import time
+import hashlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# 整个队列的距离图 (FindRegion(prostate, pca), 可选 *0.8+0.2) 预计算:
+#     data_root/ProstateSlice/(Test/)key.npy + RoiSlice/(Test/)key.npy -> data_root/DistanceMap/(Test/)key.npy
+#     packed_folder 给定时同时写进 PackedStore 的 DistanceMap.npy (按 index.csv 的 row)
+# data_root/DistanceMap/dis_map_hash.csv 记录每层输入 (两个 ROI 的内容 + 参数) 的 hash, 只重算 ROI 变了的层.
+# 每个 worker 一次处理 batch_size 层, 同样大小的层用 DistanceTransform.FindRegion 一起算.
+
+hash_name = 'dis_map_hash.csv'
+
+
+def _Hash(prostate, pca, params):
+    digest = hashlib.sha1()
+    for one in [prostate, pca]:
+        one = np.ascontiguousarray(one)
+        digest.update('{}{}'.format(one.shape, one.dtype).encode())
+        digest.update(one.tobytes())
+    digest.update(params.encode())
+    return digest.hexdigest()
+
+
+def _Params(step, normalize, metric):
+    return 'step={},normalize={},metric={}'.format(step, normalize, metric)
+
+
+def _ComputeBatch(args):
+    '''
+    返回 [(key, split, hash, 是否重算, 距离图 或 None)]; 距离图只在 return_data 时返回 (没变的层读已有的 npy).
+    '''
+    from DistanceMap.DistanceTransform import FindRegion
+    (item_list, data_root, prostate_name, pca_name, target_name, step, normalize, metric, dtype,
+     return_data, known_hash) = args
+    params = _Params(step, normalize, metric)
+
+    todo, result = [], []
+    for key, split in item_list:
+        prostate = np.squeeze(np.load(os.path.join(data_root, prostate_name, split, key + '.npy')))
+        pca = np.squeeze(np.load(os.path.join(data_root, pca_name, split, key + '.npy')))
+        one_hash = _Hash(prostate, pca, params)
+        target_path = os.path.join(data_root, target_name, split, key + '.npy')
+        if known_hash.get((split, key)) == one_hash and os.path.exists(target_path):
+            result.append((key, split, one_hash, False, np.load(target_path) if return_data else None))
+        else:
+            todo.append((key, split, one_hash, prostate, pca))
+
+    # 同样大小的一起算
+    shape_dict = {}
+    for one in todo:
+        shape_dict.setdefault(one[3].shape, []).append(one)
+    for same_shape in shape_dict.values():
+        dis_map = FindRegion(np.stack([one[3] for one in same_shape]), np.stack([one[4] for one in same_shape]),
+                             step=step, metric=metric)
+        if normalize:
+            dis_map = dis_map * 0.8 + 0.2
+        dis_map = dis_map.astype(dtype)[:, np.newaxis]
+        for (key, split, one_hash, _, _), one_map in zip(same_shape, dis_map):
+            np.save(os.path.join(data_root, target_name, split, key + '.npy'), one_map)
+            result.append((key, split, one_hash, True, one_map if return_data else None))
+    return result
+
+
+def _ListKey(folder):
+    if not os.path.isdir(folder):
+        return set()
+    return set(one[:-len('.npy')] for one in os.listdir(folder) if one.endswith('.npy'))
+
+
+def PrecomputeDistanceMap(data_root, sub_folder_list=('', 'Test'), prostate_name='ProstateSlice', pca_name='RoiSlice',
+                          target_name='DistanceMap', normalize=False, step=10, metric='chessboard', dtype=np.float32,
+                          packed_folder=None, num_workers=None, batch_size=64, force=False, verbose=True):
+    '''
+    data_root: NPYNoDivide / SUH_Dwi1500 这样的目录; sub_folder_list: 要算的子目录, '' 是模态目录本身.
+    normalize: 和 NormailzeDisMap 一样 *0.8+0.2, 这时 target_name 一般用 'DistanceMap0.2'.
+    packed_folder: PackFolder 打包的目录, target_name.npy 里对应的行一起更新.
+    force: 忽略 hash 全部重算. 返回 hash 表 (DataFrame), 这次没算的子目录的记录保留在表里.
+    '''
+    hash_path = os.path.join(data_root, target_name, hash_name)
+    old_df = pd.DataFrame(columns=['key', 'split', 'hash'])
+    if os.path.exists(hash_path):
+        old_df = pd.read_csv(hash_path, dtype={'key': str, 'split': str}, keep_default_na=False)
+    # '' 和 Test 里可能有同名的 key, 按 (split, key) 区分
+    known_hash = {} if force else dict(zip(zip(old_df['split'], old_df['key']), old_df['hash']))
+
+    item_list = []
+    for sub_folder in sub_folder_list:
+        key_set = _ListKey(os.path.join(data_root, prostate_name, sub_folder)) & \
+                  _ListKey(os.path.join(data_root, pca_name, sub_folder))
+        os.makedirs(os.path.join(data_root, target_name, sub_folder), exist_ok=True)
+        item_list += [(key, sub_folder) for key in sorted(key_set)]
+    if len(item_list) == 0:
+        # 没有层要算, packed 和已有的 hash 表都不动
+        if verbose:
+            print('{}: no slices in {}'.format(os.path.join(data_root, target_name), list(sub_folder_list)))
+        return old_df
+
+    store, row_dict = None, {}
+    if packed_folder is not None:
+        store, row_dict = _OpenPacked(packed_folder, target_name, data_root, prostate_name, item_list[:1])
+
+    args = []
+    for start in range(0, len(item_list), batch_size):
+        batch = item_list[start:start + batch_size]
+        # 每个 batch 只带自己的 hash, 不把整个表发给每个任务
+        batch_hash = {(split, key): known_hash[(split, key)] for key, split in batch if (split, key) in known_hash}
+        args.append((batch, data_root, prostate_name, pca_name, target_name, step, normalize, metric, dtype,
+                     store is not None, batch_hash))
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    rows, computed = [], 0
+    with multiprocessing.Pool(num_workers) if num_workers > 1 else _Serial() as pool:
+        for index, result in enumerate(pool.imap_unordered(_ComputeBatch, args)):
+            for key, split, one_hash, is_computed, one_map in result:
+                rows.append({'key': key, 'split': split, 'hash': one_hash})
+                computed += int(is_computed)
+                if store is not None and (split, key) in row_dict:
+                    store[row_dict[(split, key)]] = one_map
+            if verbose and (index + 1) % 20 == 0:
+                print('{} / {} slices, {} computed, {:.1f}s'.format(len(rows), len(item_list), computed,
+                                                                  time.perf_counter() - start))
+    if store is not None:
+        store.flush()
+        del store
+
+    hash_df = pd.DataFrame(rows, columns=['key', 'split', 'hash'])
+    # 和已有的表合并, 同一个 (split, key) 用这次的
+    hash_df = pd.concat([old_df, hash_df]).drop_duplicates(['split', 'key'], keep='last')
+    hash_df = hash_df.sort_values(['split', 'key']).reset_index(drop=True)
+    hash_df.to_csv(hash_path + '.tmp', index=False)
+    os.replace(hash_path + '.tmp', hash_path)
+    if verbose:
+        print('{}: {} slices, {} computed, {} unchanged in {:.1f}s'.format(
+            os.path.join(data_root, target_name), len(rows), computed, len(rows) - computed,
+            time.perf_counter() - start))
+    return hash_df
+
+
+class _Serial(object):
+    # num_workers=1 时和 Pool 一样的接口
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap_unordered(self, func, iterable):
+        return map(func, iterable)
+
+
+def _OpenPacked(packed_folder, target_name, data_root, prostate_name, first_item):
+    # 打开 (没有就新建) PackedStore 里 target_name.npy, 返回 memmap 和 (split, key) -> row
+    index_df = pd.read_csv(os.path.join(packed_folder, 'index.csv'), dtype={'key': str, 'split': str},
+                           keep_default_na=False)
+    path = os.path.join(packed_folder, target_name + '.npy')
+    if os.path.exists(path):
+        store = np.load(path, mmap_mode='r+')
+    else:
+        key, split = first_item[0]
+        shape = np.load(os.path.join(data_root, prostate_name, split, key + '.npy')).shape
+        store = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(index_df),) + shape)
+    return store, dict(zip(zip(index_df['split'], index_df['key']), index_df['row']))
+
+
+if __name__ == '__main__':
+    root = r'/home/zhangyihong/Documents/ProstateECE'
+    PrecomputeDistanceMap(root + '/NPYNoDivide', sub_folder_list=['', 'Test'])
+    PrecomputeDistanceMap(root + '/NPYNoDivide', sub_folder_list=['', 'Test'], normalize=True,
+                          target_name='DistanceMap0.2')
+    PrecomputeDistanceMap(root + '/SUH_Dwi1500', sub_folder_list=[''])
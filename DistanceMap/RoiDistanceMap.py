@@ -68,7 +68,18 @@ def DetectCloseRegion(roi0, roi1, step=10, kernel=np.ones((3, 3))):
     return diff, ratio
 
 
-def FindRegion(roi0, roi1):
+def FindRegion(roi0, roi1, backend='transform'):
+    '''
+    backend='transform': 用距离变换一次算完, 可以一批层一起算, 结果和逐次膨胀一样, 见 DistanceTransform
+    backend='dilation': 原来逐次膨胀的做法
+    '''
+    if backend == 'dilation':
+        return FindRegionDilation(roi0, roi1)
+    from DistanceMap.DistanceTransform import FindRegion as FindRegionTransform
+    return FindRegionTransform(roi0, roi1)
+
+
+def FindRegionDilation(roi0, roi1):
     # 寻找结合点
     step = 10
     region = DetectRegion(roi0, roi1)
@@ -0,0 +1,156 @@
+import time
+import numpy as np
+from scipy import ndimage
+
+# 整个 volume 一次算注意力图 (和 FindRegion 一样的定义), 距离按 NIfTI 的 spacing 算成 mm:
+#     mode='volume': 三维的欧氏距离, 相邻层的交界/病灶也会影响这一层
+#     mode='slice':  每层单独算 (和 2D 的 FindRegion 一样), 只是层内的距离是 mm, 整个 volume 一起向量化
+# 距离的单位是 unit (mm), 每 unit 一级, 共 step 级; unit 默认是层内的 spacing, 这时 mode='slice' 的 3x3 膨胀
+# 换成了欧氏距离, 其余和原来一样. 输入输出都是 (slice, row, column), 算一次以后按层取 2D 的图, 不用逐层再算.
+
+
+def LoadVolume(path):
+    # 返回 (slice, row, column) 的数组和对应的 spacing (mm)
+    import SimpleITK as sitk
+    image = sitk.ReadImage(path)
+    return sitk.GetArrayFromImage(image), tuple(image.GetSpacing()[::-1])
+
+
+def _Distance(seed, sampling):
+    # 到 seed 的欧氏距离 (单位 unit), 没有 seed 时是 inf
+    if not np.any(seed):
+        return np.full(seed.shape, np.inf)
+    return ndimage.distance_transform_edt(~seed, sampling=sampling)
+
+
+def _Edge(roi, width, sampling):
+    # 和 DistanceTransform.ExtractEdge 一样: 外扩 width 减内缩 width, volume 外面算背景
+    outer = _Distance(roi, sampling) <= width
+    inner = _Distance(~np.pad(roi, 1), sampling)[(slice(1, -1),) * roi.ndim] > width
+    return outer & ~inner
+
+
+def _VolumeRegion(prostate, pca, step, width, sampling):
+    from DistanceMap.DistanceTransform import _Ramp
+    prostate_edge = _Edge(prostate, width, sampling)
+    pca_edge = _Edge(pca, width, sampling)
+    region = (pca & ~prostate) | (prostate_edge & pca_edge)
+    if np.any(region):
+        return _Ramp(region.astype(float), _Distance(region, sampling), step)
+
+    # 没有交界: 两个边界一起外扩到接触的地方, 乘上接触的早晚
+    distance = np.maximum(_Distance(prostate_edge, sampling), _Distance(pca_edge, sampling))
+    index = np.ceil(distance.min())
+    if not index < step:
+        return np.zeros(prostate.shape)
+    diff = distance <= index
+    return (step - index) / step * _Ramp(diff.astype(float), _Distance(diff, sampling), step)
+
+
+def VolumeFindRegion(prostate, pca, spacing, step=10, unit=None, width=2, mode='volume'):
+    '''
+    prostate / pca: (slice, row, column) 的 mask; spacing: 同样顺序的 mm.
+    unit: 每一级多少 mm, 默认是层内最小的 spacing; width: 边界的宽度 (级).
+    返回 (slice, row, column) 的 float 图, 取 [slice] 就是这一层的 2D 图.
+    '''
+    prostate, pca = np.asarray(prostate) > 0.5, np.asarray(pca) > 0.5
+    if prostate.ndim != 3 or prostate.shape != pca.shape:
+        raise ValueError('prostate and pca should be 3D with the same shape, got {} and {}'.format(
+            prostate.shape, pca.shape))
+    if mode not in ['volume', 'slice']:
+        raise ValueError('mode should be volume or slice, got {}'.format(mode))
+    spacing = np.asarray(spacing, dtype=float)
+    unit = spacing[1:].min() if unit is None else float(unit)
+
+    # 结果只在两个 mask 外面 2 * step + width 级以内不为 0 (边界 width, 接触 step, 模糊 step), 只算这个范围
+    result = np.zeros(prostate.shape)
+    crop = _Crop(prostate | pca, (2 * step + width + 1) * unit / spacing, mode)
+    if crop is None:
+        return result
+    prostate, pca = prostate[crop], pca[crop]
+
+    if mode == 'slice':
+        from DistanceMap.DistanceTransform import FindRegion
+        result[crop] = FindRegion(prostate.astype(float), pca.astype(float), step, metric='euclidean',
+                                  spacing=tuple(spacing[1:] / unit))
+    else:
+        result[crop] = _VolumeRegion(prostate, pca, step, width, tuple(spacing / unit))
+    return result
+
+
+def _Crop(mask, margin, mode):
+    # mask 的包围盒每边外扩 margin 个体素; mode='slice' 时层之间不扩
+    if not np.any(mask):
+        return None
+    crop = []
+    for axis, one in enumerate(margin):
+        index = np.flatnonzero(mask.any(axis=tuple(other for other in range(mask.ndim) if other != axis)))
+        one = 0 if (mode == 'slice' and axis == 0) else int(np.ceil(one))
+        crop.append(slice(max(0, index[0] - one), min(mask.shape[axis], index[-1] + one + 1)))
+    return tuple(crop)
+
+
+def CaseAttention(case_folder, prostate_name='prostate_roi_5x5.nii.gz', pca_name='pca_roi_5x5.nii.gz',
+                  slice_list=None, **kwargs):
+    '''
+    一个 case 一次算完, 返回 {slice: 2D 注意力图}; slice_list 默认是有 PCa 的层.
+    '''
+    import os
+    prostate, spacing = LoadVolume(os.path.join(case_folder, prostate_name))
+    pca, _ = LoadVolume(os.path.join(case_folder, pca_name))
+    attention = VolumeFindRegion(prostate, pca, spacing, **kwargs)
+    if slice_list is None:
+        slice_list = [index for index in range(pca.shape[0]) if np.any(pca[index])]
+    return {index: attention[index] for index in slice_list}
+
+
+def _RandomVolume(shape, rng):
+    # 椭球的前列腺和一个小的病灶, 30% 的病灶在前列腺里面
+    grid = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    center = np.array(shape) // 2 + rng.randint(-5, 6, size=3) * np.array([0, 1, 1])
+    radius = np.array([shape[0] // 3, shape[1] // 4, shape[2] // 4])
+    prostate = sum(((one - c) / r) ** 2 for one, c, r in zip(grid, center, radius)) < 1
+    lesion_center = center + rng.randint(-1, 2, size=3) * radius // 2
+    lesion_radius = np.maximum(radius // 3, 1)
+    pca = sum(((one - c) / r) ** 2 for one, c, r in zip(grid, lesion_center, lesion_radius)) < 1
+    if rng.uniform() < 0.3:
+        pca &= prostate
+    return prostate.astype(float), pca.astype(float)
+
+
+def BenchmarkVolume(number=10, shape=(24, 280, 280), spacing=(3., 0.5, 0.5), seed=0):
+    '''
+    一个 case 所有层的注意力图: 原来逐层 RoiDistanceMap.FindRegionDilation / 逐层 DistanceTransform.FindRegion
+    vs. 整个 volume 一次 (mode='slice' / 'volume').
+    '''
+    from DistanceMap.RoiDistanceMap import FindRegionDilation
+    from DistanceMap.DistanceTransform import FindRegion
+    rng = np.random.RandomState(seed)
+    volume_list = [_RandomVolume(shape, rng) for _ in range(number)]
+
+    def _Time(func):
+        start = time.perf_counter()
+        for prostate, pca in volume_list:
+            func(prostate, pca)
+        return (time.perf_counter() - start) / number
+
+    def _Dilation(prostate, pca):
+        for index in range(prostate.shape[0]):
+            try:
+                FindRegionDilation(prostate[index], pca[index])
+            except AssertionError:
+                pass
+
+    result = {'dilation per slice': _Time(_Dilation),
+              'transform per slice': _Time(lambda prostate, pca: [FindRegion(prostate[index], pca[index])
+                                                                 for index in range(prostate.shape[0])]),
+              'volume, mode=slice': _Time(lambda prostate, pca: VolumeFindRegion(prostate, pca, spacing,
+                                                                                 mode='slice')),
+              'volume, mode=volume': _Time(lambda prostate, pca: VolumeFindRegion(prostate, pca, spacing))}
+    for key, value in result.items():
+        print('{:>20}: {:.3f}s / case'.format(key, value))
+    return result
+
+
+if __name__ == '__main__':
+    BenchmarkVolume()
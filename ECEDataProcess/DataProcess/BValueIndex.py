@@ -0,0 +1,102 @@
+import os
+import re
+import numpy as np
+
+# 每个 case 有哪些 b 值, 在哪个文件的第几个 volume, 整个队列只扫描一次:
+#     dwi.nii + dwi.bval -> 4D, volume 是 bval 里的位置; 只有一个 b 值时 volume 为 None
+#     dki.nii + dki.bval -> 同上
+#     dwi_b1500.nii / dki_b1500.nii -> 分开存的 3D, volume 为 None
+# 优先级和 SelectDWI.GetDWIPath 一样: dwi.nii > dki.nii > 分开存的文件.
+# 选中的 volume 用 nibabel 的 memmap 只读那一个, 不再整个 4D 读进来.
+
+_separate = re.compile(r'^(dwi|dki)_b(\d+(?:\.\d+)?)\.nii$')
+
+
+def ParseBval(bval_path):
+    with open(bval_path, 'r') as file:
+        return file.read().split()
+
+
+def NearestB(b_list, target=1500):
+    # 和 SelectDWI.NearTrueB 一样, 距离相同时取前面的
+    distance = [abs(float(one) - target) for one in b_list]
+    index = distance.index(min(distance))
+    return b_list[index], index
+
+
+def CaseBValues(case_path):
+    '''
+    返回 [{'b': '1500', 'file': 'dwi.nii', 'volume': 3, 'source': 'dwi'}, ...], 只 listdir 一次.
+    '''
+    file_set = set(os.listdir(case_path)) if os.path.isdir(case_path) else set()
+    for source in ['dwi', 'dki']:
+        if source + '.nii' in file_set and source + '.bval' in file_set:
+            b_list = ParseBval(os.path.join(case_path, source + '.bval'))
+            if len(b_list) == 1:
+                return [{'b': b_list[0], 'file': source + '.nii', 'volume': None, 'source': source}]
+            return [{'b': b, 'file': source + '.nii', 'volume': index, 'source': source}
+                    for index, b in enumerate(b_list)]
+
+    entries = []
+    for file in sorted(file_set):
+        match = _separate.match(file)
+        if match is not None:
+            entries.append({'b': match.group(2), 'file': file, 'volume': None, 'source': 'separate'})
+    return entries
+
+
+def BuildBValueIndex(process_folder, case_list=None):
+    # {case: CaseBValues}, 没有 manifest 时用
+    if case_list is None:
+        case_list = sorted(one for one in os.listdir(process_folder) if os.path.isdir(os.path.join(process_folder, one)))
+    return {case: CaseBValues(os.path.join(process_folder, case)) for case in case_list}
+
+
+def SelectB(entries, target=1500, b_value=None, prefix=None):
+    '''
+    4D 的取和 target 最近的 b; 分开存的取最大的 (只看 b_value 里有的, 和原来倒序找 dwi_b*.nii 一样),
+    prefix='dwi' 时分开存的只看 dwi_b*.nii. 没有 DWI 时返回 None.
+    '''
+    if len(entries) == 0:
+        return None
+    if entries[0]['source'] != 'separate':
+        _, index = NearestB([one['b'] for one in entries], target)
+        return entries[index]
+
+    if prefix is not None:
+        entries = [one for one in entries if one['file'].startswith(prefix)]
+    if b_value is not None:
+        b_value = [float(one) for one in b_value]
+        entries = [one for one in entries if float(one['b']) in b_value]
+    if len(entries) == 0:
+        return None
+    # b 一样时 dwi_b 优先于 dki_b
+    return max(entries, key=lambda one: (float(one['b']), one['file'].startswith('dwi')))
+
+
+def ReadDwiVolume(case_path, entry):
+    '''
+    只读选中的那个 volume, 返回和 sitk.GetArrayFromImage 一样的 (slice, row, column).
+    未压缩的 .nii 用 memmap, 只有这个 volume 的数据被读进内存.
+    '''
+    import nibabel as nib
+    image = nib.load(os.path.join(case_path, entry['file']), mmap=True)
+    if entry['volume'] is None or len(image.shape) == 3:
+        data = np.asarray(image.dataobj)
+    else:
+        data = np.asarray(image.dataobj[..., entry['volume']])
+    return np.transpose(data, (2, 1, 0))
+
+
+def DwiVolumeImage(case_path, entry, ref_path):
+    # 选中的 volume 作为 3D 的 SimpleITK 图像, 空间信息用 ref_path (adc.nii) 的头, 和 GetDWIPath 原来的做法一样
+    import SimpleITK as sitk
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(ref_path)
+    reader.ReadImageInformation()
+
+    image = sitk.GetImageFromArray(ReadDwiVolume(case_path, entry))
+    image.SetDirection(reader.GetDirection())
+    image.SetSpacing(reader.GetSpacing())
+    image.SetOrigin(reader.GetOrigin())
+    return image
@@ -0,0 +1,70 @@
+import numpy as np
+from scipy import ndimage
+from concurrent.futures import ThreadPoolExecutor
+
+# ROI 连通域: 只 label 一次, 用 bincount 算每个连通域的体积, 最大的连通域/体积/包围盒/重心一起得到.
+# connectivity: 3D 为 6/18/26, 2D 为 4/8; 默认 6 和 ndimage.label 的默认结构一样.
+
+_rank = {6: 1, 18: 2, 26: 3, 4: 1, 8: 2}
+
+
+def Structure(connectivity, ndim):
+    if connectivity not in _rank:
+        raise ValueError('connectivity should be one of {}, got {}'.format(sorted(_rank), connectivity))
+    rank = _rank[connectivity]
+    if rank > ndim:
+        raise ValueError('connectivity {} needs at least {}D data, got {}D'.format(connectivity, rank, ndim))
+    return ndimage.generate_binary_structure(ndim, rank)
+
+
+def LabelComponents(mask, connectivity=6):
+    mask = np.asarray(mask)
+    return ndimage.label(mask, structure=Structure(connectivity, mask.ndim))
+
+
+def ComponentStats(label_im, nb_labels):
+    '''
+    每个连通域的 {'label', 'volume', 'bbox', 'centroid'}, 按 label 排序.
+    bbox 是每一维的 (start, stop), stop 不包含; centroid 是体素坐标.
+    '''
+    index = np.nonzero(label_im)
+    labels = label_im[index]
+    volume = np.bincount(labels, minlength=nb_labels + 1)
+    centroid = [np.bincount(labels, weights=one, minlength=nb_labels + 1) / np.maximum(volume, 1) for one in index]
+    stats = []
+    for label, box in enumerate(ndimage.find_objects(label_im, max_label=nb_labels), start=1):
+        if box is None:
+            continue
+        stats.append({'label': label, 'volume': int(volume[label]),
+                      'bbox': tuple((one.start, one.stop) for one in box),
+                      'centroid': tuple(float(one[label]) for one in centroid)})
+    return stats
+
+
+def KeepLargest(mask, connectivity=6, return_stats=False):
+    '''
+    和 MaxRoi.KeepLargest 的返回一样: (label_im, nb_labels, new_mask), new_mask 是 float64 的 0/1;
+    体积一样大时取 label 小的那个. return_stats=True 时多返回每个连通域的 ComponentStats.
+    '''
+    label_im, nb_labels = LabelComponents(mask, connectivity)
+    new_mask = np.zeros(label_im.shape)
+    if nb_labels > 0:
+        volume = np.bincount(label_im.ravel(), minlength=nb_labels + 1)
+        new_mask[label_im == np.argmax(volume[1:]) + 1] = 1
+    if return_stats:
+        return label_im, nb_labels, new_mask, ComponentStats(label_im, nb_labels)
+    return label_im, nb_labels, new_mask
+
+
+def KeepLargestBatch(mask_list, connectivity=6, return_stats=False, num_workers=None):
+    # ndimage.label 和 numpy 的运算大部分不占 GIL, 用线程池就可以, 不用拷贝数据到子进程
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(lambda mask: KeepLargest(mask, connectivity, return_stats), mask_list))
+
+
+def ComponentStatsBatch(mask_list, connectivity=6, num_workers=None):
+    def One(mask):
+        return ComponentStats(*LabelComponents(mask, connectivity))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(One, mask_list))
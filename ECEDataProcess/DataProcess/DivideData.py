@@ -10,34 +10,16 @@ from ECEDataProcess.DataProcess.SelectDWI import NearTrueB
 # 正负样本比例1:3
 # b值800的在test
 
-def GetBValue(case, b_value):
+def GetBValue(case, b_value, entries=None):
+    # entries: BValueIndex 里这个 case 的记录, None 时现场扫描
+    from ECEDataProcess.DataProcess.BValueIndex import CaseBValues, SelectB
     if case == 'WYB^wu yi bao' or case == 'ZYB^zhang yun bao':
         return 0
-    case_path = os.path.join(process_folder, case)
-    if os.path.exists(os.path.join(case_path, 'dwi.nii')):
-        bval_path = os.path.join(case_path, 'dwi.bval')
-        bval = open(bval_path, 'r')
-        b_list = bval.read().split()
-        if len(b_list) == 1:
-            return b_list[0]
-        else:
-            b, index = NearTrueB(b_list)
-            return b
-
-    elif os.path.exists(os.path.join(case_path, 'dki.nii')):
-        bval_path = os.path.join(case_path, 'dki.bval')
-        bval = open(bval_path, 'r')
-        b_list = bval.read().split()
-        if len(b_list) == 1:
-            return b_list[0]
-        else:
-            b, index = NearTrueB(b_list)
-            return b
-
-    else:
-        for b in reversed(b_value):
-            if os.path.exists(os.path.join(case_path, 'dwi_b' + str(b) + '.nii')):
-                return b
+    if entries is None:
+        entries = CaseBValues(os.path.join(process_folder, case))
+    entry = SelectB(entries, b_value=b_value, prefix='dwi')
+    if entry is not None:
+        return entry['b']
 
 def StatisticsECE(folder):
     ece_number = 0
@@ -148,9 +130,9 @@ def CopyData(des_folder, folder):
 if __name__ == '__main__':
     import pandas as pd
     # b_value = ['0', '50', '700', '750', '1400', '1500']
-    # case_list = os.listdir(process_folder)
-    # for case in case_list:
-    #     b = GetBValue(case, b_value)
+    # b_index = BuildBValueIndex(process_folder)
+    # for case, entries in b_index.items():
+    #     b = GetBValue(case, b_value, entries)
     #     if isinstance(b, str):
     #         if float(b) < 1200:
     #             print(case)
@@ -0,0 +1,147 @@
+import os
+import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
+import SimpleITK as sitk
+
+# 按 spacing 把 ADC / 每个 b 值的 DWI / ROI 重采样到 T2 的网格上 (和 Registrator.RegistrateBySpacing 一样只用恒等变换).
+# T2 的网格 (size/spacing/origin/direction) 每个 case 只读一次头文件, 每个序列一个 ResampleImageFilter, 在线程池里同时跑;
+# SimpleITK 的 Execute 不占 GIL, 每个 filter 用 sitk_threads 个 ITK 线程, 总线程数 = num_workers * sitk_threads.
+# 图像用 linear 插值, 像素类型和输入一样, ROI 用 nearest; 和 Registrator 的结果可以用 CompareWithRegistrator 对比.
+
+
+class ReferenceGrid(object):
+    def __init__(self, image_path):
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(image_path)
+        # 只读头, 不读像素
+        reader.ReadImageInformation()
+        self.size = reader.GetSize()[:3]
+        self.spacing = reader.GetSpacing()[:3]
+        self.origin = reader.GetOrigin()[:3]
+        direction = reader.GetDirection()
+        if len(direction) == 16:
+            direction = direction[0:3] + direction[4:7] + direction[8:11]
+        self.direction = direction
+
+    def IsSame(self, image_path, tolerance=1e-4):
+        # 已经在 T2 网格上的文件 (比如在 T2 上画的 roi) 不用重采样
+        other = ReferenceGrid(image_path)
+        if other.size != self.size:
+            return False
+        for one, two in [(self.spacing, other.spacing), (self.origin, other.origin), (self.direction, other.direction)]:
+            if any(abs(a - b) > tolerance for a, b in zip(one, two)):
+                return False
+        return True
+
+    def Filter(self, is_roi=False, interpolator=sitk.sitkLinear, num_threads=1):
+        resample_filter = sitk.ResampleImageFilter()
+        resample_filter.SetSize(self.size)
+        resample_filter.SetOutputSpacing(self.spacing)
+        resample_filter.SetOutputOrigin(self.origin)
+        resample_filter.SetOutputDirection(self.direction)
+        resample_filter.SetTransform(sitk.Transform(3, sitk.sitkIdentity))
+        resample_filter.SetDefaultPixelValue(0)
+        resample_filter.SetInterpolator(sitk.sitkNearestNeighbor if is_roi else interpolator)
+        resample_filter.SetNumberOfThreads(num_threads)
+        return resample_filter
+
+
+def StorePath(moving_path):
+    # adc.nii -> adc_Reg.nii, 和 Registrator.GenerateStorePath 的命名一样
+    for suffix in ['.nii.gz', '.nii']:
+        if moving_path.endswith(suffix):
+            return moving_path[:-len(suffix)] + '_Reg' + suffix
+    return moving_path + '_Reg'
+
+
+def ResampleToGrid(moving_path, grid, store_path=None, is_roi=False, interpolator=sitk.sitkLinear, num_threads=1):
+    # 返回用时 (秒)
+    start = time.perf_counter()
+    moving = sitk.ReadImage(moving_path)
+    output = grid.Filter(is_roi, interpolator, num_threads).Execute(moving)
+    sitk.WriteImage(output, StorePath(moving_path) if store_path is None else store_path)
+    return time.perf_counter() - start
+
+
+def CaseMovingList(case_folder, dwi_list=None, roi_list=None):
+    '''
+    [(名字, 路径, is_roi)]: adc.nii, dwi_list (默认是分开以后的所有 dwi_b*.nii), roi_list 里存在的文件.
+    '''
+    moving_list = [('ADC', os.path.join(case_folder, 'adc.nii'), False)]
+    if dwi_list is None:
+        dwi_list = sorted(one for one in glob.glob(os.path.join(case_folder, 'dwi_b[0-9]*.nii'))
+                          if not one.endswith('_Reg.nii'))
+    moving_list += [('DWI', one, False) for one in dwi_list]
+    for one in [] if roi_list is None else roi_list:
+        path = os.path.join(case_folder, one)
+        if os.path.exists(path):
+            moving_list.append(('ROI', path, True))
+    return moving_list
+
+
+def RegistrateCase(fixed_path, moving_list, num_workers=None, sitk_threads=None, interpolator=sitk.sitkLinear,
+                   pool_size=1, verbose=True):
+    '''
+    fixed_path: t2.nii; moving_list: CaseMovingList 的结果.
+    num_workers 默认同时跑所有序列; sitk_threads 默认把 CPU 平分给每个序列;
+    pool_size: 同时在跑的 case 数 (AutoProcessor 的进程池大小), 默认的 sitk_threads 再除以它.
+    返回 (is_work, message, times), times 是 {路径: 秒, 'grid': 秒, 'total': 秒}; 失败时 message 和原来一样是 'Align ADC Failed'.
+    '''
+    start = time.perf_counter()
+    grid = ReferenceGrid(fixed_path)
+    times = {'grid': time.perf_counter() - start}
+
+    # 已经在 T2 网格上的 ROI 跳过
+    moving_list = [one for one in moving_list if not (one[2] and grid.IsSame(one[1]))]
+    if len(moving_list) == 0:
+        times['total'] = time.perf_counter() - start
+        return True, '', times
+    if num_workers is None:
+        num_workers = len(moving_list)
+    num_workers = max(1, min(num_workers, len(moving_list)))
+    if sitk_threads is None:
+        sitk_threads = max(1, (os.cpu_count() or 1) // (num_workers * max(1, pool_size)))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        future_list = [(name, path, executor.submit(ResampleToGrid, path, grid, None, is_roi, interpolator,
+                                                    sitk_threads))
+                       for name, path, is_roi in moving_list]
+        message = ''
+        for name, path, future in future_list:
+            try:
+                times[path] = future.result()
+            except Exception as e:
+                if verbose:
+                    print('Align {} Failed: {}, {}'.format(name, path, e))
+                if message == '':
+                    message = 'Align {} Failed'.format(name)
+
+    times['total'] = time.perf_counter() - start
+    if verbose:
+        print('Registrate {} series of {} in {:.2f}s ({} workers x {} sitk threads)'.format(
+            len(moving_list), os.path.dirname(fixed_path), times['total'], num_workers, sitk_threads))
+    return message == '', message, times
+
+
+def CompareWithRegistrator(fixed_path, moving_path, is_roi=False, interpolator=sitk.sitkLinear):
+    '''
+    同一个序列分别用 ResampleToGrid 和 MIP4AIM 的 Registrator.RegistrateBySpacing 重采样, 返回 (最大绝对误差, 两个像素类型).
+    '''
+    import tempfile
+    import numpy as np
+    from MIP4AIM.NiiProcess.Registrator import Registrator
+    with tempfile.TemporaryDirectory() as folder:
+        grid_path = os.path.join(folder, 'grid.nii')
+        registrator_path = os.path.join(folder, 'registrator.nii')
+        ResampleToGrid(moving_path, ReferenceGrid(fixed_path), grid_path, is_roi, interpolator)
+
+        registrator = Registrator()
+        registrator.fixed_image = fixed_path
+        registrator.moving_image = moving_path
+        registrator.RegistrateBySpacing(store_path=registrator_path)
+
+        grid_image, registrator_image = sitk.ReadImage(grid_path), sitk.ReadImage(registrator_path)
+        error = np.abs(sitk.GetArrayFromImage(grid_image).astype(float) -
+                       sitk.GetArrayFromImage(registrator_image).astype(float)).max()
+        return float(error), (grid_image.GetPixelIDTypeAsString(), registrator_image.GetPixelIDTypeAsString())
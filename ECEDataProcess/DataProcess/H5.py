@@ -37,12 +37,19 @@ def CropRoiData(roi_data, crop_shape, slice_index, center):
 
 
 # MakeH5()
-def WriteH5(data_folder, save_path):
+def WriteH5(data_folder, save_path, writer=None):
+    '''
+    writer: H5Dataset.H5Writer, 所有 case 追加到同一个 h5 里, 已经写过的 case 跳过;
+            None 时和原来一样每个 case 一个 .h5, 写到 save_path 目录下.
+    '''
     from ECEDataProcess.DataProcess.MaxRoi import SelectMaxRoiSlice, GetRoiCenter, KeepLargest
+    from ECEDataProcess.DataProcess.SliceExtractor import ExtractSlices
     case_list = os.listdir(data_folder)
     crop_shape = (1, 280, 280)
 
     for case in case_list:
+        if writer is not None and case in writer:
+            continue
         # path
         case_path = os.path.join(data_folder, case)
         t2_path = os.path.join(case_path, 't2.nii')
@@ -66,17 +73,20 @@ def WriteH5(data_folder, save_path):
 
         slice = SelectMaxRoiSlice(new_roi)
 
-        center = GetRoiCenter(new_roi[slice, ...])
+        center, _ = GetRoiCenter(new_roi[slice, ...])
 
-        t2_slice = CropT2Data(t2, crop_shape, slice, center=center)
-        dwi_slice = CropT2Data(dwi, crop_shape, slice, center=center)
-        adc_slice = CropT2Data(adc, crop_shape, slice, center=center)
-        roi_slice = CropRoiData(new_roi, crop_shape, slice, center=center)
+        # (1, 4, 280, 280), 一次裁剪+归一化, 不改 t2/dwi/adc
+        crop = ExtractSlices([t2, dwi, adc, new_roi], [slice], [center], crop_shape=crop_shape[1:],
+                             is_roi_list=[False, False, False, True])[0]
+        t2_slice_3d = crop[0:1]
+        dwi_slice_3d = crop[1:2]
+        adc_slice_3d = crop[2:3]
+        roi_slice_3d = crop[3:4]
 
-        t2_slice_3d = t2_slice[np.newaxis, ...]
-        dwi_slice_3d = dwi_slice[np.newaxis, ...]
-        adc_slice_3d = adc_slice[np.newaxis, ...]
-        roi_slice_3d = roi_slice[np.newaxis, ...]
+        if writer is not None:
+            writer.Append(case, {'input_0': t2_slice_3d, 'output_0': roi_slice_3d, 'output_1': ece,
+                                 'slice': np.int16(slice)})
+            continue
 
         dataname = case + '_slice' + str(slice) + '.h5'
         datapath = os.path.join(save_path, dataname)
@@ -146,7 +156,7 @@ def ShowH5():
 
 
 def Checkb():
-    from ECEDataProcess.DataProcess.SelectDWI import NearTrueB
+    from ECEDataProcess.DataProcess.BValueIndex import BuildBValueIndex, SelectB, ReadDwiVolume
     case_list = ['CSF^chen song fu', 'CYX^chen yu xiang', 'DRJ^dai ru jiang', 'DSB^dai song bo ^^6698-7', 'GJD^guo jin dong',
                  'GU SI KANG', 'HGH^he gong huang', 'HGH^hu guo hua', 'JIANG HONG GEN', 'JLS^jiang li shan', 'LEC^liu er chang ^^6698-13',
                  'LHP^lu hao pei ^^6698-40', 'LJJ^lu qi jia', 'LJY^liu jia yan', 'LU JI SHUN', 'LYZ^liu yin zhong','LZW^li zhong wei',
@@ -156,38 +166,22 @@ def Checkb():
 
     path = r'X:\PrcoessedData\ProstateCancerECE'
 
+    b_index = BuildBValueIndex(path, case_list)
     for case in case_list:
         case_path = os.path.join(path, case)
-        dwi_bval_path = os.path.join(case_path, 'dwi.bval')
-        dki_bval_path = os.path.join(case_path, 'dki.bval')
-        if os.path.exists(dwi_bval_path):
-            bval = open(dwi_bval_path, 'r')
-            b_list = bval.read().split()
-            b, index = NearTrueB(b_list)
-            _, _, dwi = LoadNiiData(os.path.join(case_path, 'dwi.nii'))
-            Imshow3DArray(Normalize01(dwi[..., index]))
-            print(case, b)
-        elif os.path.exists(dki_bval_path):
-            bval = open(dki_bval_path, 'r')
-            b_list = bval.read().split()
-            b, index = NearTrueB(b_list)
-            _, _, dki = LoadNiiData(os.path.join(case_path, 'dki.nii'))
-            Imshow3DArray(Normalize01(dki[..., index]))
-            print(case, b)
-        else:
-            for b in reversed(b_value):
-                if os.path.exists(os.path.join(case_path, 'dwi_b'+str(b)+'.nii')):
-                    _, _, dwi = LoadNiiData(os.path.join(case_path, 'dwi_b'+str(b)+'.nii'))
-                    Imshow3DArray(Normalize01(dwi))
-                    print(case, b)
-                    break
+        entry = SelectB(b_index[case], b_value=b_value, prefix='dwi')
+        if entry is None:
+            continue
+        # 只读选中的 volume, (slice, row, column) 转成 Imshow3DArray 的 (row, column, slice)
+        dwi = np.transpose(ReadDwiVolume(case_path, entry), (1, 2, 0))
+        Imshow3DArray(Normalize01(dwi))
+        print(case, entry['b'])
 
 
 def CheckRoiNum(data_folder):
-    from ECEDataProcess.DataProcess.MaxRoi import KeepLargest
+    from ECEDataProcess.DataProcess.Connectivity import LabelComponents, ComponentStats
     case_list = os.listdir(data_folder)
     for case in case_list:
-        volume_list = []
         # path
         case_path = os.path.join(data_folder, case)
         t2_path = os.path.join(case_path, 't2.nii')
@@ -198,12 +192,9 @@ def CheckRoiNum(data_folder):
 
         _, roi, _ = LoadNiiData(roi_path, dtype=np.uint8)
 
-        label_im, nb_labels = ndimage.label(roi)
+        label_im, nb_labels = LabelComponents(roi)
         if nb_labels != 1:
-            for index in range(1, nb_labels + 1):
-                volume = (label_im == index).sum()
-                if volume != 1:
-                    volume_list.append(volume)
+            volume_list = [one['volume'] for one in ComponentStats(label_im, nb_labels) if one['volume'] != 1]
             if len(volume_list) != 1:
                 print(case, volume_list)
 
@@ -234,6 +225,9 @@ if __name__ == '__main__':
     data_folder = resample_folder
     save_path = input_0_output_1_path
     WriteH5(data_folder, save_path)
+    # from ECEDataProcess.DataProcess.H5Dataset import H5Writer
+    # with H5Writer(os.path.join(save_path, 'all_case.h5'), chunk_size=16, compression='lzf') as writer:
+    #     WriteH5(data_folder, save_path, writer=writer)
     # TestWhiteH5()
 
 
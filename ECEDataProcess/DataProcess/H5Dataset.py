@@ -0,0 +1,169 @@
+import os
+import time
+import h5py
+import numpy as np
+from torch.utils.data import Dataset, Sampler
+
+# 所有 case 写进一个 h5, 每个模态一个 chunked dataset, 第 0 维是样本.
+# chunk 是 (chunk_size, ...) , 读一个 batch 就是读连续的几个 chunk.
+
+
+class H5Writer(object):
+    '''
+    with H5Writer(save_path, chunk_size=16, compression='lzf') as writer:
+        writer.Append(case, {'input_0': t2_slice_3d, 'output_0': roi_slice_3d, 'output_1': ece})
+    compression: None / 'lzf' / 'gzip'
+    '''
+    def __init__(self, save_path, chunk_size=16, compression=None, mode='a'):
+        self.file = h5py.File(save_path, mode)
+        self.chunk_size = chunk_size
+        self.compression = compression
+        if 'case' not in self.file:
+            self.file.create_dataset('case', shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(),
+                                     chunks=(1024,))
+        self._case_set = set(one.decode() if isinstance(one, bytes) else one for one in self.file['case'][()])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def __contains__(self, case):
+        return case in self._case_set
+
+    def _Dataset(self, name, data):
+        if name not in self.file:
+            self.file.create_dataset(name, shape=(0,) + data.shape, maxshape=(None,) + data.shape, dtype=data.dtype,
+                                     chunks=(self.chunk_size,) + data.shape, compression=self.compression)
+        return self.file[name]
+
+    def Append(self, case, data_dict):
+        index = self.file['case'].shape[0]
+        for name, data in data_dict.items():
+            data = np.asarray(data)
+            dataset = self._Dataset(name, data)
+            if dataset.shape[0] != index:
+                raise ValueError('{} has {} samples, case has {}'.format(name, dataset.shape[0], index))
+            dataset.resize(index + 1, axis=0)
+            dataset[index] = data
+        self.file['case'].resize(index + 1, axis=0)
+        self.file['case'][index] = case
+        self._case_set.add(case)
+
+    def Close(self):
+        self.file.close()
+
+
+class H5BatchReader(Dataset):
+    '''
+    一个 index 对应一个 batch, 读的是连续的 [start, start + batch_size), 给 DataLoader(batch_size=None) 用.
+    h5 文件在每个进程里第一次读的时候才打开, 多 worker 时每个 worker 有自己的句柄.
+    shuffle 时每个 epoch 随机一个起点和 batch 的顺序, batch 内部的样本是相邻的; 只用完整的 batch,
+    剩下不到 batch_size 个样本这个 epoch 不用 (下个 epoch 起点不同), 不会有一两个样本的 batch 影响 BatchNorm.
+    每个 epoch 的顺序只由 (seed, epoch) 算出来, index = epoch * batches + 第几个 batch, worker 里不需要同步状态.
+    输出和 LoadH5Data.GeneratorData 一样: inputs 是 float32, outputs 是 uint8.
+    '''
+    def __init__(self, h5_path, batch_size, input_name=None, output_name=None, shuffle=True, seed=None):
+        self.h5_path = h5_path
+        self.batch_size = batch_size
+        self.input_name = ['input_0'] if input_name is None else input_name
+        self.output_name = ['output_0'] if output_name is None else output_name
+        self.shuffle = shuffle
+        # 在主进程里定下来, 每个 worker 拿到的是同一个 seed
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+
+        with h5py.File(h5_path, 'r') as h5_file:
+            self.sample_number = h5_file['case'].shape[0]
+        self.batches = len(self.EpochStart(0))
+        self._file, self._pid = None, None
+        self._epoch_start = (None, None)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'], state['_pid'] = None, None
+        return state
+
+    def _File(self):
+        if self._file is None or self._pid != os.getpid():
+            self._file = h5py.File(self.h5_path, 'r')
+            self._pid = os.getpid()
+        return self._file
+
+    def EpochStart(self, epoch):
+        # 第 epoch 轮每个 batch 的起点
+        if not self.shuffle:
+            return np.arange(0, self.sample_number, self.batch_size)
+        full = self.sample_number // self.batch_size
+        if full == 0:
+            return np.array([0])
+        random = np.random.RandomState(np.random.SeedSequence([self.seed, epoch]).generate_state(1)[0])
+        offset = random.randint(self.sample_number - full * self.batch_size + 1)
+        start = np.arange(full) * self.batch_size + offset
+        return start[random.permutation(full)]
+
+    def __len__(self):
+        return self.batches
+
+    def __getitem__(self, index):
+        epoch, position = divmod(index, self.batches)
+        if self._epoch_start[0] != epoch:
+            self._epoch_start = (epoch, self.EpochStart(epoch))
+        start = int(self._epoch_start[1][position])
+        end = min(start + self.batch_size, self.sample_number)
+        h5_file = self._File()
+        inputs = [h5_file[name][start:end].astype(np.float32) for name in self.input_name]
+        outputs = [h5_file[name][start:end].astype(np.uint8) for name in self.output_name]
+        return inputs, outputs
+
+    def Generator(self):
+        # 和 LoadH5Data.GeneratorData 一样一直循环
+        index = 0
+        while True:
+            inputs, outputs = self[index]
+            index += 1
+            yield inputs[0], outputs[0]
+
+
+class H5EpochSampler(Sampler):
+    '''
+    DataLoader(reader, batch_size=None, sampler=H5EpochSampler(reader)), 每个 epoch 开始前 sampler.SetEpoch(epoch).
+    sampler 只在主进程里, 给出的 index 带着 epoch, persistent_workers 时 worker 也能算出这一轮的顺序.
+    '''
+    def __init__(self, reader):
+        self.reader = reader
+        self.epoch = 0
+
+    def SetEpoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.reader.batches
+
+    def __iter__(self):
+        return iter(range(self.epoch * self.reader.batches, (self.epoch + 1) * self.reader.batches))
+
+
+def BenchmarkH5(per_file_folder, single_h5_path, batch_size=24, batches=50):
+    from ECEDataProcess.DataProcess.LoadH5Data import GeneratorData
+
+    generator = GeneratorData(per_file_folder, batch_size)
+    start = time.perf_counter()
+    for _ in range(batches):
+        next(generator)
+    per_file = (time.perf_counter() - start) / batches
+
+    generator = H5BatchReader(single_h5_path, batch_size).Generator()
+    start = time.perf_counter()
+    for _ in range(batches):
+        next(generator)
+    single = (time.perf_counter() - start) / batches
+
+    print('per-file: {:.2f} ms / batch, single h5: {:.2f} ms / batch, speed up {:.1f}x'.format(
+        per_file * 1000, single * 1000, per_file / single))
+    return per_file, single
+
+
+if __name__ == '__main__':
+    BenchmarkH5(r'X:\CNNFormatData\ProstateCancerECE\AllData\Train',
+                r'X:\CNNFormatData\ProstateCancerECE\AllData\train.h5')
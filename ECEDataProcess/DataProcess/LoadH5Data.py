@@ -46,6 +46,12 @@ def GeneratorData(data_folder, batch_size):
                 label_list = []
 
 
+def GeneratorSingleH5(h5_path, batch_size, shuffle=True):
+    # H5Dataset.H5Writer 写的单个 h5, 每个 batch 是一次连续读取, 不再每个样本开关一次文件
+    from ECEDataProcess.DataProcess.H5Dataset import H5BatchReader
+    return H5BatchReader(h5_path, batch_size, shuffle=shuffle).Generator()
+
+
 def main():
     data_folder = r'X:\CNNFormatData\ProstateCancerECE\AllData\Validation'
     file_list = os.listdir(data_folder)
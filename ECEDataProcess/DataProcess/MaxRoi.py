@@ -10,7 +10,7 @@ from MeDIT.Normalize import Normalize01
 # from FilePath import resample_folder, csv_path, process_folder
 
 
-def SelectMaxRoiSlice(roi):
+def _SelectMaxRoiSliceLoop(roi):
     roi_size = []
     for slice in range(roi.shape[0]):
         roi_size.append(np.sum(roi[slice, ...]))
@@ -20,7 +20,7 @@ def SelectMaxRoiSlice(roi):
     return max_slice
 
 
-def GetRoiSize(roi):
+def _GetRoiSizeLoop(roi):
     roi_row = []
     roi_column = []
     for row in range(roi.shape[0]):
@@ -36,7 +36,7 @@ def GetRoiSize(roi):
     # return size_list
 
 
-def GetRoiCenter(roi):
+def _GetRoiCenterLoop(roi):
     roi_row = []
     roi_column = []
     for up in range(roi.shape[0]):
@@ -58,7 +58,7 @@ def GetRoiCenter(roi):
     return center, (int(up), int(bottle), int(left), int(right))
 
 
-def GetRoiCenterNew(roi):
+def _GetRoiCenterNewLoop(roi):
     roi_row = []
     roi_column = []
     for up in range(roi.shape[0]):
@@ -78,14 +78,77 @@ def GetRoiCenterNew(roi):
     bottle = up + max_column
     return center, (int(up), int(bottle), int(left), int(right))
 
-def KeepLargest(mask):
-    new_mask = np.zeros(mask.shape)
-    label_im, nb_labels = ndimage.label(mask)
-    max_volume = [(label_im == index).sum() for index in range(1, nb_labels + 1)]
-    index = np.argmax(max_volume)
-    new_mask[label_im == index+1] = 1
-    # print(max_volume, np.sum(new_mask))
-    return label_im, nb_labels, new_mask
+
+# 下面的函数用 axis 上的 sum/argmax 代替逐行逐层的循环, 结果和原来的循环版本 (_xxxLoop) 完全一样.
+# is_batch=True 时前面的维度都是 batch: SelectMaxRoiSlice 输入 (batch, slice, ...), 其余输入 (batch, row, column).
+
+
+def SelectMaxRoiSlice(roi, is_batch=False):
+    roi = np.asarray(roi)
+    if not is_batch:
+        return int(np.argmax(roi.reshape(roi.shape[0], -1).sum(axis=1)))
+    roi_size = roi.reshape(roi.shape[0], roi.shape[1], -1).sum(axis=2)
+    return np.argmax(roi_size, axis=1)
+
+
+def _RowColumnSum(roi, is_batch):
+    # roi[row, ...] 和 roi[..., column] 的和
+    if is_batch:
+        return roi.sum(axis=-1), roi.sum(axis=-2)
+    row_axis = tuple(range(1, roi.ndim))
+    column_axis = tuple(range(0, roi.ndim - 1))
+    return roi.sum(axis=row_axis), roi.sum(axis=column_axis)
+
+
+def GetRoiSize(roi, is_batch=False):
+    roi = np.asarray(roi)
+    roi_row, roi_column = _RowColumnSum(roi, is_batch)
+    return roi_row.max(axis=-1), roi_column.max(axis=-1)
+
+
+def _RoiCorner(roi):
+    # (..., row, column) -> 最大行/列的宽度, 以及它们第一个非零位置 (up, left)
+    roi_row, roi_column = roi.sum(axis=-1), roi.sum(axis=-2)
+    max_row, max_column = roi_row.max(axis=-1), roi_column.max(axis=-1)
+    row_index, column_index = roi_row.argmax(axis=-1), roi_column.argmax(axis=-1)
+
+    row = np.take_along_axis(roi, row_index[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+    column = np.take_along_axis(roi, column_index[..., np.newaxis, np.newaxis], axis=-1)[..., 0]
+    return max_row, max_column, np.argmax(row, axis=-1), np.argmax(column, axis=-1)
+
+
+def _RoiCenter(roi, is_batch, is_new):
+    roi = np.asarray(roi)
+    if not is_batch and roi.ndim != 2:
+        # 只有 2D 的 roi 有意义, 其他情况保持原来的结果
+        return _GetRoiCenterNewLoop(roi) if is_new else _GetRoiCenterLoop(roi)
+
+    max_row, max_column, left, up = _RoiCorner(roi)
+    center_row, center_column = up + max_column // 2, left + max_row // 2
+    right, bottle = left + max_row, up + max_column
+    if is_new:
+        center_row, center_column = center_column, center_row
+    if not is_batch:
+        return (int(center_row), int(center_column)), (int(up), int(bottle), int(left), int(right))
+    center = np.stack([center_row, center_column], axis=-1).astype(int)
+    box = np.stack([up, bottle, left, right], axis=-1).astype(int)
+    return center, box
+
+
+def GetRoiCenter(roi, is_batch=False):
+    # center 是 (row, column)
+    return _RoiCenter(roi, is_batch, is_new=False)
+
+
+def GetRoiCenterNew(roi, is_batch=False):
+    # center 是 (column, row)
+    return _RoiCenter(roi, is_batch, is_new=True)
+
+
+def KeepLargest(mask, connectivity=6):
+    # 只 label 一次, 体积用 bincount, 见 Connectivity.KeepLargest
+    from ECEDataProcess.DataProcess.Connectivity import KeepLargest as KeepLargestComponent
+    return KeepLargestComponent(mask, connectivity)
 
 
 def test():
@@ -143,5 +206,54 @@ def ShowProblemData(case):
     # Imshow3DArray(Normalize01(np.transpose(raw_dwi[2, ...], [1, 2, 0])))
 
 
+def _ToInt(result):
+    if isinstance(result, (list, tuple)):
+        return [_ToInt(one) for one in result]
+    return int(result)
+
+
+def BenchmarkRoiKernels(case_number=50, shape=(24, 280, 280), seed=0):
+    import time
+    rng = np.random.RandomState(seed)
+    # 随机的椭球 roi, 很多层是空的, 空 roi 的结果也要一致
+    grid = np.meshgrid(*[np.arange(one) for one in shape], indexing='ij')
+    roi_list = []
+    for _ in range(case_number):
+        center = rng.uniform([6, 80, 80], [18, 200, 200])
+        radii = rng.uniform([2, 10, 10], [6, 40, 40])
+        roi_list.append((sum(((g - c) / r) ** 2 for g, c, r in zip(grid, center, radii)) < 1).astype(np.uint8))
+    roi_batch = np.stack(roi_list)
+    slice_batch = roi_batch.reshape((-1,) + shape[1:])
+
+    def Time(func):
+        start = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - start
+
+    cases = [('SelectMaxRoiSlice', lambda: [_SelectMaxRoiSliceLoop(one) for one in roi_list],
+              lambda: [SelectMaxRoiSlice(one) for one in roi_list],
+              lambda: SelectMaxRoiSlice(roi_batch, is_batch=True).tolist()),
+             ('GetRoiSize', lambda: [_GetRoiSizeLoop(one) for one in slice_batch],
+              lambda: [GetRoiSize(one) for one in slice_batch],
+              lambda: list(zip(*[one.tolist() for one in GetRoiSize(slice_batch, is_batch=True)]))),
+             ('GetRoiCenter', lambda: [_GetRoiCenterLoop(one) for one in slice_batch],
+              lambda: [GetRoiCenter(one) for one in slice_batch],
+              lambda: [(tuple(c), tuple(b)) for c, b in zip(*[one.tolist() for one in
+                                                               GetRoiCenter(slice_batch, is_batch=True)])]),
+             ('GetRoiCenterNew', lambda: [_GetRoiCenterNewLoop(one) for one in slice_batch],
+              lambda: [GetRoiCenterNew(one) for one in slice_batch],
+              lambda: [(tuple(c), tuple(b)) for c, b in zip(*[one.tolist() for one in
+                                                               GetRoiCenterNew(slice_batch, is_batch=True)])])]
+    for name, loop, single, batch in cases:
+        loop_result, loop_time = Time(loop)
+        single_result, single_time = Time(single)
+        batch_result, batch_time = Time(batch)
+        assert _ToInt(loop_result) == _ToInt(single_result) == _ToInt(batch_result), name
+        print('{:<18} loop {:8.1f} ms, vectorized {:8.1f} ms ({:.0f}x), batch {:8.1f} ms ({:.0f}x)'.format(
+            name, loop_time * 1000, single_time * 1000, loop_time / single_time, batch_time * 1000,
+            loop_time / batch_time))
+
+
 if __name__ == '__main__':
     ShowProblemData('XSJ^xu shou jun')
+    # BenchmarkRoiKernels()
@@ -1,35 +1,63 @@
 import os
+import time
 import numpy as np
+import pandas as pd
 
-from MIP4AIM.NiiProcess.Registrator import Registrator
 from MeDIT.SaveAndLoad import LoadNiiData
 from MeDIT.Normalize import Normalize01
 from MeDIT.Visualization import Imshow3DArray
 
 from FilePath import process_folder
 
-registrator = Registrator()
 
-def RegistrateBySpacing(case_folder):
+def RegistrateBySpacing(case_folder, use_cache=False, roi_list=None, num_workers=None, sitk_threads=None,
+                        return_times=False):
+    '''
+    adc.nii / max_b_dwi.nii / roi_list 里的 ROI 同时重采样到 t2.nii 的网格上, 见 GridResample.RegistrateCase
+    use_cache: t2/adc/max_b_dwi 没变并且 _Reg 文件还在时直接跳过, 见 DicomData.StageCache
+    return_times: 多返回每个序列的用时 {路径: 秒, 'total': 秒}
+    '''
+    if use_cache:
+        from ECEDataProcess.DicomData.StageCache import StageCache
+        cache = StageCache(case_folder)
+        input_files = [os.path.join(case_folder, one) for one in ['t2.nii', 'adc.nii', 'max_b_dwi.nii']]
+        return cache.Run('RegistrateBySpacing', lambda: RegistrateBySpacing(case_folder, roi_list=roi_list,
+                                                                            num_workers=num_workers,
+                                                                            sitk_threads=sitk_threads,
+                                                                            return_times=return_times),
+                         params={'roi': roi_list}, input_files=input_files, watch_folders=[case_folder])
+
+    from ECEDataProcess.DataProcess.GridResample import RegistrateCase, CaseMovingList
     t2_path = os.path.join(case_folder, 't2.nii')
-    adc_path = os.path.join(case_folder, 'adc.nii')
     dwi_path = os.path.join(case_folder, 'max_b_dwi.nii')
 
-    registrator.fixed_image = t2_path
-
-    registrator.moving_image = adc_path
-    try:
-        registrator.RegistrateBySpacing(store_path=registrator.GenerateStorePath(adc_path))
-    except:
-        return False, 'Align ADC Failed'
+    moving_list = CaseMovingList(case_folder, dwi_list=[dwi_path], roi_list=roi_list)
+    is_work, message, times = RegistrateCase(t2_path, moving_list, num_workers=num_workers, sitk_threads=sitk_threads)
+    if return_times:
+        return is_work, message, times
+    return is_work, message
 
-    registrator.moving_image = dwi_path
-    try:
-        registrator.RegistrateBySpacing(store_path=registrator.GenerateStorePath(dwi_path))
-    except:
-        return False, 'Align DWI Failed'
 
-    return True, ''
+def RegistrateFolder(root_folder, csv_path, roi_list=None, num_workers=None, sitk_threads=None):
+    # 每个 case 的总用时和每个序列的用时写进 csv_path
+    rows = []
+    for case in sorted(os.listdir(root_folder)):
+        case_folder = os.path.join(root_folder, case)
+        if not os.path.isdir(case_folder):
+            continue
+        start = time.perf_counter()
+        try:
+            is_work, message, times = RegistrateBySpacing(case_folder, roi_list=roi_list, num_workers=num_workers,
+                                                          sitk_threads=sitk_threads, return_times=True)
+        except Exception as e:
+            is_work, message, times = False, str(e), {}
+        row = {'case': case, 'is_work': is_work, 'message': message, 'wall': time.perf_counter() - start}
+        row.update({os.path.basename(key): value for key, value in times.items()})
+        rows.append(row)
+        print('{}: {:.2f}s {}'.format(case, row['wall'], message))
+    df = pd.DataFrame(rows)
+    df.to_csv(csv_path, index=False)
+    return df
 
 
 def Path(case_folder):
@@ -51,7 +79,8 @@ def Path(case_folder):
 if __name__ == '__main__':
     # case_folder = r'C:\Users\ZhangYihong\Desktop\try\BAO ZHENG LI'
     case_folder = r'X:\PrcoessedData\ProstateCancerECE\CSJ^chen shi jie'
-    RegistrateBySpacing(case_folder)
+    RegistrateBySpacing(case_folder, use_cache=True)
+    # RegistrateFolder(process_folder, os.path.join(process_folder, 'registration_time.csv'), roi_list=['roi.nii'])
     # case_list = os.listdir(process_folder)
     # for case in case_list:
     #     case_folder = os.path.join(process_folder, case)
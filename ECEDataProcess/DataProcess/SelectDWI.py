@@ -18,65 +18,37 @@ from MeDIT.Normalize import Normalize01
 # from FilePath import process_folder, resample_folder, desktop_path
 
 
-def NearTrueB(b_list):
-    dis = []
-    for index in b_list:
-        dis.append(abs(float(index) - 1500))
-    index = dis.index(min(dis))
-    return b_list[index], index
+def NearTrueB(b_list, target=1500):
+    from ECEDataProcess.DataProcess.BValueIndex import NearestB
+    return NearestB(b_list, target)
 
 def MoveFile():
     pass
 
 
-def GetDWIPath(case):
+def GetDWIPath(case, entries=None):
+    '''
+    entries: 这个 case 在 b 值索引里的记录 (BValueIndex.BuildBValueIndex / CaseManifest.GetBValue),
+             None 时现场扫描; 4D 的只读选中的 volume.
+    '''
+    from ECEDataProcess.DataProcess.BValueIndex import CaseBValues, SelectB, DwiVolumeImage
     print(case)
     if case == 'WYB^wu yi bao' or case == 'ZYB^zhang yun bao':
         return 0
 
     b_value = ['0', '50', '700', '750', '1400', '1500']
     case_path = os.path.join(process_folder, case)
+    if not os.path.exists(os.path.join(case_path, 'adc.nii')):
+        return
 
-    if os.path.exists(os.path.join(case_path, 'adc.nii')):
-        if os.path.exists(os.path.join(case_path, 'dwi.nii')):
-            bval_path = os.path.join(case_path, 'dwi.bval')
-            bval = open(bval_path, 'r')
-            b_list = bval.read().split()
-            if len(b_list) == 1:
-                new_img, new_dwi, _ = LoadNiiData(os.path.join(case_path, 'dwi.nii'))
-
-            else:
-                b, index = NearTrueB(b_list)
-                _, dwi, _ = LoadNiiData(os.path.join(case_path, 'dwi.nii'))
-                img, _, _ = LoadNiiData(os.path.join(case_path, 'adc.nii'))
-                new_dwi = dwi[index, ...]
-                new_img = sitk.GetImageFromArray(new_dwi)
-                new_img.SetDirection(img.GetDirection())
-                new_img.SetSpacing(img.GetSpacing())
-                new_img.SetOrigin(img.GetOrigin())
-
-        elif os.path.exists(os.path.join(case_path, 'dki.nii')):
-            bval_path = os.path.join(case_path, 'dki.bval')
-            bval = open(bval_path, 'r')
-            b_list = bval.read().split()
-            if len(b_list) == 1:
-                new_img, new_dwi, _ = LoadNiiData(os.path.join(case_path, 'dki.nii'))
-            else:
-                b, index = NearTrueB(b_list)
-                img, dki, _ = LoadNiiData(os.path.join(case_path, 'dki.nii'))
-                img, _, _ = LoadNiiData(os.path.join(case_path, 'adc.nii'))
-                new_dwi = dki[index, ...]
-                new_img = sitk.GetImageFromArray(new_dwi)
-                new_img.SetDirection(img.GetDirection())
-                new_img.SetSpacing(img.GetSpacing())
-                new_img.SetOrigin(img.GetOrigin())
-
-        else:
-            for b in reversed(b_value):
-                if os.path.exists(os.path.join(case_path, 'dwi_b'+str(b)+'.nii')):
-                    new_img, new_dwi, _ = LoadNiiData(os.path.join(case_path, 'dwi_b'+str(b)+'.nii'))
-                    break
+    if entries is None:
+        entries = CaseBValues(case_path)
+    entry = SelectB(entries, b_value=b_value, prefix='dwi')
     try:
+        if entry['volume'] is None:
+            new_img = sitk.ReadImage(os.path.join(case_path, entry['file']))
+        else:
+            new_img = DwiVolumeImage(case_path, entry, os.path.join(case_path, 'adc.nii'))
         sitk.WriteImage(new_img, os.path.join(case_path, 'max_b_dwi.nii'))
         # print('Image size is: ', new_img.GetSize())
         # print('Image resolution is: ', new_img.GetSpacing())
@@ -86,10 +58,11 @@ def GetDWIPath(case):
         print(case, e)
 
 def test():
+    from ECEDataProcess.DataProcess.BValueIndex import BuildBValueIndex
 
-    case_list = os.listdir(process_folder)
-    for case in case_list:
-        GetDWIPath(case)
+    b_index = BuildBValueIndex(process_folder)
+    for case, entries in b_index.items():
+        GetDWIPath(case, entries)
 
     # try:
     #     path = os.path.join(desktop_path, case + 'max_b.nii')
@@ -125,7 +98,11 @@ def SelectBinTest():
     des_folder = r'X:\CNNFormatData\ProstateCancerECE\NPYNoDivide\Test\DWISliceb1500'
     b_folder = r'X:\PrcoessedData\ProstateCancerECE'
     b_value = ['0', '50', '700', '750', '1400', '1500']
-    for num, case in enumerate(os.listdir(test_folder)):
+    from ECEDataProcess.DataProcess.BValueIndex import BuildBValueIndex, SelectB
+    case_list = os.listdir(test_folder)
+    # 整个队列只扫描一次 b 值
+    b_index = BuildBValueIndex(b_folder, sorted(set(case[:case.index('_slice')] for case in case_list)))
+    for num, case in enumerate(case_list):
 
         case_name = case[:case.index('_slice')]
         case_path = os.path.join(test_folder, case)
@@ -168,33 +145,10 @@ def SelectBinTest():
 
 
 
-        if os.path.exists(os.path.join(b_folder, case_name + '/dwi.bval')):
-            bval_path = os.path.join(b_folder,  case_name + '/dwi.bval')
-            b_list = open(bval_path, 'r').read().split()
-            b, index = NearTrueB(b_list)
-            if float(b) < 1000:
-                # pass
-                print(case_name)
-                print('b is {}.'.format(b))
-
-        elif os.path.exists(os.path.join(b_folder, case_name + '/dki.bval')):
-            bval_path = os.path.join(b_folder,  case_name + '/dki.bval')
-            b_list = open(bval_path, 'r').read().split()
-            b, index = NearTrueB(b_list)
-            if float(b) < 1000:
-                # pass
-                print(case_name)
-                print('b is {}..'.format(b))
-
-        else:
-            # print(case_name)
-            for b in reversed(b_value):
-                if os.path.exists(os.path.join(b_folder, case_name + '/dwi_b' + str(b) + '.nii')) \
-                        or os.path.exists(os.path.join(b_folder, case_name + '/dki_b' + str(b) + '.nii')):
-                    if float(b) < 1000:
-                        print(case_name)
-                        print('b is {}...'.format(b))
-                        break
+        entry = SelectB(b_index.get(case_name, []), b_value=b_value)
+        if entry is not None and float(entry['b']) < 1000:
+            print(case_name)
+            print('b is {}{}'.format(entry['b'], {'dwi': '.', 'dki': '..', 'separate': '...'}[entry['source']]))
 
 if __name__ == '__main__':
     SelectBinTest()
@@ -115,8 +115,9 @@ def SelectRoi():
                 print(case)
 
 
-def MultiRoi():
+def MultiRoi(connectivity=6):
     from MeDIT.SaveAndLoad import LoadNiiData
+    from ECEDataProcess.DataProcess.Connectivity import LabelComponents, ComponentStats
     data_folder = r'X:\PrcoessedData\ProstateCancerECE'
     multi_list = ['CHEN REN', 'CHEN ZHENG', 'DING YONG MING', 'DU KE BIN', 'FYK^fan yuan kai','GAO FA MING',
                   'GCD^gu chuan dao', 'GCF^gao chang fu','GENG LONG XIANG^GENG LONG XIANG','GSH^gao si hui','GU SI KANG',
@@ -158,7 +159,8 @@ def MultiRoi():
         t2_path = os.path.join(data_path, 't2.nii')
         _, _, roi = LoadNiiData(roi_path)
         _, _, t2 = LoadNiiData(t2_path)
-        label_im, nb_labels = ndimage.label(roi)
+        label_im, nb_labels = LabelComponents(roi, connectivity)
+        print(a, case, [one['volume'] for one in ComponentStats(label_im, nb_labels) if one['volume'] >= 10])
         Imshow3DArray(Normalize01(t2), roi=Normalize01(label_im))
 
 
@@ -0,0 +1,77 @@
+import numpy as np
+
+# 多模态按层裁剪 + z-score, 一次写进预先分配好的 (slices, channels, row, column) float32 数组.
+# 输入的 volume 不会被修改 (H5.CropT2Data / Test4Case.CropData 会原地减均值除方差).
+# 裁剪窗口和 MeDIT.ArrayProcess.ExtractPatch(is_shift=True) 一样: 中心太靠边时平移到图像内部.
+
+
+def CropWindow(shape, crop_shape, center):
+    '''
+    返回每一维的 (start, stop) 和输出里的 (start, stop); 图像比裁剪尺寸小时两边补 0.
+    '''
+    source, target = [], []
+    for size, crop, point in zip(shape, crop_shape, center):
+        if size >= crop:
+            point = int(min(max(point, crop // 2), size - (crop - crop // 2)))
+            source.append((point - crop // 2, point - crop // 2 + crop))
+            target.append((0, crop))
+        else:
+            pad = (crop - size) // 2
+            source.append((0, size))
+            target.append((pad, pad + size))
+    return source, target
+
+
+def ExtractSlices(volume_list, slice_list, center_list, crop_shape=(192, 192), is_roi_list=None, out=None):
+    '''
+    volume_list: [t2, adc, dwi, prostate, pca], 每个都是 (slice, row, column)
+    slice_list: 要取的层; center_list: 每一层裁剪中心 (row, column), 比如 MaxRoi.GetRoiCenter 的结果
+    is_roi_list: ROI 通道不做归一化, 默认都是图像
+    返回 (len(slice_list), len(volume_list), crop_shape[0], crop_shape[1]) 的 float32;
+    z-score 用整层 (裁剪前) 的均值和标准差, 和原来的 CropData/CropT2Data 一样.
+    '''
+    if is_roi_list is None:
+        is_roi_list = [False] * len(volume_list)
+    if len(is_roi_list) != len(volume_list):
+        raise ValueError('{} volumes but {} is_roi flags'.format(len(volume_list), len(is_roi_list)))
+    if len(center_list) != len(slice_list):
+        raise ValueError('{} slices but {} centers'.format(len(slice_list), len(center_list)))
+
+    shape = (len(slice_list), len(volume_list)) + tuple(crop_shape)
+    if out is None:
+        out = np.zeros(shape, dtype=np.float32)
+    elif out.shape != shape or out.dtype != np.float32:
+        raise ValueError('out should be float32 {}, got {} {}'.format(shape, out.dtype, out.shape))
+    else:
+        out[...] = 0
+
+    for index, (slice, center) in enumerate(zip(slice_list, center_list)):
+        source, target = CropWindow(volume_list[0].shape[1:], crop_shape, center)
+        source_index = tuple(np.s_[start:stop] for start, stop in source)
+        target_index = tuple(np.s_[start:stop] for start, stop in target)
+        for channel, (volume, is_roi) in enumerate(zip(volume_list, is_roi_list)):
+            one_slice = volume[slice]
+            one_out = out[index, channel][target_index]
+            one_out[...] = one_slice[source_index]
+            if not is_roi:
+                # 只在裁剪后的区域上减均值除方差, 整层只读不写
+                one_out -= np.mean(one_slice, dtype=np.float32)
+                one_out /= np.std(one_slice, dtype=np.float32)
+    return out
+
+
+def RoiSlices(roi, prostate=None):
+    # 有 PCa (并且有前列腺) 的层, 和 Test4Case.Run 里的选法一样
+    area = roi.reshape(roi.shape[0], -1).sum(axis=1) > 0
+    if prostate is not None:
+        area &= prostate.reshape(prostate.shape[0], -1).sum(axis=1) > 0
+    return np.nonzero(area)[0].tolist()
+
+
+def SliceCenters(roi, slice_list):
+    # 每一层 roi 的 GetRoiCenter 中心, 一次算完
+    from ECEDataProcess.DataProcess.MaxRoi import GetRoiCenter
+    if len(slice_list) == 0:
+        return []
+    center, _ = GetRoiCenter(roi[slice_list], is_batch=True)
+    return [tuple(one) for one in center.tolist()]
@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+
+# raw_folder 下每个子目录是一个 study. 新 study 出现后等它写完 (settle_time 内没有变化) 再交给处理.
+# 有 watchdog 时用文件系统事件 (inotify / ReadDirectoryChangesW), 没有就轮询, 两种方式只扫描还没处理的 study.
+
+
+def FolderSignature(folder):
+    # (文件数, 总大小, 最新的 mtime), 拷贝过程中至少有一项在变
+    number, size, mtime = 0, 0, 0.
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            try:
+                stat = os.stat(os.path.join(root, file))
+            except OSError:
+                # 正在拷贝/改名的文件
+                continue
+            number += 1
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return number, size, mtime
+
+
+class CaseWatcher(object):
+    '''
+    watcher = CaseWatcher(raw_folder, settle_time=60)
+    for case, arrival in watcher.Iterate(): ...
+    arrival 是第一次看到这个 study 的时间 (time.time()), 用来算从到达到出结果的延迟.
+    '''
+    def __init__(self, raw_folder, settle_time=60., poll_interval=5., use_events=True, ignore=None):
+        self.raw_folder = raw_folder
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        # ignore(case) 为 True 的 study 不再关心, 比如已经处理过的
+        self.ignore = ignore
+        self._lock = threading.Lock()
+        self._pending = {}  # case -> [arrival, last_change, signature]
+        self._emitted = set()
+        self._failed = {}  # case -> 失败时的目录签名
+        self._observer = self._StartObserver() if use_events else None
+
+    @property
+    def is_event(self):
+        return self._observer is not None
+
+    def _StartObserver(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            print('watchdog is not installed, polling {} every {}s'.format(self.raw_folder, self.poll_interval))
+            return None
+
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                for path in [event.src_path, getattr(event, 'dest_path', '')]:
+                    if path:
+                        watcher._Touch(path)
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.raw_folder, recursive=True)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def _Touch(self, path):
+        relative = os.path.relpath(path, self.raw_folder)
+        if relative.startswith(os.pardir) or relative == os.curdir:
+            return
+        case = relative.split(os.sep)[0]
+        now = time.time()
+        with self._lock:
+            if case in self._emitted:
+                return
+            if case in self._pending:
+                self._pending[case][1] = now
+            else:
+                self._pending[case] = [now, now, None]
+
+    def Stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def Discard(self, case):
+        '''
+        处理失败以后调用. study 被移走时, 同名的 study 再来就重新处理; 还留在 raw_folder 里时 (use_cache 只拷贝)
+        记下这时的目录签名, 签名变了 (比如重新传了数据) 才重新处理, 不会每个 settle_time 重跑一次.
+        '''
+        case_folder = os.path.join(self.raw_folder, case)
+        signature = FolderSignature(case_folder) if os.path.isdir(case_folder) else None
+        with self._lock:
+            self._pending.pop(case, None)
+            if signature is None:
+                self._emitted.discard(case)
+                self._failed.pop(case, None)
+            else:
+                self._emitted.add(case)
+                self._failed[case] = signature
+
+    def _Scan(self):
+        # 只看 raw_folder 这一层, 新目录加进 pending; 事件模式下也做, 防止漏掉启动前就在的 study
+        for entry in os.scandir(self.raw_folder):
+            if not entry.is_dir():
+                continue
+            with self._lock:
+                failed = self._failed.get(entry.name)
+            if failed is not None:
+                if FolderSignature(entry.path) == failed:
+                    continue
+                with self._lock:
+                    self._failed.pop(entry.name, None)
+                    self._emitted.discard(entry.name)
+            with self._lock:
+                if entry.name in self._emitted or entry.name in self._pending:
+                    continue
+            if self.ignore is not None and self.ignore(entry.name):
+                with self._lock:
+                    self._emitted.add(entry.name)
+                continue
+            self._Touch(entry.path)
+
+    def Ready(self):
+        '''
+        返回已经写完的 [(case, arrival)]. 事件模式下 last_change 由事件更新;
+        两种模式下 settle_time 到了以后都再比较一次目录签名, 签名变了就重新计时.
+        '''
+        self._Scan()
+        now = time.time()
+        with self._lock:
+            pending = [(case, one[:]) for case, one in self._pending.items()]
+
+        ready = []
+        for case, (arrival, last_change, signature) in pending:
+            if now - last_change < self.settle_time:
+                continue
+            case_folder = os.path.join(self.raw_folder, case)
+            if not os.path.isdir(case_folder):
+                with self._lock:
+                    self._pending.pop(case, None)
+                continue
+            new_signature = FolderSignature(case_folder)
+            with self._lock:
+                if case not in self._pending:
+                    continue
+                if signature is None:
+                    # 第一次检查: 记下签名, 隔一个 poll_interval 再确认一次
+                    self._pending[case][1:] = [now - self.settle_time + self.poll_interval, new_signature]
+                    continue
+                if new_signature != signature:
+                    # 还在写, 重新计时
+                    self._pending[case][1:] = [now, new_signature]
+                    continue
+                self._pending.pop(case)
+                self._emitted.add(case)
+            ready.append((case, arrival))
+        return sorted(ready, key=lambda one: one[1])
+
+    def Iterate(self):
+        while True:
+            for one in self.Ready():
+                yield one
+            time.sleep(self.poll_interval)
@@ -6,12 +6,18 @@ from MIP4AIM.Application2Series.SeriesMatcher import SeriesStringMatcher
 
 from MeDIT.Log import CustomerCheck, Eclog
 
+from ECEDataProcess.DicomData.SeriesRules import SeriesRuleEngine
+
 
 class Mymethod:
-    def __init__(self, raw_folder, processed_folder, failed_folder):
+    def __init__(self, raw_folder, processed_folder, failed_folder, rules_path=None):
+        '''
+        rules_path: 序列匹配规则 (json), None 时用 SeriesRules.default_rules, 和原来的 matcher 一样
+        '''
         self.raw_folder = raw_folder
         self.process_folder = processed_folder
         self.failed_folder = failed_folder
+        self.engine = SeriesRuleEngine(rules_path)
 
     def GetPath(self, case_folder):
         for root, dirs, files in os.walk(case_folder):
@@ -21,6 +27,26 @@ class Mymethod:
                 return root, dirs, files
 
     def T2Matcher(self, files):
+        return self.engine.Match(files, 't2')
+
+    def DWIMatcher(self, files):
+        return self.engine.Match(files, 'dwi')
+
+    def ADCMatcher(self, files):
+        return self.engine.Match(files, 'adc')
+
+    def ROIMatcher(self, files):
+        return self.engine.Match(files, 'roi')
+
+    def _Pick(self, classified, category):
+        # classified: engine.Classify 的结果, 一个 case 只遍历一次文件
+        result, error = classified
+        if category in error:
+            raise Exception(error[category])
+        return result[category]
+
+    # 原来的 matcher, 用来和 SeriesRuleEngine 比较 (SeriesRules.CheckParity)
+    def _T2MatcherLegacy(self, files):
         t2_matcher = SeriesStringMatcher(include_key=['t2'], exclude_key=['roi', 'ROI', 'diff', 'CA', 'ca', 'drawr', 'map', 'DIS2D', 'PosDisp'],
                                          suffex=('.nii'))
         T2_matcher = SeriesStringMatcher(include_key=['T2'], exclude_key=['roi', 'ROI', 'diff', 'CA', 'ca', 'drawr', 'map'],
@@ -40,7 +66,7 @@ class Mymethod:
 
         return sorted(t2_result)
 
-    def DWIMatcher(self, files):
+    def _DWIMatcherLegacy(self, files):
         dwi_matcher = SeriesStringMatcher(include_key='dwi', exclude_key=['Reg', 'ADC', 'BVAL', 'drawr'],
                                           suffex=('.nii', '.bval', '.bvec'))
         DwI_matcher = SeriesStringMatcher(include_key='DWI', exclude_key=['Reg', 'ADC', 'BVAL', 'drawr', 'hr'],
@@ -70,7 +96,7 @@ class Mymethod:
 
         return dwi_result
 
-    def ADCMatcher(self, files):
+    def _ADCMatcherLegacy(self, files):
         adc_matcher = SeriesStringMatcher(include_key=['adc'], exclude_key=['hr', 'drawr', 'Reg', 'roi'], suffex=('.nii'))
         ADC_matcher = SeriesStringMatcher(include_key=['ADC'], exclude_key=['hr', 'drawr', 'Reg', 'roi'], suffex=('.nii'))
         A_D_C_matcher = SeriesStringMatcher(include_key=['Apparent Diffusion Coefficient'], exclude_key=['hr', 'drawr', 'Reg', 'roi'],
@@ -85,7 +111,7 @@ class Mymethod:
                 raise Exception('Can not find ADC data')
         return adc_result
 
-    def ROIMatcher(self, files):
+    def _ROIMatcherLegacy(self, files):
         roi_matcher = SeriesStringMatcher(include_key='roi', exclude_key=['drawr', 'adc', 'ADC'], suffex=('.nii', '.csv'))
         roi_result = roi_matcher.Match(files)
         if len(roi_result) == 0:
@@ -187,8 +213,9 @@ class Mymethod:
                 continue
 
             print('Copy, roi, dwi and adc: {}'.format(case))
+            classified = self.engine.Classify(files)
             try:
-                t2_result = self.T2Matcher(files)
+                t2_result = self._Pick(classified, 't2')
                 # copy
                 if len(t2_result) == 1:
                     self.CopyData(t2_result[0], des_case_folder, case_path, 't2.nii')
@@ -202,7 +229,7 @@ class Mymethod:
                 print('Failed to copy t2.')
 
             try:
-                roi_result = self.ROIMatcher(files)
+                roi_result = self._Pick(classified, 'roi')
                 # copy
                 roi_list = ['roi0', 'roi1', 'roi2']
                 if len(roi_result) == 2:
@@ -225,7 +252,7 @@ class Mymethod:
                 print('Failed to copy roi.')
 
             # try:
-            #     dwi_result = self.DWIMatcher(files)
+            #     dwi_result = self._Pick(classified, 'dwi')
             #     # print(dwi_result)
             #     self.CopyDKIData(dwi_result, des_case_folder, case_path)
             # except Exception as e:
@@ -234,7 +261,7 @@ class Mymethod:
             #     print('Failed to copy dwi.')
 
             # try:
-            #     adc_result = self.ADCMatcher(files)
+            #     adc_result = self._Pick(classified, 'adc')
             #     if len(adc_result) == 1:
             #         self.CopyData(adc_result[0], des_case_folder, case_path, 'adc.nii')
             #     else:
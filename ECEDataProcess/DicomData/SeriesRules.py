@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import random
+
+# SaveNii.Mymethod 的序列匹配规则, 编译成一次遍历:
+#     所有规则里出现的关键字编成 bit, 每个文件只算一次包含了哪些关键字 (mask), 每个 group 的判断就是
+#     (mask & include) == include and (mask & exclude) == 0 and 后缀对, 一次遍历得到所有序列.
+# 和 SeriesStringMatcher.Match 的结果一样: 关键字区分大小写, include 都要有, exclude 一个都不能有,
+# 同一个序列几个 group 的结果按 group 的顺序拼起来 (同一个文件可以出现两次), 每个 group 内保持文件的顺序.
+#
+# 每个序列的规则:
+#     groups:   [{'name', 'include', 'exclude', 'suffix'}], 结果按顺序拼接
+#     fallback: groups 都没匹配到时用的 groups
+#     refine:   结果多于一个时, 第一个有结果的 group 对应的 include 再筛一次, 比如 t2 -> 'tra', T2 -> 'Ax'
+#     sort:     结果排序; error: 没有结果时的异常信息
+# 原来的几个 matcher 有的 include_key 给的是字符串 ('dwi' / 'roi' / 'ADC'), refine 用的 SeriesStringMatcher 是默认后缀,
+# 这两处 SeriesStringMatcher 的行为这里没法确认: 在有 MIP4AIM 的机器上用 RecordLegacy 记下原来的结果
+# (legacy_record_path), 之后 CheckRecorded 不需要 MIP4AIM 也能对比.
+
+_dwi_suffix = ['.nii', '.bval', '.bvec']
+_dwi_exclude = ['Reg', 'ADC', 'BVAL', 'drawr', 'MC']
+_adc_exclude = ['hr', 'drawr', 'Reg', 'roi']
+
+default_rules = {
+    't2': {
+        'groups': [{'name': 't2', 'include': ['t2'], 'suffix': ['.nii'],
+                    'exclude': ['roi', 'ROI', 'diff', 'CA', 'ca', 'drawr', 'map', 'DIS2D', 'PosDisp']},
+                   {'name': 'T2', 'include': ['T2'], 'suffix': ['.nii'],
+                    'exclude': ['roi', 'ROI', 'diff', 'CA', 'ca', 'drawr', 'map']}],
+        'refine': [['t2', ['tra']], ['T2', ['Ax']]],
+        'sort': True,
+        'error': 'Can not find t2 nii data'},
+    'dwi': {
+        'groups': [{'name': 'dwi', 'include': ['dwi'], 'exclude': ['Reg', 'ADC', 'BVAL', 'drawr'],
+                    'suffix': _dwi_suffix},
+                   {'name': 'DWI', 'include': ['DWI'], 'exclude': ['Reg', 'ADC', 'BVAL', 'drawr', 'hr'],
+                    'suffix': _dwi_suffix},
+                   {'name': 'diff', 'include': ['diff'], 'exclude': _dwi_exclude, 'suffix': _dwi_suffix},
+                   {'name': 'DKI', 'include': ['DKI'], 'exclude': _dwi_exclude, 'suffix': _dwi_suffix},
+                   {'name': 'dki', 'include': ['dki'], 'exclude': _dwi_exclude, 'suffix': _dwi_suffix},
+                   {'name': 'trace', 'include': ['trace'], 'exclude': _dwi_exclude, 'suffix': _dwi_suffix}],
+        'fallback': [{'name': 'DWI_all', 'include': ['DWI'], 'exclude': ['Reg', 'ADC', 'BVAL', 'drawr'],
+                      'suffix': _dwi_suffix}],
+        'error': 'Can not find DWI or DKI data'},
+    'adc': {
+        'groups': [{'name': 'adc', 'include': ['adc'], 'exclude': _adc_exclude, 'suffix': ['.nii']},
+                   {'name': 'ADC', 'include': ['ADC'], 'exclude': _adc_exclude, 'suffix': ['.nii']},
+                   {'name': 'A_D_C', 'include': ['Apparent Diffusion Coefficient'], 'exclude': _adc_exclude,
+                    'suffix': ['.nii']}],
+        'fallback': [{'name': 'ADC_all', 'include': ['ADC'], 'exclude': ['drawr', 'Reg', 'roi'], 'suffix': ['.nii']}],
+        'error': 'Can not find ADC data'},
+    'roi': {
+        'groups': [{'name': 'roi', 'include': ['roi'], 'exclude': ['drawr', 'adc', 'ADC'], 'suffix': ['.nii', '.csv']}],
+        'error': 'Can not find ROI data'},
+}
+
+
+def LoadRules(rules_path=None):
+    if rules_path is None:
+        return default_rules
+    with open(rules_path, 'r') as file:
+        return json.load(file)
+
+
+def SaveRules(rules_path, rules=None):
+    # 导出默认规则, 改完以后用 SeriesRuleEngine(rules_path) 加载
+    with open(rules_path, 'w') as file:
+        json.dump(default_rules if rules is None else rules, file, indent=1)
+
+
+class SeriesRuleEngine(object):
+    '''
+    engine = SeriesRuleEngine(rules_path)
+    result, error = engine.Classify(files)    # {'t2': [...], 'dwi': [...], ...}, {'roi': 'Can not find ROI data'}
+    engine.Match(files, 't2')                 # 和 Mymethod.T2Matcher 一样, 没有结果时抛异常
+    '''
+    def __init__(self, rules=None):
+        if rules is None or isinstance(rules, str):
+            rules = LoadRules(rules)
+        self.rules = rules
+
+        key_list = []
+        for spec in rules.values():
+            for group in spec.get('groups', []) + spec.get('fallback', []):
+                key_list += group['include'] + group.get('exclude', [])
+            for _, include in spec.get('refine', []):
+                key_list += include
+        # 去重, 保持顺序
+        self.key_list = list(dict.fromkeys(key_list))
+        self.bit = {key: 1 << index for index, key in enumerate(self.key_list)}
+
+        # [(序列, group 名, include mask, exclude mask, 后缀)], 包括 fallback
+        self.group_list = []
+        for category, spec in rules.items():
+            for group in spec.get('groups', []) + spec.get('fallback', []):
+                self.group_list.append((category, group['name'], self._Mask(group['include']),
+                                        self._Mask(group.get('exclude', [])), tuple(group.get('suffix', ['']))))
+
+    def _Mask(self, key_list):
+        mask = 0
+        for key in key_list:
+            mask |= self.bit[key]
+        return mask
+
+    def FileMask(self, file):
+        mask = 0
+        for key, bit in self.bit.items():
+            if key in file:
+                mask |= bit
+        return mask
+
+    def _Scan(self, files):
+        # 一次遍历: {(序列, group 名): [文件]}, 和每个文件的 mask
+        matched = {(category, name): [] for category, name, _, _, _ in self.group_list}
+        mask_dict = {}
+        for file in files:
+            mask = mask_dict.get(file)
+            if mask is None:
+                mask = mask_dict[file] = self.FileMask(file)
+            for category, name, include, exclude, suffix in self.group_list:
+                if mask & include == include and not mask & exclude and file.endswith(suffix):
+                    matched[(category, name)].append(file)
+        return matched, mask_dict
+
+    def _Resolve(self, category, matched, mask_dict):
+        spec = self.rules[category]
+        result = []
+        for group in spec.get('groups', []):
+            result += matched[(category, group['name'])]
+
+        if len(result) > 1:
+            for name, include in spec.get('refine', []):
+                if len(matched[(category, name)]) != 0:
+                    include = self._Mask(include)
+                    result = [one for one in result if mask_dict[one] & include == include]
+                    break
+
+        if len(result) == 0:
+            for group in spec.get('fallback', []):
+                result += matched[(category, group['name'])]
+
+        if spec.get('sort', False):
+            result = sorted(result)
+        return result
+
+    def Classify(self, files):
+        matched, mask_dict = self._Scan(files)
+        result, error = {}, {}
+        for category, spec in self.rules.items():
+            result[category] = self._Resolve(category, matched, mask_dict)
+            if len(result[category]) == 0:
+                error[category] = spec.get('error', 'Can not find {} data'.format(category))
+        return result, error
+
+    def Match(self, files, category):
+        result, error = self.Classify(files)
+        if category in error:
+            raise Exception(error[category])
+        return result[category]
+
+
+def _LegacyResult(files):
+    # 原来 Mymethod 的四个 matcher, 需要 MIP4AIM
+    from ECEDataProcess.DicomData.SaveNii import Mymethod
+    processor = Mymethod(None, None, None)
+    result, error = {}, {}
+    for category, matcher in [('t2', processor._T2MatcherLegacy), ('dwi', processor._DWIMatcherLegacy),
+                              ('adc', processor._ADCMatcherLegacy), ('roi', processor._ROIMatcherLegacy)]:
+        try:
+            result[category] = matcher(files)
+        except Exception as e:
+            result[category], error[category] = [], e.__str__()
+    return result, error
+
+
+def _Different(old_result, old_error, new_result, new_error):
+    return [category for category in old_result
+            if old_result[category] != new_result.get(category) or old_error.get(category) != new_error.get(category)]
+
+
+def CheckParity(files, engine=None):
+    # 和原来的 matcher 比较, 返回不一样的序列
+    engine = SeriesRuleEngine() if engine is None else engine
+    new_result, new_error = engine.Classify(files)
+    old_result, old_error = _LegacyResult(files)
+    return _Different(old_result, old_error, new_result, new_error)
+
+
+legacy_record_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'series_rules_legacy.json')
+
+
+def ProbeFiles():
+    '''
+    专门区分 SeriesStringMatcher 行为的文件名: include_key 是字符串时是整个匹配还是逐个字符 ('d_w_i'),
+    suffex=('.nii') 是后缀还是逐个字符, refine ('tra' / 'Ax') 用的默认后缀会不会去掉 .nii 以外的文件.
+    '''
+    return ['1_t2_tse_tra.nii', '2_t2_tse_sag.nii', '3_t2_tse_tra.nii.gz', '4_T2 Ax FRFSE.nii', '5_T2 Sag.nii',
+            '6_T2_Ax.json', '7_ep2d_d_w_i.nii', '8_dwi_b1500.nii', '9_dwi_b1500.bval', '10_dwi_b1500.bvec',
+            '11_dwi_b1500.json', '12_DWI_hr.nii', '13_A_D_C.nii', '14_ep2d_ADC.nii', '15_ADC_hr.nii',
+            '16_r_o_i.nii', '17_roi.nii', '18_roi.csv', '19_roi.nii.gz', '20_adc_roi.nii', '21_t2_tra.nii.i',
+            '22_DKI.nii', '23_diff_MC.nii', '24_trace.bval']
+
+
+def RecordLegacy(record_path=None, file_number_list=(100, 1000), seed=0):
+    # 在有 MIP4AIM 的机器上跑: ProbeFiles 和 SyntheticFiles 上原来 matcher 的结果写进 json, 和代码一起提交
+    record_path = legacy_record_path if record_path is None else record_path
+    record = []
+    for name, files in [('probe', ProbeFiles())] + [('synthetic_{}'.format(one), SyntheticFiles(one, seed))
+                                                    for one in file_number_list]:
+        result, error = _LegacyResult(files)
+        record.append({'name': name, 'files': files, 'result': result, 'error': error})
+    with open(record_path, 'w') as file:
+        json.dump(record, file, indent=1)
+    return record
+
+
+def CheckRecorded(record_path=None, engine=None):
+    '''
+    和 RecordLegacy 记下的结果比较, 不需要 MIP4AIM. 返回 {记录名: 不一样的序列}, 都一样时是空的.
+    '''
+    record_path = legacy_record_path if record_path is None else record_path
+    engine = SeriesRuleEngine() if engine is None else engine
+    with open(record_path, 'r') as file:
+        record = json.load(file)
+    different = {}
+    for one in record:
+        new_result, new_error = engine.Classify(one['files'])
+        category_list = _Different(one['result'], one['error'], new_result, new_error)
+        if len(category_list) > 0:
+            different[one['name']] = category_list
+    return different
+
+
+def SyntheticFiles(file_number, seed=0):
+    # 模拟 dcm2niix 转出来的文件名, 用来做 benchmark
+    rng = random.Random(seed)
+    stem = ['t2_tse_tra', 'T2 Ax FRFSE', 't2_tse_sag', 't2_tse_cor', 'ep2d_diff_b50_800_1500_tra', 'DWI_b1500',
+            'DKI_tra', 'dwi_trace', 'ep2d_diff_tra_ADC', 'Apparent Diffusion Coefficient (mm2_s)', 'ADC_hr',
+            'roi0', 'roi1', 'roi', 'drawroi', 'localizer', 'PosDisp_t2', 'T2map', 'dwi_Reg']
+    suffix = ['.nii', '.nii', '.bval', '.bvec', '.json', '.csv', '.nii.gz']
+    return ['{}_{}_{}{}'.format(index, rng.choice(stem), rng.randint(1, 30), rng.choice(suffix))
+            for index in range(file_number)]
+
+
+def BenchmarkMatcher(file_number_list=(100, 1000, 5000, 20000), repeat=5, check_parity=True):
+    engine = SeriesRuleEngine()
+    rows = []
+    for file_number in file_number_list:
+        files = SyntheticFiles(file_number)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            engine.Classify(files)
+        new_time = (time.perf_counter() - start) / repeat
+
+        old_time, parity = None, None
+        try:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                _LegacyResult(files)
+            old_time = (time.perf_counter() - start) / repeat
+            if check_parity:
+                parity = len(CheckParity(files, engine)) == 0
+        except ImportError:
+            # 没有 MIP4AIM 时只测新的, parity 用记下的结果
+            if check_parity and os.path.exists(legacy_record_path):
+                parity = len(CheckRecorded(engine=engine)) == 0
+        rows.append({'files': file_number, 'engine': new_time, 'legacy': old_time, 'parity': parity})
+        print('{:>6} files: engine {:.4f}s, legacy {}, parity {}'.format(
+            file_number, new_time, 'n/a' if old_time is None else '{:.4f}s'.format(old_time), parity))
+    return rows
+
+
+if __name__ == '__main__':
+    BenchmarkMatcher()
+    # RecordLegacy()   # 有 MIP4AIM 时
+    # SaveRules(os.path.join(os.path.dirname(__file__), 'series_rules.json'))
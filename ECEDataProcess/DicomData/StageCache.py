@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import hashlib
+
+# 预处理每个阶段的缓存, key 是这个阶段输入和参数的 hash:
+#     输入文件按内容 hash (按 size/mtime 记住, 没变的文件不重复读), DICOM 用 SeriesInstanceUID, 参数里放 b 值/模型版本等.
+# key 没变并且上次的输出都还在 (size/mtime 没变) 就跳过这个阶段. 中间某个阶段失败时, 前面成功的阶段下次直接命中.
+# store_case_folder/stage_cache.json 记录每个阶段的 key/输出/命中次数, log_path 里每次命中或重跑记一行.
+
+manifest_name = 'stage_cache.json'
+default_suffixes = ('.nii', '.nii.gz', '.bval', '.bvec', '.json')
+
+
+def _Stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def _Snapshot(folder_list):
+    snapshot = {}
+    for folder in folder_list:
+        for root, dirs, files in os.walk(folder):
+            for file in files:
+                if file == manifest_name or file.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, file)
+                snapshot[path] = _Stat(path)
+    return snapshot
+
+
+def ModelVersion(model_folder):
+    # 模型目录下文件名/大小/修改时间的 hash, 换了权重或配置 key 就变
+    digest = hashlib.sha1()
+    for path, (size, mtime) in sorted(_Snapshot([model_folder]).items()):
+        digest.update('{}|{}|{}'.format(os.path.relpath(path, model_folder), size, mtime).encode())
+    return digest.hexdigest()
+
+
+def SeriesUID(case_folder):
+    '''
+    每个存放 DICOM 的子目录的 (相对路径, SeriesInstanceUID, 文件数), 只读第一个文件的头.
+    没有 pydicom 时用文件名和大小代替 UID.
+    '''
+    try:
+        import pydicom
+    except ImportError:
+        pydicom = None
+
+    series = []
+    for root, dirs, files in os.walk(case_folder):
+        dicom_files = sorted([one for one in files if not one.endswith(default_suffixes)])
+        if len(dicom_files) == 0 or len(dirs) > 0:
+            continue
+        uid = None
+        if pydicom is not None:
+            try:
+                header = pydicom.dcmread(os.path.join(root, dicom_files[0]), stop_before_pixels=True,
+                                         specific_tags=['SeriesInstanceUID'])
+                uid = str(header.SeriesInstanceUID)
+            except Exception:
+                uid = None
+        if uid is None:
+            uid = hashlib.sha1('|'.join('{}:{}'.format(one, os.path.getsize(os.path.join(root, one)))
+                                        for one in dicom_files).encode()).hexdigest()
+        series.append([os.path.relpath(root, case_folder), uid, len(dicom_files)])
+    return sorted(series)
+
+
+class StageCache(object):
+    '''
+    cache = StageCache(store_case_folder, stage_order=[...], log_path=...)
+    result = cache.Run('Registrate Different series', func, params={'b': 1500},
+                       input_folders=[store_case_folder], watch_folders=[store_case_folder])
+    func 返回 None 或者非 tuple 表示成功; 返回 (False, ...) / (State, Info) 这类失败结果时不写缓存, 原样返回.
+    '''
+    def __init__(self, store_case_folder, case=None, stage_order=None, log_path=None, suffixes=default_suffixes):
+        self.store_case_folder = store_case_folder
+        self.case = os.path.basename(store_case_folder) if case is None else case
+        self.stage_order = [] if stage_order is None else list(stage_order)
+        self.log_path = log_path
+        self.suffixes = suffixes
+        self.manifest_path = os.path.join(store_case_folder, manifest_name)
+        self.manifest = {'stage': {}, 'hash': {}}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as file:
+                    self.manifest = json.load(file)
+            except ValueError:
+                # 写到一半的 manifest, 当作没有缓存
+                pass
+
+    def _Save(self):
+        with open(self.manifest_path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _Log(self, stage, state, key, cost):
+        if self.log_path is None:
+            return
+        is_new = not os.path.exists(self.log_path)
+        with open(self.log_path, 'a') as file:
+            if is_new:
+                file.write('time,case,stage,state,key,seconds\n')
+            file.write('{},"{}","{}",{},{},{:.2f}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), self.case, stage,
+                                                             state, key[:12], cost))
+
+    def _FileHash(self, path):
+        stat = _Stat(path)
+        known = self.manifest['hash'].get(path)
+        if known is not None and known[:2] == stat:
+            return known[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        self.manifest['hash'][path] = stat + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def _Excluded(self, stage):
+        # 这个阶段和后面阶段的输出不算输入, 重跑时文件夹里已经有它们了
+        if stage in self.stage_order:
+            stage_list = self.stage_order[self.stage_order.index(stage):]
+        else:
+            stage_list = [stage]
+        excluded = set()
+        for one in stage_list:
+            excluded.update(self.manifest['stage'].get(one, {}).get('outputs', {}).keys())
+        return excluded
+
+    def Key(self, stage, params=None, input_folders=None, input_files=None):
+        excluded = self._Excluded(stage)
+        file_list = [] if input_files is None else list(input_files)
+        for path in _Snapshot([] if input_folders is None else input_folders):
+            if path.endswith(self.suffixes) and path not in excluded:
+                file_list.append(path)
+
+        digest = hashlib.sha1()
+        digest.update(stage.encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for path in sorted(set(file_list)):
+            digest.update('{}|{}'.format(os.path.basename(path), self._FileHash(path)).encode())
+        return digest.hexdigest()
+
+    def IsHit(self, stage, key):
+        record = self.manifest['stage'].get(stage)
+        if record is None or record['key'] != key:
+            return False
+        for path, stat in record['outputs'].items():
+            if not os.path.exists(path) or _Stat(path) != stat:
+                return False
+        return True
+
+    def Run(self, stage, func, params=None, input_folders=None, input_files=None, watch_folders=None):
+        key = self.Key(stage, params, input_folders, input_files)
+        if self.IsHit(stage, key):
+            record = self.manifest['stage'][stage]
+            record['hit'] = record.get('hit', 0) + 1
+            self._Save()
+            self._Log(stage, 'hit', key, 0.)
+            return record.get('result')
+
+        watch_folders = [] if watch_folders is None else watch_folders
+        before = _Snapshot(watch_folders)
+        start = time.perf_counter()
+        result = func()
+        cost = time.perf_counter() - start
+        if _IsFailed(result):
+            self.manifest['stage'].pop(stage, None)
+            self._Save()
+            self._Log(stage, 'failed', key, cost)
+            return result
+
+        after = _Snapshot(watch_folders)
+        outputs = {path: stat for path, stat in after.items() if before.get(path) != stat}
+        record = self.manifest['stage'].get(stage, {})
+        self.manifest['stage'][stage] = {'key': key, 'outputs': outputs, 'result': result,
+                                         'hit': record.get('hit', 0), 'miss': record.get('miss', 0) + 1,
+                                         'seconds': round(cost, 2), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        self._Save()
+        self._Log(stage, 'miss', key, cost)
+        return result
+
+    def Summary(self):
+        return {stage: (one.get('hit', 0), one.get('miss', 0)) for stage, one in self.manifest['stage'].items()}
+
+
+def _IsFailed(result):
+    # AutoProcessor 里的失败返回: (False, message) / (False, source, dest) / (State, Info)
+    if isinstance(result, tuple) and len(result) > 0:
+        return result[0] is False or isinstance(result[0], str)
+    return False
@@ -2,6 +2,11 @@ import os
 import time
 import glob
 import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
 
 from MIP4AIM.Functions.DicomInfo import DicomShareInfo
 from MIP4AIM.Dicom2Nii.DataReader import DataReader
@@ -15,14 +20,85 @@ from CNNModel.SuccessfulModel.CSProstateCancerDetection import CSDetectTrumpetNe
 
 from MeDIT.Log import CustomerCheck, Eclog
 
+from ECEDataProcess.DicomData.CaseWatcher import CaseWatcher
+from ECEDataProcess.DicomData.StageCache import StageCache, SeriesUID, ModelVersion
+from ECEDataProcess.DataProcess.GridResample import RegistrateCase, CaseMovingList
+
+# 进程池里每个 worker 自己的 AutoProcessor, 模型在 worker 启动时加载一次
+_worker_processor = None
+
+
+def _InitWorker(init_args, pool_size=1):
+    global _worker_processor
+    _worker_processor = AutoProcessor(*init_args)
+    # 同一台机器上 pool_size 个 worker 一起重采样, 默认的 sitk_threads 按它平分 CPU
+    _worker_processor.pool_size = pool_size
+    _worker_processor.LoadModel()
+
+
+def _ProcessInWorker(case, store_case_folder):
+    return _worker_processor.ProcessOneCase(case, store_case_folder)
+
+
+class StageTimer(object):
+    '''
+    每个阶段累计的耗时和 case 数, Summary 里给出每个阶段的 case/h 以及整体的 case/h.
+    多进程时各阶段时间是所有 worker 加起来的, 整体吞吐按墙上时间算.
+    '''
+    def __init__(self):
+        self.stage_time, self.stage_count = {}, {}
+        self.case_number, self.failed_number = 0, 0
+        self.latency = []
+        self.start = time.perf_counter()
+
+    def Add(self, stage_times, is_failed):
+        for stage, one in stage_times:
+            self.stage_time[stage] = self.stage_time.get(stage, 0.) + one
+            self.stage_count[stage] = self.stage_count.get(stage, 0) + 1
+        self.case_number += 1
+        self.failed_number += int(is_failed)
+
+    def AddLatency(self, latency):
+        # 从 study 到达 raw_folder 到处理完的时间
+        self.latency.append(latency)
+
+    def Summary(self):
+        wall = time.perf_counter() - self.start
+        lines = ['{} cases ({} failed) in {:.1f}s, {:.1f} cases/h'.format(
+            self.case_number, self.failed_number, wall, self.case_number / wall * 3600 if wall > 0 else 0.)]
+        if len(self.latency) > 0:
+            lines.append('    latency: median {:.1f}s, max {:.1f}s'.format(np.median(self.latency), np.max(self.latency)))
+        for stage, total in self.stage_time.items():
+            count = self.stage_count[stage]
+            lines.append('    {:<30} {:>5} cases, {:8.2f}s/case, {:8.1f} cases/h per worker'.format(
+                stage, count, total / count, count / total * 3600 if total > 0 else 0.))
+        return '\n'.join(lines)
+
+
 class AutoProcessor:
-    def __init__(self, raw_folder, processed_folder, failed_folder, segment_model_folder, detect_model_folder, is_overwrite=False):
+    def __init__(self, raw_folder, processed_folder, failed_folder, segment_model_folder, detect_model_folder, is_overwrite=False,
+                 use_cache=False, roi_list=None, registration_workers=None, sitk_threads=None):
+        '''
+        use_cache: 每个阶段按输入和参数的 hash 缓存 (StageCache), 已经处理过的 case 不再整个跳过或整个重跑,
+                   只重跑输入变了的阶段; 失败时保留 store_case_folder, 下次从失败的阶段接着跑.
+        roi_list: 配准时和 ADC/DWI 一起重采样到 T2 上的 ROI 文件名
+        registration_workers / sitk_threads: 同时重采样的序列数 / 每个序列的 ITK 线程数, 见 GridResample.RegistrateCase;
+                   不设 sitk_threads 时按 IterativeCase/WatchCase 的 num_workers (进程池大小) 平分 CPU.
+        '''
+        self._init_args = (raw_folder, processed_folder, failed_folder, segment_model_folder, detect_model_folder,
+                           is_overwrite, use_cache, roi_list, registration_workers, sitk_threads)
         self.raw_folder = raw_folder
         self.process_folder = processed_folder
         self.failed_folder = failed_folder
         self.segment_model_folder = segment_model_folder
         self.detect_model_folder = detect_model_folder
         self.is_overwrite = is_overwrite
+        self.use_cache = use_cache
+        self.roi_list = roi_list
+        self.registration_workers = registration_workers
+        self.sitk_threads = sitk_threads
+        self.pool_size = 1
+        self.target_b_value = 1500
         self.dcm2niix_path = r'd:\StandardAlongProgram\MRICron\mricrogl_windows\mricrogl\dcm2niix.exe'
 
         self.matcher = MatcherManager()
@@ -42,7 +118,9 @@ class AutoProcessor:
     def DetectProstateCancer(self, case_folder):
         t2_path = os.path.join(case_folder, 't2.nii')
         adc_path = os.path.join(case_folder, 'adc_Reg.nii')
-        dwi_path = glob.glob(os.path.join(case_folder, 'dwi_b[0-9]*_Reg.nii'))[0]
+        # 所有 b 值都配准了, 用和 target_b_value 最近的那个
+        dwi_path = self.registrator.GenerateStorePath(
+            self.dwi_processor.ExtractSpecificDwiFile(case_folder, self.target_b_value))
         prostate_roi = os.path.join(case_folder, r'ProstateROI_TrumpetNet.nii.gz')
         self.pca_detector.Run(t2_path, adc_path, dwi_path, prostate_roi_image=prostate_roi,
                          store_folder=case_folder)
@@ -52,28 +130,19 @@ class AutoProcessor:
         self.prostate_segmentor.Run(t2_path, store_folder=case_folder)
 
     def RegistrateBySpacing(self, case_folder, target_b_value=1500):
+        # T2 的网格只读一次, ADC / 每个 b 值的 DWI / ROI 同时重采样, 见 GridResample
         t2_path = os.path.join(case_folder, 't2.nii')
-        adc_path = os.path.join(case_folder, 'adc.nii')
         dwi_path = self.dwi_processor.ExtractSpecificDwiFile(case_folder, target_b_value)
 
         if dwi_path == '':
             return False, 'No DWI with b close to {}'.format(target_b_value)
 
-        self.registrator.fixed_image = t2_path
-
-        self.registrator.moving_image = adc_path
-        try:
-            self.registrator.RegistrateBySpacing(store_path=self.registrator.GenerateStorePath(adc_path))
-        except:
-            return False, 'Align ADC Failed'
-
-        self.registrator.moving_image = dwi_path
-        try:
-            self.registrator.RegistrateBySpacing(store_path=self.registrator.GenerateStorePath(dwi_path))
-        except:
-            return False, 'Align DWI Failed'
-
-        return True, ''
+        moving_list = CaseMovingList(case_folder, roi_list=self.roi_list)
+        if dwi_path not in [one[1] for one in moving_list]:
+            moving_list.append(('DWI', dwi_path, False))
+        is_work, message, times = RegistrateCase(t2_path, moving_list, num_workers=self.registration_workers,
+                                                 sitk_threads=self.sitk_threads, pool_size=self.pool_size)
+        return is_work, message
 
 
     def SeperateDWI(self, case_folder):
@@ -96,6 +165,13 @@ class AutoProcessor:
                     ConvertDicom2Nii(root, root + '\\..', dcm2niix_path=self.dcm2niix_path)
 
     def MoveFilaedCase(self, case):
+        if self.use_cache:
+            # 有缓存时原始数据留在 raw_folder, 下次从失败的阶段接着跑; failed_folder 里放一份拷贝方便查看
+            failed_case_folder = os.path.join(self.failed_folder, case)
+            if os.path.exists(failed_case_folder):
+                shutil.rmtree(failed_case_folder)
+            shutil.copytree(os.path.join(self.raw_folder, case), failed_case_folder)
+            return
         if not os.path.exists(os.path.join(self.failed_folder, case)):
             shutil.move(os.path.join(self.raw_folder, case), os.path.join(self.failed_folder, case))
         else:
@@ -104,96 +180,272 @@ class AutoProcessor:
         if os.path.exists(os.path.join(self.process_folder, case)):
             shutil.rmtree(os.path.join(self.process_folder, case))
 
-    def IterativeCase(self):
+    def LoadModel(self):
         print('Loading: Segment MyModel')
         self.prostate_segmentor.LoadConfigAndModel(self.segment_model_folder)
 
         print('Loading: Detection MyModel')
         self.pca_detector.LoadConfigAndModel(self.detect_model_folder)
 
+    def _Stages(self, case_folder, store_case_folder):
+        # (提示, 失败时写进 log 的 State, 执行) ; 执行返回 None 表示成功, 返回 (State, Info) 表示没有异常但失败了
+        def ExtractSeries():
+            is_work, message_one, message_two = self.ExtractSeries(case_folder, store_case_folder)
+            if not is_work:
+                return message_one, message_two
+
+        def Registrate():
+            is_work, message = self.RegistrateBySpacing(store_case_folder, self.target_b_value)
+            if not is_work:
+                return 'Registration failed. ', message
+
+        return [('Convert Dicom to Nii', 'Dicom to Nii failed.', lambda: self.ConvertDicom2Nii(case_folder)),
+                ('Extract Target Series', 'Series are crashed', ExtractSeries),
+                ('Seperate 4D Nii', 'Seperate DWI failed.', lambda: self.SeperateDWI(store_case_folder)),
+                ('Registrate Different series', 'Registration failed.', Registrate),
+                ('Segment Prostate', 'Segment prostate failed.', lambda: self.SegmentProstate(store_case_folder)),
+                ('Detect PCa', 'PCa detection failed.', lambda: self.DetectProstateCancer(store_case_folder))]
+
+    def _CacheSpec(self, message, case_folder, store_case_folder):
+        # 每个阶段的 (参数, 输入目录, 输出目录)
+        if message == 'Convert Dicom to Nii':
+            return {'series': SeriesUID(case_folder)}, None, [case_folder]
+        if message == 'Extract Target Series':
+            return {'config': ['t2', 'dwi', 'adc']}, [case_folder], [store_case_folder]
+        if message == 'Registrate Different series':
+            params = {'target_b_value': self.target_b_value, 'roi': self.roi_list}
+            return params, [store_case_folder], [store_case_folder]
+        if message == 'Segment Prostate':
+            return {'model': ModelVersion(self.segment_model_folder)}, [store_case_folder], [store_case_folder]
+        if message == 'Detect PCa':
+            return {'model': ModelVersion(self.detect_model_folder)}, [store_case_folder], [store_case_folder]
+        return None, [store_case_folder], [store_case_folder]
+
+    def ProcessOneCase(self, case, store_case_folder):
+        '''
+        跑完一个 case 的所有阶段. 返回 (case, log, error, stage_times):
+        log 是要写进 CustomerCheck 的 {'State', 'Info'}, 成功时为 None; error 是要写进 Eclog 的异常信息.
+        失败的 case 在这里移到 failed_folder (use_cache 时只拷贝一份, 原始数据不动), log 由调用的进程统一写.
+        '''
+        case_folder = os.path.join(self.raw_folder, case)
+        stage_list = self._Stages(case_folder, store_case_folder)
+        cache = None
+        if self.use_cache:
+            cache = StageCache(store_case_folder, case, stage_order=[one[0] for one in stage_list],
+                               log_path=os.path.join(self.failed_folder, 'cache_log.csv'))
+        stage_times = []
+        for message, failed_state, stage in stage_list:
+            print('{}: {}'.format(message, case))
+            start = time.perf_counter()
+            try:
+                if cache is None:
+                    result = stage()
+                else:
+                    params, input_folders, watch_folders = self._CacheSpec(message, case_folder, store_case_folder)
+                    result = cache.Run(message, stage, params=params, input_folders=input_folders,
+                                       watch_folders=watch_folders)
+            except Exception as e:
+                stage_times.append((message, time.perf_counter() - start))
+                self.MoveFilaedCase(case)
+                return case, {'State': failed_state, 'Info': e.__str__()}, traceback.format_exc(), stage_times
+            stage_times.append((message, time.perf_counter() - start))
+            if result is not None:
+                self.MoveFilaedCase(case)
+                return case, {'State': result[0], 'Info': result[1]}, None, stage_times
+        return case, None, None, stage_times
+
+    def _Claim(self, case):
+        # 返回 store_case_folder, 不需要处理时返回 None
+        print(case, '\n')
+        case_folder = os.path.join(self.raw_folder, case)
+        if not os.path.isdir(case_folder):
+            return None
+
+        store_case_folder = os.path.join(self.process_folder, case)
+        if not os.path.exists(store_case_folder):
+            os.mkdir(store_case_folder)
+        else:
+            # 有缓存时由 StageCache 决定哪些阶段要重跑
+            if not self.is_overwrite and not self.use_cache:
+                return None
+        return store_case_folder
+
+    def _NewCases(self):
+        case_list = []
+        for case in sorted(os.listdir(self.raw_folder)):
+            store_case_folder = self._Claim(case)
+            if store_case_folder is not None:
+                case_list.append((case, store_case_folder))
+        return case_list
+
+    def _Record(self, result, timer):
+        case, log, error, stage_times = result
+        if log is not None:
+            self.log.AddOne(case, log)
+        if error is not None:
+            self.eclog.error(error)
+        timer.Add(stage_times, log is not None)
+
+    def _WorkerFailed(self, case, e):
+        # worker 本身出错 (比如进程崩溃), 也按失败记录
+        self.MoveFilaedCase(case)
+        return case, {'State': 'Worker failed.', 'Info': e.__str__()}, traceback.format_exc(), []
+
+    def _NewExecutor(self, num_workers):
+        return ProcessPoolExecutor(max_workers=num_workers, initializer=_InitWorker,
+                                   initargs=(self._init_args, num_workers))
+
+    def _Start(self, num_workers):
         self.log = CustomerCheck(os.path.join(self.failed_folder, 'failed_log.csv'), patient=1, data={'State': [], 'Info': []})
         self.eclog = Eclog(os.path.join(self.failed_folder, 'failed_log_details.log')).GetLogger()
 
-        while True:
-            for case in sorted(os.listdir(self.raw_folder)):
-                print(case, '\n')
-                case_folder = os.path.join(self.raw_folder, case)
-                if not os.path.isdir(case_folder):
-                    continue
+        if num_workers > 1:
+            return self._NewExecutor(num_workers)
+        self.LoadModel()
+        return None
+
+    def _Isolate(self, suspects):
+        # 每个 case 单独在一个新的单进程池里重跑, 只有让这个池也崩溃的 case 才是真正出问题的
+        finished = []
+        for item in suspects:
+            executor = self._NewExecutor(1)
+            try:
+                result = executor.submit(_ProcessInWorker, item[0], item[1]).result()
+            except Exception as e:
+                result = self._WorkerFailed(item[0], e)
+            finally:
+                executor.shutdown()
+            finished.append((item, result))
+        return finished
+
+    def _Collect(self, executor, running, num_workers, timeout=None):
+        '''
+        running: {future: (case, store_case_folder, ...)}, 等至少一个完成, 返回 (executor, [(item, result)]).
+        一个 worker 被杀掉 (OOM, GPU 模型 segfault) 以后整个进程池变成 BrokenProcessPool, 其余的 future
+        和以后的 submit 都会失败: 这时重建进程池, 还在跑的 case 逐个单独重跑, 健康的 case 不会被移走.
+        '''
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+        finished, suspects = [], []
+        for future in done:
+            item = running.pop(future)
+            try:
+                finished.append((item, future.result()))
+            except BrokenProcessPool:
+                suspects.append(item)
+            except Exception as e:
+                finished.append((item, self._WorkerFailed(item[0], e)))
+        if len(suspects) == 0:
+            return executor, finished
+
+        for future, item in list(running.items()):
+            if future.done() and not future.cancelled() and future.exception() is None:
+                finished.append((item, future.result()))
+            else:
+                suspects.append(item)
+        running.clear()
+        print('Process pool broken, rerun {} cases one by one: {}'.format(
+            len(suspects), ', '.join(one[0] for one in suspects)))
+        executor.shutdown(wait=False)
+        finished += self._Isolate(suspects)
+        return self._NewExecutor(num_workers), finished
+
+    def IterativeCase(self, num_workers=1, sleep_time=3600):
+        '''
+        num_workers > 1 时 case 在进程池里并行, 每个 worker 启动时加载一次分割和检测模型 (显存 x num_workers).
+        同时只提交 num_workers 个 case, 进程池崩溃时只需要单独重跑这几个. CustomerCheck/Eclog 只在主进程里写.
+        '''
+        executor = self._Start(num_workers)
 
-                store_case_folder = os.path.join(self.process_folder, case)
-                if not os.path.exists(store_case_folder):
-                    os.mkdir(store_case_folder)
+        try:
+            while True:
+                timer = StageTimer()
+                case_list = self._NewCases()
+                if executor is None:
+                    for case, store_case_folder in case_list:
+                        self._Record(self.ProcessOneCase(case, store_case_folder), timer)
                 else:
-                    if not self.is_overwrite:
+                    running = {}
+                    while len(case_list) > 0 or len(running) > 0:
+                        while len(case_list) > 0 and len(running) < num_workers:
+                            item = case_list.pop(0)
+                            running[executor.submit(_ProcessInWorker, *item)] = item
+                        executor, finished = self._Collect(executor, running, num_workers)
+                        for _, result in finished:
+                            self._Record(result, timer)
+
+                self.log.Save()
+                if timer.case_number > 0:
+                    print(timer.Summary())
+
+                print('Sleep........ZZZ.........ZZZZ..........')
+                time.sleep(sleep_time)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _RecordLatency(self, case, arrival, is_failed, timer):
+        finished = time.time()
+        timer.AddLatency(finished - arrival)
+        print('{}: {:.1f}s from arrival to result'.format(case, finished - arrival))
+        latency_path = os.path.join(self.failed_folder, 'latency.csv')
+        one_df = pd.DataFrame({'case': [case], 'arrival': [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(arrival))],
+                               'latency': [round(finished - arrival, 1)], 'failed': [int(is_failed)]})
+        one_df.to_csv(latency_path, mode='a', index=False, header=not os.path.exists(latency_path))
+
+    def WatchCase(self, num_workers=1, settle_time=60., poll_interval=5., use_events=True, report_interval=3600):
+        '''
+        代替 IterativeCase 的整点轮询: 新 study 写完 (settle_time 内没有变化) 后马上处理.
+        有 watchdog 时用文件系统事件, 否则每 poll_interval 秒扫描一次 raw_folder 这一层.
+        每个 case 从到达到出结果的延迟写在 failed_folder/latency.csv.
+        '''
+        executor = self._Start(num_workers)
+        ignore = None
+        if not self.is_overwrite and not self.use_cache:
+            ignore = lambda case: os.path.exists(os.path.join(self.process_folder, case))
+        watcher = CaseWatcher(self.raw_folder, settle_time=settle_time, poll_interval=poll_interval,
+                              use_events=use_events, ignore=ignore)
+
+        timer, report_time = StageTimer(), time.time()
+        pending, running = [], {}
+        try:
+            while True:
+                for case, arrival in watcher.Ready():
+                    store_case_folder = self._Claim(case)
+                    if store_case_folder is None:
                         continue
+                    if executor is None:
+                        result = self.ProcessOneCase(case, store_case_folder)
+                        self._Record(result, timer)
+                        self._RecordLatency(case, arrival, result[1] is not None, timer)
+                        if result[1] is not None:
+                            watcher.Discard(case)
+                        self.log.Save()
+                    else:
+                        pending.append((case, store_case_folder, arrival))
+
+                while len(pending) > 0 and len(running) < num_workers:
+                    item = pending.pop(0)
+                    running[executor.submit(_ProcessInWorker, item[0], item[1])] = item
+                if len(running) > 0:
+                    executor, finished = self._Collect(executor, running, num_workers, timeout=poll_interval)
+                    for (case, _, arrival), result in finished:
+                        self._Record(result, timer)
+                        self._RecordLatency(case, arrival, result[1] is not None, timer)
+                        if result[1] is not None:
+                            watcher.Discard(case)
+                    if len(finished) > 0:
+                        self.log.Save()
+                else:
+                    time.sleep(poll_interval)
+
+                if time.time() - report_time > report_interval and timer.case_number > 0:
+                    print(timer.Summary())
+                    timer, report_time = StageTimer(), time.time()
+        finally:
+            watcher.Stop()
+            if executor is not None:
+                executor.shutdown()
 
-                print('Convert Dicom to Nii: {}'.format(case))
-                try:
-                    self.ConvertDicom2Nii(case_folder)
-                except Exception as e:
-                    self.log.AddOne(case, {'State': 'Dicom to Nii failed.', 'Info': e.__str__()})
-                    self.eclog.error(e)
-                    self.MoveFilaedCase(case)
-                    continue
-
-                print('Extract Target Series: {}'.format(case))
-                try:
-                    is_work, message_one, message_two = self.ExtractSeries(case_folder, store_case_folder)
-                    if not is_work:
-                        self.log.AddOne(case, {'State': message_one, 'Info': message_two})
-                        self.MoveFilaedCase(case)
-                        continue
-                except Exception as e:
-                    self.log.AddOne(case, {'State': 'Series are crashed', 'Info': e.__str__()})
-                    self.eclog.error(e)
-                    self.MoveFilaedCase(case)
-                    continue
-
-                print('Seperate 4D Nii: {}'.format(case))
-                try:
-                    self.SeperateDWI(store_case_folder)
-                except Exception as e:
-                    self.log.AddOne(case, {'State': 'Seperate DWI failed.', 'Info': e.__str__()})
-                    self.eclog.error(e)
-                    self.MoveFilaedCase(case)
-                    continue
-
-                print('Registrate Different series: {}'.format(case))
-                try:
-                    is_work, message = self.RegistrateBySpacing(store_case_folder)
-                    if not is_work:
-                        self.log.AddOne(case, {'State': 'Registration failed. ', 'Info': message})
-                        self.MoveFilaedCase(case)
-                        continue
-                except Exception as e:
-                    self.log.AddOne(case, {'State': 'Registration failed.', 'Info': e.__str__()})
-                    self.eclog.error(e)
-                    self.MoveFilaedCase(case)
-                    continue
-
-                print('Segment Prostate: {}'.format(case))
-                try:
-                    self.SegmentProstate(store_case_folder)
-                except Exception as e:
-                    self.log.AddOne(case, {'State': 'Segment prostate failed.', 'Info': e.__str__()})
-                    self.eclog.error(e)
-                    self.MoveFilaedCase(case)
-                    continue
-
-                print('Detect PCa: {}'.format(case))
-                try:
-                    self.DetectProstateCancer(store_case_folder)
-                except Exception as e:
-                    self.log.AddOne(case, {'State': 'PCa detection failed.', 'Info': e.__str__()})
-                    self.eclog.error(e)
-                    self.MoveFilaedCase(case)
-                    continue
-
-            self.log.Save()
-
-            print('Sleep........ZZZ.........ZZZZ..........')
-            time.sleep(3600)
 
 def main():
     # raw_folder = r'data\temp_dicom'
@@ -205,7 +457,9 @@ def main():
     segment_model_folder = r'd:\SuccessfulModel\ProstateSegmentTrumpetNet'
     detect_model_folder = r'd:\SuccessfulModel\PCaDetectTrumpetNetBlurryROI1500QA_ZYD_Recheck_V1'
     processor = AutoProcessor(raw_folder, store_folder, failed_folder, segment_model_folder, detect_model_folder, is_overwrite=True)
-    processor.IterativeCase()
+    # num_workers > 1 时每个 worker 都加载一份分割和检测模型 (显存 x num_workers), 需要时再打开
+    processor.IterativeCase(num_workers=1)
+    # processor.WatchCase(num_workers=1, settle_time=60)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,23 +1,170 @@
 import os
+import gzip
+import multiprocessing
 import numpy as np
 import pandas as pd
 
-from BasicTool.MeDIT.SaveAndLoad import LoadImage
-
-data_folder = r'X:\StoreFormatData\ProstateCancerECE\ResampleData'
-store_path = r'C:\Users\ZhangYihong\Desktop\ProstateVolume.csv'
-case_list = os.listdir(data_folder)
-for case in case_list:
-    case_path = os.path.join(data_folder, case)
-    prostate_path = os.path.join(case_path, 'ProstateROI_TrumpetNet.nii.gz')
-    image, data, ref = LoadImage(prostate_path)
-    resolution = image.GetSpacing()
-    pixels = np.sum(data)
-    volume = pixels*resolution[0]*resolution[1]*resolution[2]
-    print(case)
-
-    # one_label_df = pd.DataFrame(volume, index=[case], columns=['volume'])
-    # if case == case_list[0]:
-    #     one_label_df.to_csv(store_path, mode='a+', header=True)
-    # else:
-    #     one_label_df.to_csv(store_path, mode='a+', header=False)
\ No newline at end of file
+# 整个队列的前列腺体积/病灶统计, 每个 case 一行写进同一个 csv (或 .parquet):
+#     spacing 只读 NIfTI 头; 前列腺 mask 按块解压, 每块只数非零体素并更新包围盒, 不把整个 volume 读进内存.
+#     病灶 (roi.nii) 要算连通域, 整个读进来, 见 DataProcess.Connectivity.
+# incremental=True 时已经在输出里并且文件没变 (mtime 一样) 的 case 跳过; mtime 存成整数的纳秒 (mtime_ns),
+# float 写进 csv 再读回来不一定相等.
+
+chunk_bytes = 1 << 22
+
+
+def _Open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _Header(path):
+    import nibabel as nib
+    header = nib.load(path).header
+    slope, inter = header.get_slope_inter()
+    return {'shape': header.get_data_shape()[:3], 'spacing': tuple(float(one) for one in header.get_zooms()[:3]),
+            'dtype': header.get_data_dtype(), 'offset': int(header['vox_offset']),
+            'slope': 1. if slope is None else float(slope), 'inter': 0. if inter is None else float(inter)}
+
+
+def MaskStatistics(path):
+    '''
+    按块解压统计 mask: 返回 spacing, 非零体素数, 体积 (mm^3), 包围盒 (x0, x1, y0, y1, z0, z1, 体素坐标, 不包含 x1).
+    '''
+    header = _Header(path)
+    nx, ny, nz = (list(header['shape']) + [1, 1])[:3]
+    dtype = header['dtype']
+    step = max(1, chunk_bytes // dtype.itemsize) * dtype.itemsize
+
+    count, low, high = 0, [nx, ny, nz], [-1, -1, -1]
+    offset = 0
+    rest = b''
+    with _Open(path) as file:
+        file.read(header['offset'])
+        while offset < nx * ny * nz:
+            block = file.read(step)
+            if not block:
+                break
+            block = rest + block
+            usable = len(block) // dtype.itemsize * dtype.itemsize
+            rest = block[usable:]
+            data = np.frombuffer(block[:usable], dtype=dtype)[:nx * ny * nz - offset]
+            if header['slope'] != 1. or header['inter'] != 0.:
+                data = data * header['slope'] + header['inter']
+            index = np.flatnonzero(data)
+            if len(index) > 0:
+                index += offset
+                count += len(index)
+                # NIfTI 里 x 变化最快
+                for axis, one in enumerate([index % nx, index // nx % ny, index // (nx * ny)]):
+                    low[axis] = min(low[axis], int(one.min()))
+                    high[axis] = max(high[axis], int(one.max()))
+            offset += len(data)
+
+    spacing = header['spacing']
+    bbox = [None] * 6 if count == 0 else [low[0], high[0] + 1, low[1], high[1] + 1, low[2], high[2] + 1]
+    return {'spacing': spacing, 'voxels': count, 'volume': count * spacing[0] * spacing[1] * spacing[2], 'bbox': bbox}
+
+
+def LesionStatistics(path, connectivity=26):
+    # 病灶体积/个数/每个病灶的包围盒 (体素坐标, 和 nibabel 的 x, y, z 顺序一样)
+    import nibabel as nib
+    from ECEDataProcess.DataProcess.Connectivity import LabelComponents, ComponentStats
+    image = nib.load(path)
+    spacing = image.header.get_zooms()[:3]
+    mask = np.asanyarray(image.dataobj)
+    mask = mask.reshape(mask.shape[:3]) != 0
+    stats = ComponentStats(*LabelComponents(mask, connectivity))
+    voxels = sum(one['volume'] for one in stats)
+    return {'lesion_voxels': voxels, 'lesion_volume': voxels * spacing[0] * spacing[1] * spacing[2],
+            'lesion_number': len(stats), 'lesion_bbox': [one['bbox'] for one in stats]}
+
+
+def _CaseStatistics(args):
+    case, case_folder, prostate_name, roi_name, connectivity = args
+    prostate_path = os.path.join(case_folder, prostate_name)
+    roi_path = os.path.join(case_folder, roi_name)
+    row = {'case': case, 'mtime_ns': _CaseMtime(prostate_path, roi_path), 'error': ''}
+    try:
+        stats = MaskStatistics(prostate_path)
+        row.update({'spacing_x': stats['spacing'][0], 'spacing_y': stats['spacing'][1],
+                    'spacing_z': stats['spacing'][2], 'voxels': stats['voxels'], 'volume': stats['volume']})
+        row.update(dict(zip(['x0', 'x1', 'y0', 'y1', 'z0', 'z1'], stats['bbox'])))
+        if os.path.exists(roi_path):
+            lesion = LesionStatistics(roi_path, connectivity)
+            lesion['lesion_bbox'] = str(lesion['lesion_bbox'])
+            row.update(lesion)
+    except Exception as e:
+        row['error'] = e.__str__()
+    return row
+
+
+def _CaseMtime(*path_list):
+    return max([os.stat(one).st_mtime_ns for one in path_list if os.path.exists(one)] + [0])
+
+
+def _Read(store_path):
+    if store_path.endswith('.parquet'):
+        return pd.read_parquet(store_path)
+    return pd.read_csv(store_path)
+
+
+def _Write(df, store_path):
+    if store_path.endswith('.parquet'):
+        df.to_parquet(store_path, index=False)
+    else:
+        df.to_csv(store_path, index=False)
+
+
+def ProstateVolume(data_folder, store_path, prostate_name='ProstateROI_TrumpetNet.nii.gz', roi_name='roi.nii',
+                   connectivity=26, num_workers=None, incremental=True):
+    '''
+    data_folder 下每个 case 一行: spacing / 前列腺体素数, 体积, 包围盒 / 病灶体积, 个数, 包围盒.
+    store_path 以 .parquet 结尾时写 parquet (需要 pyarrow), 否则写 csv.
+    '''
+    done = pd.DataFrame()
+    if incremental and os.path.exists(store_path):
+        done = _Read(store_path)
+        done = done[done['error'].fillna('') == '']
+        if 'mtime_ns' not in done.columns:
+            # 以前的输出存的是 float 的 mtime, 全部重算一次
+            done = pd.DataFrame()
+
+    args = []
+    for case in sorted(os.listdir(data_folder)):
+        case_folder = os.path.join(data_folder, case)
+        if not os.path.exists(os.path.join(case_folder, prostate_name)):
+            continue
+        if len(done) > 0:
+            known = done[done['case'] == case]
+            mtime = _CaseMtime(os.path.join(case_folder, prostate_name), os.path.join(case_folder, roi_name))
+            if len(known) > 0 and int(known['mtime_ns'].iloc[0]) == mtime:
+                continue
+        args.append((case, case_folder, prostate_name, roi_name, connectivity))
+    print('{} cases to do, {} already done'.format(len(args), len(done)))
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if num_workers > 1 and len(args) > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            rows = list(pool.imap_unordered(_CaseStatistics, args))
+    else:
+        rows = [_CaseStatistics(one) for one in args]
+
+    new_df = pd.DataFrame(rows)
+    if len(done) > 0 and len(new_df) > 0:
+        done = done[~done['case'].isin(new_df['case'])]
+    df = pd.concat([done, new_df], ignore_index=True, sort=False)
+    if len(df) == 0:
+        return df
+    df = df.sort_values('case').reset_index(drop=True)
+    _Write(df, store_path)
+    for one in rows:
+        if one['error'] != '':
+            print('{} failed: {}'.format(one['case'], one['error']))
+    return df
+
+
+if __name__ == '__main__':
+    data_folder = r'X:\StoreFormatData\ProstateCancerECE\ResampleData'
+    store_path = r'C:\Users\ZhangYihong\Desktop\ProstateVolume.csv'
+    ProstateVolume(data_folder, store_path)
@@ -122,6 +122,33 @@ def StatisticsMultiRoi2():
     print(roi_2_number, pirads_diff, ece_diff, same)
 
 
+def StatisticsComponent(process_folder, csv_store_path, connectivity=26, batch_size=16, num_workers=None):
+    '''
+    每个 case 的 roi*.nii 里每个病灶 (连通域) 一行: 体积/包围盒/重心, 多个线程一起算.
+    '''
+    from ECEDataProcess.DataProcess.Connectivity import ComponentStatsBatch
+
+    path_list = []
+    for case in sorted(os.listdir(process_folder)):
+        case_folder = os.path.join(process_folder, case)
+        for roi in ['roi.nii', 'roi0.nii', 'roi1.nii', 'roi2.nii']:
+            if os.path.exists(os.path.join(case_folder, roi)):
+                path_list.append((case, roi, os.path.join(case_folder, roi)))
+
+    rows = []
+    for start in range(0, len(path_list), batch_size):
+        batch = path_list[start:start + batch_size]
+        mask_list = [LoadNiiData(path)[1] for _, _, path in batch]
+        for (case, roi, _), stats in zip(batch, ComponentStatsBatch(mask_list, connectivity, num_workers)):
+            for one in stats:
+                rows.append({'case': case, 'roi': roi, 'label': one['label'], 'lesion number': len(stats),
+                             'volume': one['volume'], 'bbox': one['bbox'], 'centroid': one['centroid']})
+
+    df = pd.DataFrame(rows)
+    df.to_csv(csv_store_path, index=False)
+    return df
+
+
 if __name__ == '__main__':
     ShowOne()
 
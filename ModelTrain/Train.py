@@ -6,6 +6,8 @@ import time
 import sys
 import os
 
+from DataSet.LoaderFactory import DevicePrefetcher
+
 
 class Trainer():
     def __init__(self, model, model_type, loss_fn, optimizer, lr_schedule, log_batchs, train_data_loader, device=None,
@@ -31,6 +33,8 @@ class Trainer():
         self.best_loss = sys.float_info.max
         self.logger = logger
         self.writer = writer
+        # device 为 None 时在 CPU 上跑, 仍然用后台线程预取
+        self.prefetcher = DevicePrefetcher('cpu' if device is None else device, model=model)
 
     def fit(self):
         for epoch in range(0, self.start_epoch):
@@ -62,12 +66,9 @@ class Trainer():
         self.model.train()  # Set model to training mode
         losses = []
 
-        for i, (inputs, labels) in enumerate(self.train_data_loader):  # Notice
-            if self.device is not None:
-                inputs, labels = inputs.to(self.device), labels.to(self.device)
-                labels = labels.squeeze()
-            else:
-                labels = labels.squeeze()
+        self.prefetcher.Reset()
+        for i, (inputs, labels) in enumerate(self.prefetcher.Iterate(self.train_data_loader)):  # Notice
+            labels = labels.squeeze()
 
             self.optimizer.zero_grad()
 
@@ -84,6 +85,7 @@ class Trainer():
                             % (local_time_str, i, len(self.train_data_loader) - 1, batch_mean_loss)
                 self.logger.append(print_str)
             self.writer.add_scalar('loss/loss_c', batch_mean_loss, self.cur_epoch)
+        self.logger.append(str(self.prefetcher))
 
     def _backward(self, loss, loss_list):
         pass
@@ -92,12 +94,8 @@ class Trainer():
         self.model.eval()
         losses = []
         with torch.no_grad():  # Notice
-            for i, (inputs, labels) in enumerate(self.valid_data_loader):
-                if self.device:
-                    inputs, labels = inputs.to(self.device), labels.to(self.device)
-                    labels = labels.squeeze()
-                else:
-                    labels = labels.squeeze()
+            for i, (inputs, labels) in enumerate(self.prefetcher.Iterate(self.valid_data_loader)):
+                labels = labels.squeeze()
 
                 outputs = self.model(inputs)  # Notice
 
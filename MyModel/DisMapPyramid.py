@@ -0,0 +1,115 @@
+import time
+import torch
+import torch.nn.functional as F
+
+# DisMap 模型里每个 Bottleneck 都把 dis_map interpolate 到自己的大小, 但一次 forward 只有 4 个大小 (92/46/23/12),
+# ResNeXt 的 14 个 Bottleneck 就做了 14 次. DisMapPyramid 在一次 forward 里每个大小只算一次, 之后直接取.
+#     model(t2, adc, dwi, dis_map)                       forward 里自己建 (第一次用到某个大小时才算)
+#     model(t2, adc, dwi, DisMapPyramid(dis_map, ...))   外面建好, 比如同一个 case 给五个 fold 的模型用
+#     model(t2, adc, dwi, {(92, 92): ..., ...})          loader 里用 PyramidLevels 算好的, collate 以后是 dict
+# 每层的结果和原来的 F.interpolate(dis_map, size=shape, ...) 一样, 只是不重复算.
+
+
+class DisMapPyramid(object):
+    def __init__(self, dis_map=None, mode='bilinear', align_corners=None, levels=None):
+        self.dis_map = dis_map
+        self.mode = mode
+        self.align_corners = align_corners
+        self.levels = {} if levels is None else {tuple(shape): one for shape, one in levels.items()}
+        # 每次 Get 取到的字节数, Benchmark 用来算省下的显存
+        self.requested_bytes = 0
+
+    def Get(self, shape):
+        shape = tuple(shape)
+        if shape not in self.levels:
+            if self.dis_map is None:
+                raise KeyError('no level {} in the pyramid and no dis_map to build it'.format(shape))
+            self.levels[shape] = F.interpolate(self.dis_map, size=shape, mode=self.mode,
+                                               align_corners=self.align_corners)
+        one = self.levels[shape]
+        self.requested_bytes += one.numel() * one.element_size()
+        return one
+
+    def LevelBytes(self):
+        return sum(one.numel() * one.element_size() for one in self.levels.values())
+
+
+def AsPyramid(dis_map, mode='bilinear', align_corners=None):
+    # 模型 forward 开头调用: tensor 包成 DisMapPyramid, loader 给的 dict 当作算好的层, DisMapPyramid 原样返回
+    if isinstance(dis_map, DisMapPyramid):
+        return dis_map
+    if isinstance(dis_map, dict):
+        return DisMapPyramid(mode=mode, align_corners=align_corners, levels=dis_map)
+    return DisMapPyramid(dis_map, mode, align_corners)
+
+
+def ResizeDisMap(dis_map, shape, mode='bilinear', align_corners=None):
+    # Bottleneck 里代替 F.interpolate; 直接给 tensor 时和原来一样每次都算
+    if isinstance(dis_map, DisMapPyramid):
+        return dis_map.Get(shape)
+    return F.interpolate(dis_map, size=tuple(shape), mode=mode, align_corners=align_corners)
+
+
+def PyramidShapes(input_shape, stride_list=(2, 1, 2, 2, 2)):
+    # conv1 以后 maxpool (stride 2), layer1 (stride 1), layer2-4 (stride 2), 都是 kernel 3 padding 1:
+    # (184, 184) -> [(92, 92), (92, 92), (46, 46), (23, 23), (12, 12)] 去重以后的 4 个大小
+    shape_list, shape = [], tuple(input_shape)
+    for stride in stride_list:
+        shape = tuple((one - 1) // stride + 1 for one in shape)
+        if shape not in shape_list:
+            shape_list.append(shape)
+    return shape_list
+
+
+def PyramidLevels(dis_map, shape_list, mode='bilinear', align_corners=None):
+    '''
+    在 DataLoader 的 worker 里给一个样本 (1, H, W) 算好每一层, 返回 {shape: (1, h, w)}, collate 以后直接给模型.
+    '''
+    dis_map = torch.as_tensor(dis_map, dtype=torch.float32)[None]
+    return {tuple(shape): F.interpolate(dis_map, size=tuple(shape), mode=mode, align_corners=align_corners)[0]
+            for shape in shape_list}
+
+
+def BenchmarkPyramid(model, inputs, dis_map, repeat=10, train=False):
+    '''
+    model.dis_map_pyramid 为 False (每个 Bottleneck 自己 interpolate) 和 True 的 forward 时间;
+    train=True 时包括 backward. 返回 {'legacy': 秒, 'pyramid': 秒, 'legacy_bytes', 'pyramid_bytes', 'max_error'}:
+    bytes 是 interpolate 出来的 dis_map 一共占的字节数, train 时这些都被 autograd 留到 backward.
+    CUDA 上同时记录显存峰值 (legacy_peak / pyramid_peak).
+    '''
+    device = dis_map.device
+    model.train(train)
+    result = {}
+    for name, use_pyramid in [('legacy', False), ('pyramid', True)]:
+        model.dis_map_pyramid = use_pyramid
+        for index in range(repeat + 1):
+            if index == 1:
+                # 第一次是 warm up
+                if device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                    torch.cuda.reset_peak_memory_stats(device)
+                start = time.perf_counter()
+            pyramid = DisMapPyramid(dis_map, model.dis_map_mode, model.dis_map_align_corners)
+            with torch.set_grad_enabled(train):
+                prediction = model(*inputs, pyramid if use_pyramid else dis_map)
+                if train:
+                    prediction.sum().backward()
+                    model.zero_grad()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            result[name + '_peak'] = torch.cuda.max_memory_allocated(device)
+        result[name] = (time.perf_counter() - start) / repeat
+        if use_pyramid:
+            # 一个 pyramid: 每个 Bottleneck 取的总量就是原来 interpolate 出来的总量
+            result['legacy_bytes'] = pyramid.requested_bytes
+            result['pyramid_bytes'] = pyramid.LevelBytes()
+
+    # eval 下两种结果应该一样 (train 时有 dropout, 不比较)
+    model.eval()
+    with torch.no_grad():
+        model.dis_map_pyramid = False
+        legacy = model(*inputs, dis_map)
+        model.dis_map_pyramid = True
+        pyramid = model(*inputs, dis_map)
+    result['max_error'] = float((legacy - pyramid).abs().max())
+    return result
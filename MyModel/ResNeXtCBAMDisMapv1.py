@@ -6,6 +6,7 @@ import torch.nn.functional as F
 import torch
 
 from MyModel.Block import conv1x1, conv3x3
+from MyModel.DisMapPyramid import AsPyramid, ResizeDisMap
 
 '''
 v1: all layers add distance map
@@ -108,7 +109,7 @@ class Bottleneck(nn.Module):
         out = self.bn3(out)
 
         shape = out.shape[2:]
-        dis_map_resize = F.interpolate(dis_map, size=shape, mode='bilinear')
+        dis_map_resize = ResizeDisMap(dis_map, shape, mode='bilinear')
 
         out = self.ca(out) * out
         out_fm = self.sa_fm(out) * out
@@ -209,6 +210,10 @@ class ResNeXt(nn.Module):
         """
         super(ResNeXt, self).__init__()
 
+        # dis_map 每个大小在一次 forward 里只 interpolate 一次, 见 MyModel.DisMapPyramid
+        self.dis_map_mode, self.dis_map_align_corners = 'bilinear', None
+        self.dis_map_pyramid = True
+
         self.cardinality = cardinality
         self.baseWidth = baseWidth
         self.num_classes = num_classes
@@ -235,6 +240,8 @@ class ResNeXt(nn.Module):
                 m.bias.data.zero_()
 
     def forward(self, inputs, dis_map):
+        if self.dis_map_pyramid:
+            dis_map = AsPyramid(dis_map, self.dis_map_mode, self.dis_map_align_corners)
         x = self.conv1(inputs)  # shape = (184, 184)
         x = self.bn1(x)
         x = self.relu(x)
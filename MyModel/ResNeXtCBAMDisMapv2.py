@@ -5,6 +5,7 @@ import torch.nn.functional as F
 import torch
 
 from MyModel.Block import conv1x1
+from MyModel.DisMapPyramid import AsPyramid, ResizeDisMap
 
 
 '''
@@ -104,7 +105,7 @@ class DisBottleneck(nn.Module):
         out = self.bn3(out)
 
         shape = out.shape[2:]
-        dis_map_resize = F.interpolate(dis_map, size=shape, mode='bilinear')
+        dis_map_resize = ResizeDisMap(dis_map, shape, mode='bilinear')
 
         out = self.ca(out) * out
         out_fm = self.sa_fm(out) * out
@@ -268,6 +269,10 @@ class ResNeXt(nn.Module):
         """
         super(ResNeXt, self).__init__()
 
+        # dis_map 每个大小在一次 forward 里只 interpolate 一次, 见 MyModel.DisMapPyramid
+        self.dis_map_mode, self.dis_map_align_corners = 'bilinear', None
+        self.dis_map_pyramid = True
+
         self.cardinality = cardinality
         self.baseWidth = baseWidth
         self.num_classes = num_classes
@@ -294,6 +299,8 @@ class ResNeXt(nn.Module):
                 m.bias.data.zero_()
 
     def forward(self, inputs, dis_map):
+        if self.dis_map_pyramid:
+            dis_map = AsPyramid(dis_map, self.dis_map_mode, self.dis_map_align_corners)
         x = self.conv1(inputs)
         x = self.bn1(x)
         x = self.relu(x)
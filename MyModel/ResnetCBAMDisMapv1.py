@@ -8,6 +8,7 @@ import torch
 import matplotlib.pyplot as plt
 
 from MyModel.Block import conv1x1, conv3x3
+from MyModel.DisMapPyramid import AsPyramid, ResizeDisMap
 
 
 '''
@@ -101,7 +102,7 @@ class DisBottleneck(nn.Module):
         # plt.imshow(torch.squeeze(out)[0, ...].cpu().detach(), cmap='gray')
 
         shape = out.shape[2:]
-        dis_map_resize = F.interpolate(dis_map, size=shape, mode='bilinear')
+        dis_map_resize = ResizeDisMap(dis_map, shape, mode='bilinear')
         # plt.subplot(236)
         # plt.title('dm')
         # plt.imshow(torch.squeeze(dis_map_resize).cpu().detach(), cmap='gray')
@@ -277,6 +278,10 @@ class ResNet(nn.Module):
         """
         super(ResNet, self).__init__()
 
+        # dis_map 每个大小在一次 forward 里只 interpolate 一次, 见 MyModel.DisMapPyramid
+        self.dis_map_mode, self.dis_map_align_corners = 'bilinear', None
+        self.dis_map_pyramid = True
+
         self.cardinality = cardinality
         self.baseWidth = baseWidth
         self.num_classes = num_classes
@@ -303,6 +308,8 @@ class ResNet(nn.Module):
                 m.bias.data.zero_()
 
     def forward(self, inputs, dis_map):
+        if self.dis_map_pyramid:
+            dis_map = AsPyramid(dis_map, self.dis_map_mode, self.dis_map_align_corners)
         x = self.conv1(inputs)  # shape = (184, 184)
         x = self.bn1(x)
         x = self.relu(x)
@@ -6,6 +6,7 @@ from torch.nn import init
 import torch
 
 from MyModel.Block import conv1x1, conv3x3
+from MyModel.DisMapPyramid import AsPyramid, ResizeDisMap
 
 
 '''
@@ -99,7 +100,7 @@ class Bottleneck(nn.Module):
         out = self.bn3(out)
 
         shape = out.shape[2:]
-        dis_map_resize = F.interpolate(dis_map, size=shape, mode='nearest')
+        dis_map_resize = ResizeDisMap(dis_map, shape, mode='nearest')
 
         out = self.ca(out) * out
         out_fm = self.sa(out) * out
@@ -200,6 +201,10 @@ class ResNeXt(nn.Module):
         """
         super(ResNeXt, self).__init__()
 
+        # dis_map 每个大小在一次 forward 里只 interpolate 一次, 见 MyModel.DisMapPyramid
+        self.dis_map_mode, self.dis_map_align_corners = 'nearest', None
+        self.dis_map_pyramid = True
+
         self.cardinality = cardinality
         self.baseWidth = baseWidth
         self.num_classes = num_classes
@@ -228,6 +233,8 @@ class ResNeXt(nn.Module):
                 m.bias.data.zero_()
 
     def forward(self, inputs, dis_map):
+        if self.dis_map_pyramid:
+            dis_map = AsPyramid(dis_map, self.dis_map_mode, self.dis_map_align_corners)
         x = self.conv1(inputs)  # shape = (184, 184)
         x = self.bn1(x)
         x = self.relu(x)
@@ -10,6 +10,7 @@ from SSHProject.BasicTool.MeDIT.Others import IterateCase
 from Metric.classification_statistics import get_auc, draw_roc
 
 from Metric.MyMetric import BinaryClassification
+from DataSet.LoaderFactory import MakeLoader, EpochSeed, DevicePrefetcher
 
 
 param_config = {
@@ -28,7 +29,7 @@ param_config = {
 }
 
 
-def EnhancedTestSUH(is_dismap=True, param=None):
+def EnhancedTestSUH(is_dismap=True, param=None, epoch_seed=None):
     data_root = r'/home/zhangyihong/Documents/ProstateECE/SUH_Dwi1500'
     input_shape = (192, 192)
     batch_size = 2
@@ -42,7 +43,8 @@ def EnhancedTestSUH(is_dismap=True, param=None):
         data.AddOne(Label(data_root + '/label_negative.csv', label_tag='Negative'), is_input=False)
     else:
         data.AddOne(Label(data_root + '/label_negative.csv', label_tag='Positive'), is_input=False)
-    data_loader = DataLoader(data, batch_size=batch_size, shuffle=False)
+    data_loader = MakeLoader(data, batch_size=batch_size, shuffle=False, persistent_workers=False,
+                             epoch_seed=epoch_seed)
     return data_loader
 
 
@@ -81,13 +83,11 @@ def ModelEnhancedSUH(weights_list=None, is_dismap=True):
             print(i)
             pred_list, label_list = [], []
             if i == 0:
-                data_loader = EnhancedTestSUH(is_dismap, param_config)
+                data_loader = EnhancedTestSUH(is_dismap, param_config, EpochSeed(seed=cv_index))
             else:
                 data_loader = EnhancedTestSUH(is_dismap)
 
-            for inputs, outputs in data_loader:
-                inputs = MoveTensorsToDevice(inputs, device)
-                outputs = MoveTensorsToDevice(outputs, device)
+            for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
                 preds = model(*inputs)[:, 1]
                 if isinstance((1 - preds).cpu().data.numpy().squeeze().tolist(), float):
                     if is_dismap:
@@ -121,7 +121,7 @@ def ModelEnhancedSUH(weights_list=None, is_dismap=True):
     return mean_pred, mean_label
 
 
-def EnhancedTestJSPH(is_dismap=True, data_type='test', param=None):
+def EnhancedTestJSPH(is_dismap=True, data_type='test', param=None, epoch_seed=None):
     data_root = r'/home/zhangyihong/Documents/ProstateECE/NPYNoDivide'
     input_shape = (192, 192)
     batch_size = 2
@@ -147,7 +147,8 @@ def EnhancedTestJSPH(is_dismap=True, data_type='test', param=None):
             data.AddOne(Label(data_root + '/label.csv', label_tag='Negative'), is_input=False)
         else:
             data.AddOne(Label(data_root + '/label.csv', label_tag='Positive'), is_input=False)
-    data_loader = DataLoader(data, batch_size=batch_size, shuffle=False)
+    data_loader = MakeLoader(data, batch_size=batch_size, shuffle=False, persistent_workers=False,
+                             epoch_seed=epoch_seed)
     return data_loader
 
 
@@ -184,13 +185,11 @@ def ModelEnhancedJSPH(weights_list=None, is_dismap=True, data_type='test'):
             print(i)
             pred_list, label_list = [], []
             if i == 0:
-                data_loader = EnhancedTestJSPH(is_dismap, data_type, param_config)
+                data_loader = EnhancedTestJSPH(is_dismap, data_type, param_config, EpochSeed(seed=cv_index))
             else:
                 data_loader = EnhancedTestJSPH(is_dismap, data_type)
 
-            for inputs, outputs in data_loader:
-                inputs = MoveTensorsToDevice(inputs, device)
-                outputs = MoveTensorsToDevice(outputs, device)
+            for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
                 preds = model(*inputs)[:, 1]
                 if is_dismap:
@@ -9,6 +9,7 @@ from SSHProject.BasicTool.MeDIT.Others import IterateCase
 from Metric.classification_statistics import get_auc, draw_roc
 # from Metric.MyMetric import BinaryClassification
 from SSHProject.BasicTool.MeDIT.Statistics import BinaryClassification
+from DataSet.LoaderFactory import DevicePrefetcher
 
 
 def ModelJSPH(weights_list=None, is_dismap=True, data_type='test', store_path=r''):
@@ -71,9 +72,7 @@ def ModelJSPH(weights_list=None, is_dismap=True, data_type='test', store_path=r'
 
         pred_list, label_list = [], []
         model.eval()
-        for inputs, outputs in data_loader:
-            inputs = MoveTensorsToDevice(inputs, device)
-            outputs = MoveTensorsToDevice(outputs, device)
+        for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
             preds = model(*inputs)[:, 1]
             if is_dismap:
@@ -144,9 +143,7 @@ def ModelSUH(weights_list=None, is_dismap=True, store_path=r''):
 
         pred_list, label_list = [], []
         model.eval()
-        for inputs, outputs in data_loader:
-            inputs = MoveTensorsToDevice(inputs, device)
-            outputs = MoveTensorsToDevice(outputs, device)
+        for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
             preds = model(*inputs)[:, 1]
 
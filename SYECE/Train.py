@@ -13,6 +13,9 @@ from SSHProject.CnnTools.T4T.Utility.Initial import HeWeightInit
 
 # from SYECE.path_config import model_root, data_root
 from SYECE.ModelWithoutDis import ResNeXt
+from DataSet.LoaderFactory import MakeLoader, EpochSeed, DevicePrefetcher
+from DataSet.BatchAugment import BatchAugment
+from DataSet.CohortCache import CohortCache
 # from SYECE.model import ResNeXt
 
 model_root = r'/home/zhangyihong/Documents/ProstateECE/Model'
@@ -27,7 +30,11 @@ def ClearGraphPath(graph_path):
         os.mkdir(graph_path)
 
 
-def _GetLoader(sub_list, aug_param_config, input_shape, batch_size, shuffle):
+def _GetLoader(sub_list, aug_param_config, input_shape, batch_size, shuffle, epoch_seed=None, cache=None):
+    if cache is not None:
+        return cache.GetLoader(sub_list, ['T2Slice', 'AdcSlice', 'DwiSlice'], 'Positive',
+                               input_shape, batch_size, shuffle, aug_param_config, epoch_seed=epoch_seed)
+
     data = DataManager(sub_list=sub_list, augment_param=aug_param_config)
 
     data.AddOne(Image2D(data_root + '/T2Slice', shape=input_shape))
@@ -38,12 +45,12 @@ def _GetLoader(sub_list, aug_param_config, input_shape, batch_size, shuffle):
     data.Balance(Label(data_root + '/label.csv', label_tag='Positive'))
     # data.AddOne(Label(data_root + '/label.csv'), is_input=False)
     # data.Balance(Label(data_root + '/label.csv'))
-    loader = DataLoader(data, batch_size=batch_size, shuffle=shuffle)
+    loader = MakeLoader(data, batch_size=batch_size, shuffle=shuffle, epoch_seed=epoch_seed)
     batches = np.ceil(len(data.indexes) / batch_size)
     return loader, batches
 
 
-def EnsembleTrain():
+def EnsembleTrain(is_batch_augment=False, use_cache=False):
     torch.autograd.set_detect_anomaly(True)
 
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
@@ -68,15 +75,28 @@ def EnsembleTrain():
         ElasticTransform.name: ['elastic', 1, 0.1, 256]
     }
 
+    # is_batch_augment: 在 device 上对整个 batch 做增强, DataManager 不再逐样本增强
+    is_roi_list = [False, False, False]
+    augmentor = BatchAugment(param_config) if is_batch_augment else None
+    loader_param_config = None if is_batch_augment else param_config
+
+    cache = CohortCache(data_root) if use_cache else None
+
     spliter = DataSpliter()
     cv_generator = spliter.SplitLabelCV(data_root + '/ece.csv', store_root=model_folder)
     for cv_index, (sub_train, sub_val) in enumerate(cv_generator):
         sub_model_folder = MakeFolder(model_folder / 'CV_{}'.format(cv_index))
-        train_loader, train_batches = _GetLoader(sub_train, param_config, input_shape, batch_size, True)
-        val_loader, val_batches = _GetLoader(sub_val, param_config, input_shape, batch_size, True)
+        # train / val 共用 epoch 计数, 但各自一个 stream, 不会重复同样的随机数
+        epoch_seed = EpochSeed(seed=cv_index)
+        train_loader, train_batches = _GetLoader(sub_train, loader_param_config, input_shape, batch_size, True,
+                                                 epoch_seed.Stream(0), cache)
+        val_loader, val_batches = _GetLoader(sub_val, loader_param_config, input_shape, batch_size, True,
+                                             epoch_seed.Stream(1), cache)
 
         model = ResNeXt(3, 2).to(device)
         model.apply(HeWeightInit)
+        timer = DevicePrefetcher(device, model=model)
+        val_prefetcher = DevicePrefetcher(device, model=model)
 
         optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
         # criterion = torch.nn.BCELoss()
@@ -90,14 +110,16 @@ def EnsembleTrain():
 
         for epoch in range(total_epoch):
             train_loss, val_loss = 0., 0.
+            epoch_seed.SetEpoch(epoch)
+            timer.Reset()
 
             model.train()
             pred_list, label_list = [], []
-            for ind, (inputs, outputs) in enumerate(train_loader):
+            for ind, (inputs, outputs) in enumerate(timer.Iterate(train_loader)):
                 optimizer.zero_grad()
 
-                inputs = MoveTensorsToDevice(inputs, device)
-                outputs = MoveTensorsToDevice(outputs, device)
+                if augmentor is not None:
+                    inputs = augmentor(inputs, is_roi_list)
 
                 preds = model(*inputs)
 
@@ -116,9 +138,9 @@ def EnsembleTrain():
             model.eval()
             pred_list, label_list = [], []
             with torch.no_grad():
-                for ind, (inputs, outputs) in enumerate(val_loader):
-                    inputs = MoveTensorsToDevice(inputs, device)
-                    outputs = MoveTensorsToDevice(outputs, device)
+                for ind, (inputs, outputs) in enumerate(val_prefetcher.Iterate(val_loader)):
+                    if augmentor is not None:
+                        inputs = augmentor(inputs, is_roi_list)
 
                     preds = model(*inputs)
 
@@ -142,11 +164,16 @@ def EnsembleTrain():
             writer.add_scalars('Auc',
                                {'train_auc': train_auc,
                                 'val_auc': val_auc}, epoch + 1)
+            writer.add_scalars('Time',
+                               {'data_wait': timer.wait_time,
+                                'data_overlapped': timer.Summary()['overlapped'],
+                                'train_epoch': timer.total_time}, epoch + 1)
 
             print('Epoch {}: loss: {:.3f}, val-loss: {:.3f}, auc: {:.3f}, val-auc: {:.3f}'.format(
                 epoch + 1, train_loss / train_batches, val_loss / val_batches,
                 train_auc, val_auc
             ))
+            print(timer)
 
             scheduler.step(val_loss)
             early_stopping(val_loss, model, (epoch + 1, val_loss))
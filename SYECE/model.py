@@ -6,6 +6,7 @@ import torch.nn.functional as F
 import torch
 
 from MyModel.Block import conv1x1, conv3x3
+from MyModel.DisMapPyramid import AsPyramid, ResizeDisMap
 from T4T.Block.ConvBlock import ConvBn2D
 
 '''
@@ -108,7 +109,7 @@ class Bottleneck(nn.Module):
         out = self.bn3(out)
 
         shape = out.shape[2:]
-        dis_map_resize = F.interpolate(dis_map, size=shape, mode='bilinear', align_corners=True)
+        dis_map_resize = ResizeDisMap(dis_map, shape, mode='bilinear', align_corners=True)
 
         out = self.ca(out) * out
         out_fm = self.sa_fm(out) * out
@@ -208,6 +209,10 @@ class ResNeXt(nn.Module):
         """
         super(ResNeXt, self).__init__()
 
+        # dis_map 每个大小在一次 forward 里只 interpolate 一次, 见 MyModel.DisMapPyramid
+        self.dis_map_mode, self.dis_map_align_corners = 'bilinear', True
+        self.dis_map_pyramid = True
+
         self.conv1 = ConvBn2D(in_channels, inplanes)
         self.maxpool1 = nn.MaxPool2d(kernel_size=3, stride=2, padding=1)
 
@@ -231,6 +236,8 @@ class ResNeXt(nn.Module):
                 m.bias.data.zero_()
 
     def forward(self, t2, adc, dwi, dis_map):
+        if self.dis_map_pyramid:
+            dis_map = AsPyramid(dis_map, self.dis_map_mode, self.dis_map_align_corners)
         inputs = torch.cat([t2, adc, dwi], dim=1)
         x = self.conv1(inputs)
         x = self.maxpool1(x)  # shape = (92, 92)
@@ -248,6 +255,28 @@ class ResNeXt(nn.Module):
         # return x
 
 
+def Benchmark(batch_size_list=(24, 1), input_shape=(184, 184), repeat=10, train=True, device=None):
+    # 每个 Bottleneck 自己 interpolate vs. 每次 forward 建一次 DisMapPyramid
+    from MyModel.DisMapPyramid import BenchmarkPyramid
+    if device is None:
+        device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+    model = ResNeXt(3, 2).to(device)
+    result_list = []
+    for batch_size in batch_size_list:
+        inputs = [torch.randn(batch_size, 1, *input_shape, device=device) for _ in range(3)]
+        dis_map = torch.rand(batch_size, 1, *input_shape, device=device)
+        result = BenchmarkPyramid(model, inputs, dis_map, repeat=repeat, train=train)
+        print('batch {:>2}: legacy {:.4f}s, pyramid {:.4f}s, interpolated dis_map {:.2f} MB -> {:.2f} MB, '
+              'max error {:.2e}'.format(batch_size, result['legacy'], result['pyramid'],
+                                        result['legacy_bytes'] / 2 ** 20, result['pyramid_bytes'] / 2 ** 20,
+                                        result['max_error']))
+        if 'legacy_peak' in result:
+            print('          peak memory {:.1f} MB -> {:.1f} MB'.format(result['legacy_peak'] / 2 ** 20,
+                                                                      result['pyramid_peak'] / 2 ** 20))
+        result_list.append(result)
+    return result_list
+
+
 if __name__ == '__main__':
     device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
     model = ResNeXt(3, num_classes=2).to(device)
@@ -10,6 +10,7 @@ from SYECE.ModelWithoutDis import ResNeXt
 
 from SSHProject.BasicTool.MeDIT.Statistics import BinaryClassification
 from SSHProject.BasicTool.MeDIT.Others import IterateCase
+from DataSet.LoaderFactory import DevicePrefetcher
 
 from GradCam.demo import demo_my
 
@@ -59,9 +60,7 @@ def EnsembleInference(data_type, weights_list=None):
         pred_list, label_list = [], []
         fcn_out_list = []
         model.eval()
-        for inputs, outputs in data_loader:
-            inputs = MoveTensorsToDevice(inputs, device)
-            outputs = MoveTensorsToDevice(outputs, device)
+        for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
             model_pred = model(*inputs)
             preds = model_pred[0][:, 1]
@@ -149,9 +148,7 @@ def ModelTest(weights_list=None, data_type=None):
 
             pred_list, label_list = [], []
             model.eval()
-            for inputs, outputs in data_loader:
-                inputs = MoveTensorsToDevice(inputs, device)
-                outputs = MoveTensorsToDevice(outputs, device)
+            for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
                 preds = model(*inputs)[:, 1]
                 pred_list.extend((1 - preds).cpu().data.numpy().squeeze().tolist())
@@ -222,9 +219,7 @@ def ModelSUH(weights_list=None):
         pred_list, label_list = [], []
         fcn_out_list = []
         model.eval()
-        for inputs, outputs in data_loader:
-            inputs = MoveTensorsToDevice(inputs, device)
-            outputs = MoveTensorsToDevice(outputs, device)
+        for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
             # preds = model(*inputs)[:, 1]
             model_pred = model(*inputs)
@@ -314,9 +309,7 @@ def ROCofModels(weights_list=None, data_type=['alltrain', 'test']):
 
             pred_list, label_list = [], []
             model.eval()
-            for inputs, outputs in data_loader:
-                inputs = MoveTensorsToDevice(inputs, device)
-                outputs = MoveTensorsToDevice(outputs, device)
+            for inputs, outputs in DevicePrefetcher(device, model=model).Iterate(data_loader):
 
                 preds = model(*inputs)[:, 1]
                 pred_list.extend((1 - preds).cpu().data.numpy().squeeze().tolist())